@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+
+def group_means(grouped, column, groups):
+    """
+    Vectorized version of utilities.compute_mean_dict: the mean of a column per group, as a rounded percentage
+
+    :param grouped: the grouped dataframe (e.g. AnswerDataset.all_trials_by_level)
+    :param column: the column to average
+    :param groups: the groups to report, in order (groups without answers get NaN)
+    :return: dictionary of group -> mean percentage
+    """
+    means = grouped[column].mean().reindex(groups)
+    return {group: round(value * 100) if not np.isnan(value) else np.nan for group, value in means.items()}
+
+
+def group_values(grouped, column, groups):
+    """
+    The values of a column per group (e.g. for violin plots), in one pass over the groups
+
+    :param grouped: the grouped dataframe
+    :param column: the column of interest
+    :param groups: the groups to report, in order
+    :return: dictionary of group -> array of values (empty for groups without answers)
+    """
+    indices = grouped.indices
+    values = grouped.obj[column].to_numpy()
+    return {group: values[indices[group]] if group in indices else values[:0] for group in groups}
+
+
+def accuracy_histogram(grouped_by_subject, n_trials, column="Is.correct"):
+    """
+    The number of participants per accuracy value (over all their completed puzzles)
+
+    :param grouped_by_subject: the answers grouped per participant
+    :param n_trials: the number of trials, which defines the possible accuracy values
+    :param column: the column with the correctness (0 or 1) of each answer
+    :return: dictionary of accuracy (%) -> number of participants, for all possible accuracy values
+    """
+    accuracies = grouped_by_subject[column].sum() / grouped_by_subject.size() * 100
+    return accuracies.value_counts().reindex([x / n_trials * 100 for x in range(n_trials + 1)], fill_value=0).to_dict()
+
+
+def count_histogram(grouped_by_subject):
+    """
+    The number of participants per number of completed puzzles
+
+    :param grouped_by_subject: the answers grouped per participant
+    :return: dictionary of number of completed puzzles -> number of participants
+    """
+    return grouped_by_subject.size().value_counts().to_dict()
+
+
+def bin_answers(answers, bins, weights=None):
+    """
+    Histogram of numerical answers over the intervals (bins[i - 1], bins[i]]; answers outside all intervals are not
+    counted
+
+    :param answers: list, array or series of answers (numbers or strings of numbers)
+    :param bins: sorted array with the extrema of the intervals
+    :param weights: optional number of times each answer was given (e.g. when the answers are already counted)
+    :return: dictionary of interval label -> number of answers
+    """
+    answers = pd.to_numeric(pd.Series(answers)).to_numpy()
+    bin_idx = np.searchsorted(bins, answers, side="left")
+    in_range = (bin_idx > 0) & (bin_idx < len(bins))
+    counts = np.bincount(bin_idx[in_range], minlength=len(bins),
+                         weights=None if weights is None else np.asarray(weights)[in_range]).astype(int)
+    return {f"({bins[idx - 1]}, {bins[idx]}]": int(counts[idx]) for idx in range(1, len(bins))}
@@ -1,18 +1,26 @@
 import pandas as pd
 import numpy as np
-import re
-from statistics import mean, median
 from collections import Counter
-from utilities import translate_answer, compute_mean_dict, plot_bar, plot_multiple_bars_per_level, plot_violin
+from utilities import render_figures
+from aggregation import group_means, group_values, accuracy_histogram, count_histogram, bin_answers
+# the answer codec and the figure cache are shared with the modeling code (see utilities.MODELING_DIR)
+from answer_codec import ANSWERS, N_CODES, SPECIAL_ANSWERS, encode_answers, count_codes
+from plot_cache import memoize
+from dataset import AnswerDataset
 
+# ToM orders and scenarios, in the order in which they are plotted
+LEVELS = [1, 2, 3, 4]
+SCENARIOS = ["birthday", "hair", "drink", "toy"]
 
-def get_form_data():
+
+def get_form_data(dataset):
     """
     Aggregate all answers to the background form and write to txt
+
+    :param dataset: the AnswerDataset
     """
     # background form answers are unique per participant
-    df = pd.read_csv("All answers_all.csv")
-    df.drop_duplicates(subset=['Subject id'], inplace=True)
+    df = dataset.form_answers
 
     f = open("plots/form_data.txt", "w")
     text = ""
@@ -65,179 +73,259 @@ def get_form_data():
     f.close()
 
 
-def plot_accuracy_per_order_and_scenario(orientation="vertical"):
+def get_accuracy_data(dataset):
     """
     For each ToM order and scenario, compute the mean accuracy as
                 # of correct answers/ # of answers
 
+    :param dataset: the AnswerDataset
+    :return: dictionary of ToM order -> accuracy, and dictionary of scenario -> accuracy (sorted by accuracy)
+    """
+    # for each ToM order (level) and each scenario (only the second block), compute the accuracy
+    dict_tom_means = group_means(dataset.all_trials_by_level, "Is.correct", LEVELS)
+    # for readability, sort scenario dict by value
+    dict_scenario_means = dict(sorted(group_means(dataset.all_trials_by_scenario, "Is.correct", SCENARIOS).items(),
+                                      key=lambda item: item[1], reverse=True))
+    return dict_tom_means, dict_scenario_means
+
+
+def get_accuracy_figures(dataset, orientation="vertical"):
+    """
+    Bar plots of the mean accuracy for each ToM order and scenario (see get_accuracy_data)
+
+    :param dataset: the AnswerDataset
     :param orientation: if "vertical" then creates vertical bars, if "horizontal" then creates horizontal bars
+    :return: list of figures, as (plotting function, arguments, keyword arguments) (see utilities.render_figure)
     """
-    df = pd.read_csv("All answers_puzzles all trials.csv")
-    dict_tom = {1: [], 2: [], 3: [], 4: []}
-    dict_scenario = {"birthday": [], "hair": [], "drink": [], "toy": []}
+    dict_tom_means, dict_scenario_means = memoize(get_accuracy_data, dataset)
 
-    # for each ToM order (level) and each scenario, check whether answer is correct
-    for (idx, row) in df.iterrows():
-        dict_tom[row["Level"]].append(row["Is.correct"])
-        if row["Block"] == 2:
-            dict_scenario[row["Scenario"]].append(row["Is.correct"])
+    return [("plot_bar", (list(dict_tom_means.values()), list(dict_tom_means.keys()), "Accuracy per ToM Order",
+                          "Accuracy (%) over the 8 puzzles", "ToM order", (1, len(dict_tom_means)), (0, 100)),
+             dict(title_save_file="plots_paper/acc_per_order", orientation=orientation, rotation_x=0,
+                  chance_x=1 / 12 * 100, bar_size=0.3)),
+            ("plot_bar", (list(dict_scenario_means.values()), list(dict_scenario_means.keys()), "Accuracy per Scenario",
+                          "Accuracy (%) over the 8 puzzles", "Scenario", (0, len(dict_scenario_means) - 1), (0, 100)),
+             dict(title_save_file="plots_paper/acc_per_scen", orientation=orientation, rotation_x=0,
+                  chance_x=1 / 12 * 100, bar_size=0.3, rotation_y=45))]
+
+
+def plot_accuracy_per_order_and_scenario(dataset, orientation="vertical"):
+    """
+    Plot the mean accuracy for each ToM order and scenario (see get_accuracy_figures)
+
+    :param dataset: the AnswerDataset
+    :param orientation: if "vertical" then creates vertical bars, if "horizontal" then creates horizontal bars
+    """
+    render_figures(get_accuracy_figures(dataset, orientation=orientation))
 
-    dict_tom_means = compute_mean_dict(dict_tom)
-    # for readability, sort scenario dict by value
-    dict_scenario_means = dict(sorted(compute_mean_dict(dict_scenario).items(), key=lambda item: item[1], reverse=True))
 
-    plot_bar(list(dict_tom_means.values()), list(dict_tom_means.keys()), "Accuracy per ToM Order", "Accuracy (%) over the 8 puzzles", "ToM order",
-             (1, len(dict_tom_means)), (0, 100), title_save_file="plots_paper/acc_per_order", orientation=orientation,
-             rotation_x=0, chance_x=1 / 12 * 100, bar_size=0.3)
-    plot_bar(list(dict_scenario_means.values()), list(dict_scenario_means.keys()), "Accuracy per Scenario", "Accuracy (%) over the 8 puzzles", "Scenario",
-             (0, len(dict_scenario_means) - 1), (0, 100), title_save_file="plots_paper/acc_per_scen", orientation=orientation,
-             rotation_x=0, chance_x=1 / 12 * 100, bar_size=0.3, rotation_y=45)
+def get_accuracy_per_participant_data(dataset):
+    """
+    For each participant, compute the mean accuracy over all completed puzzles
+
+    :param dataset: the AnswerDataset
+    :return: dictionary of accuracy (%) -> number of participants
+    """
+    return accuracy_histogram(dataset.all_trials_by_subject, n_trials=8)
 
 
-def plot_accuracy_per_participant():
+def get_accuracy_per_participant_figures(dataset):
     """
-    For each participant, compute the mean accuracy over all completed puzzles. Then, plot the frequency of the
-    accuracy values in a bar plot.
+    Plot the frequency of the mean accuracy values of the participants in a bar plot (see
+    get_accuracy_per_participant_data)
+
+    :param dataset: the AnswerDataset
+    :return: list of figures (see get_accuracy_figures)
     """
-    all_accuracies = {x / 8 * 100: 0 for x in range(9)}
-    all_answers = pd.read_csv("All answers_puzzles all trials.csv")
-    # compute and store all the mean accuracy over all completed puzzles for each participant
-    for subject_id in set(all_answers["Subject.id"]):
-        df_temp = all_answers.loc[all_answers["Subject.id"] == subject_id]
-        no_correct_answers = len(df_temp[df_temp['Is.correct'] == 1])
-        accuracy = no_correct_answers / len(df_temp) * 100
-        all_accuracies[accuracy] += 1
+    # count the participants per mean accuracy over all completed puzzles
+    all_accuracies = memoize(get_accuracy_per_participant_data, dataset)
 
-    plot_bar(list(all_accuracies.keys()), list(all_accuracies.values()), "Distribution of Accuracy Over Participants",
-             "Accuracy (%) over the 8 puzzles", "Number of participants", (0, max(all_accuracies.values())),
-             (0, max(all_accuracies.keys())), "plots_paper/distrib_acc_participants", chance_x=1 / 12 * 100,
-             rotation_x=0, bar_size=3)
+    return [("plot_bar", (list(all_accuracies.keys()), list(all_accuracies.values()),
+                          "Distribution of Accuracy Over Participants", "Accuracy (%) over the 8 puzzles",
+                          "Number of participants", (0, max(all_accuracies.values())), (0, max(all_accuracies.keys()))),
+             dict(title_save_file="plots_paper/distrib_acc_participants", chance_x=1 / 12 * 100, rotation_x=0,
+                  bar_size=3))]
 
 
-def count_no_entries_per_participant():
+def plot_accuracy_per_participant(dataset):
+    """
+    Plot the frequency of the accuracy values over participants (see get_accuracy_per_participant_figures)
+
+    :param dataset: the AnswerDataset
+    """
+    render_figures(get_accuracy_per_participant_figures(dataset))
+
+
+def count_no_entries_per_participant(dataset):
     """
     Count how many puzzles each participant solved. Then, show how many participants finished how many puzzle
+
+    :param dataset: the AnswerDataset
     """
-    all_count = []
-    all_answers = pd.read_csv("All answers_puzzles.csv")
-    for subject_id in set(all_answers["Subject.id"]):
-        df_temp = all_answers.loc[all_answers["Subject.id"] == subject_id]
-        all_count.append(len(df_temp))
+    print("Number of trials completed: Number of participants", count_histogram(dataset.puzzle_answers_by_subject))
 
-    print("Number of trials completed: Number of participants", dict(Counter(all_count)))
 
+def get_time_distribution_data(dataset, log_bool=False):
+    """
+    Collect the (log-)time of solving a puzzle for each ToM order and each scenario
 
-def plot_time_distribution(log_bool=False, vertical=True):
+    :param dataset: the AnswerDataset
+    :param log_bool: if True, then the log-transformed time is collected
+    :return: dictionary of ToM order -> times, and dictionary of scenario -> times (sorted by mean time)
+    """
+    time_column = "logTime" if log_bool else "Time"
+    # for each ToM order (level) and scenario (only the second block), store the (log-transformed) times
+    dict_tom = group_values(dataset.all_trials_by_level, time_column, LEVELS)
+    dict_scenario = group_values(dataset.all_trials_by_scenario, time_column, SCENARIOS)
+
+    # for readability, sort by mean of values
+    dict_scenario_sorted = dict(sorted(dict_scenario.items(), key=lambda item: np.mean(item[1])))
+    return dict_tom, dict_scenario_sorted
+
+
+def get_time_distribution_figures(dataset, log_bool=False, vertical=True):
     """
     Plot the log-time distribution of solving a puzzle for:
         1) each ToM order
         2) each scenario
     in three separate violin plots
 
+    :param dataset: the AnswerDataset
     :param log_bool: if True, then log-transformed time is plotted
     :param vertical: if True, then creates vertical violin plots, otherwise horizontal
+    :return: list of figures (see get_accuracy_figures)
     """
-    df = pd.read_csv("All answers_puzzles all trials.csv")
-    dict_tom = {1: [], 2: [], 3: [], 4: []}
-    dict_scenario = {"birthday": [], "hair": [], "drink": [], "toy": []}
+    dict_tom, dict_scenario_sorted = memoize(get_time_distribution_data, dataset, log_bool=log_bool)
 
-    # for each ToM order (level), scenario and combination, store the log-transformed times
-    for (idx, row) in df.iterrows():
-        time = row["logTime"] if log_bool else row["Time"]
-        dict_tom[row["Level"]].append(time)
-        # for scenarios, only consider the second block
-        if row["Block"] == 2:
-            dict_scenario[row["Scenario"]].append(time)
+    y_axis_label = "Time (log-transformed)" if log_bool else "Time (in seconds)"
+    return [("plot_violin", (list(dict_tom.values()), None, list(dict_tom.keys()), y_axis_label, "ToM order", (0, 800),
+                             None, "Distribution of Time over ToM Orders"),
+             dict(title_save_file="plots_paper/tom_time_distrib", vertical=vertical)),
+            ("plot_violin", (list(dict_scenario_sorted.values()), None, list(dict_scenario_sorted.keys()), y_axis_label,
+                             "Scenario", (0, 800), None, "Distribution of Time over Scenarios"),
+             dict(title_save_file="plots_paper/scenario_time_distrib", vertical=vertical, rotation_y=45))]
 
-    # for readability, sort by mean of values
-    dict_scenario_sorted = dict(sorted(dict_scenario.items(), key=lambda item: mean(item[1])))
 
-    y_axis_label = "Time (log-transformed)" if log_bool else "Time (in seconds)"
-    plot_violin(list(dict_tom.values()), None, list(dict_tom.keys()), y_axis_label, "ToM order", (0, 800), None,
-                "Distribution of Time over ToM Orders", "plots_paper/tom_time_distrib", vertical)
-    plot_violin(list(dict_scenario_sorted.values()), None, list(dict_scenario_sorted.keys()), y_axis_label, "Scenario",
-                (0, 800), None, "Distribution of Time over Scenarios", "plots_paper/scenario_time_distrib", vertical,
-                rotation_y=45)
+def plot_time_distribution(dataset, log_bool=False, vertical=True):
+    """
+    Plot the time distribution for each ToM order and scenario (see get_time_distribution_figures)
+
+    :param dataset: the AnswerDataset
+    :param log_bool: if True, then log-transformed time is plotted
+    :param vertical: if True, then creates vertical violin plots, otherwise horizontal
+    """
+    render_figures(get_time_distribution_figures(dataset, log_bool=log_bool, vertical=vertical))
 
 
-def plot_p_beauty(bin_size=20):
+def get_p_beauty_data(dataset, bin_size=20):
     """
-    Plot the binned distribution of the p-beauty answers.
+    Bin the p-beauty answers
 
+    :param dataset: the AnswerDataset
     :param bin_size: the number of bins
+    :return: dictionary of interval -> number of answers
     """
-    df = pd.read_csv("All answers_all.csv")
-    # get only the p-beauty answers
-    df_pb = df[df['Index'].isnull()]
-    # count how many participants gave the same answer
-    dict_answers = dict(Counter(list(df_pb["Given answer"])))
     # find the thresholds for the specified number of bins
     bins = np.linspace(0, 100, bin_size, dtype=int)
-    # create a dictionary where the keys are intervals between two extrema of each bin
-    dict_binned_answers = {f"({bins[idx - 1]}, {bins[idx]}]": 0 for idx in range(1, len(bins))}
-
-    # for each p-beauty answer...
-    for ans in dict_answers.keys():
-        # for each binned interval...
-        for str_binned_interval in dict_binned_answers.keys():
-            # find the extrema values for each binned interval...
-            binned_interval = re.findall(r'\d+', str_binned_interval)
-            # if the p-beauty answer is within that binned interval, update the dict
-            if int(binned_interval[0]) < int(ans) <= int(binned_interval[1]):
-                dict_binned_answers[str_binned_interval] += dict_answers[ans]
-                break
-
-    plot_bar(list(dict_binned_answers.keys()), list(dict_binned_answers.values()), "P-beauty Answer Distribution",
-             "Value interval", "Number of participants", (0, max(dict_binned_answers.values())),
-             (0, len(dict_binned_answers)), "plots_paper/p-beauty_distrib", bar_size=0.5)
-
-
-def plot_distrib_answers():
-    """
-    For each of the four original birthday puzzles, plot the frequency of all answers in a bar plot
-    """
-    df = pd.read_csv("All answers_puzzles.csv")
-    question_bank = pd.read_csv("../interface/question_bank.csv")
-    dict_tom = {"I don't know": {'May, 15': 0, 'September, 14': 0, 'September, 15': 0, 'May, 18': 0},
-                "No solution": {'May, 15': 0, 'September, 14': 0, 'September, 15': 0, 'May, 18': 0},
-                "Multiple solutions": {'May, 15': 0, 'September, 14': 0, 'September, 15': 0, 'May, 18': 0}}
-
-    # for each of the four puzzles, store the answers
-    for (idx, row) in df.iterrows():
-        if str(row["Index"]) != "nan" and str(row["Time"]) != "nan":
-            # first, translate the answer, such that the puzzle corresponds to one of the four original puzzles
-            correct_answer = question_bank.loc[question_bank["IDX"] == row["Index"]]["Translated answer"].values[0]
-            transl_key = question_bank.loc[question_bank["IDX"] == row["Index"]]["Translation key"].values[0]
-            scenario = question_bank.loc[question_bank["IDX"] == row["Index"]]["Scenario"].values[0]
-            try:
-                transl_answer = translate_answer(row["Given.answer"].split(", "), scenario, eval(transl_key))
-            except KeyError:
-                transl_answer = row["Given.answer"]
-            # then, store it as a given answer for the corresponding original puzzle
-            if transl_answer not in dict_tom.keys():
-                dict_tom[transl_answer] = {'May, 15': 0, 'September, 14': 0, 'September, 15': 0, 'May, 18': 0}
-                dict_tom[transl_answer][correct_answer] = 1
-            else:
-                dict_tom[transl_answer][correct_answer] += 1
-
-    # sort dictionary by month and day, in this order
-    key_order = ["May", "June", "July", "August", "September", "Multiple solutions", "No solution", "I don't know"]
-    new_tom_dict = {}
-    for lookup_key in key_order:
-        new_lookup_dict = {key: value for (key, value) in dict_tom.items() if lookup_key in key}
-        new_lookup_dict = dict(sorted(new_lookup_dict.items()))
-        new_tom_dict.update(new_lookup_dict)
-
-    plot_multiple_bars_per_level(new_tom_dict, "Answer selected", "Distribution of answers per puzzle type",
-                                 "plots/distrib_answers_puzzle")
+    # count the p-beauty answers in the interval between two extrema of each bin
+    return bin_answers(dataset.p_beauty_answers["Given answer"], bins)
+
+
+def get_p_beauty_figures(dataset, bin_size=20):
+    """
+    Plot the binned distribution of the p-beauty answers.
+
+    :param dataset: the AnswerDataset
+    :param bin_size: the number of bins
+    :return: list of figures (see get_accuracy_figures)
+    """
+    dict_binned_answers = memoize(get_p_beauty_data, dataset, bin_size=bin_size)
+
+    return [("plot_bar", (list(dict_binned_answers.keys()), list(dict_binned_answers.values()),
+                          "P-beauty Answer Distribution", "Value interval", "Number of participants",
+                          (0, max(dict_binned_answers.values())), (0, len(dict_binned_answers))),
+             dict(title_save_file="plots_paper/p-beauty_distrib", bar_size=0.5))]
+
+
+def plot_p_beauty(dataset, bin_size=20):
+    """
+    Plot the binned distribution of the p-beauty answers (see get_p_beauty_figures)
+
+    :param dataset: the AnswerDataset
+    :param bin_size: the number of bins
+    """
+    render_figures(get_p_beauty_figures(dataset, bin_size=bin_size))
+
+
+def get_distrib_answers_data(dataset):
+    """
+    For each of the four original birthday puzzles, count the frequency of all answers
+
+    :param dataset: the AnswerDataset
+    :return: dictionary of answer -> dictionary of puzzle (its correct answer) -> frequency
+    """
+    df = dataset.puzzle_answers
+    question_bank = dataset.question_bank
+    df = df.loc[df["Index"].notna() & df["Time"].notna()]
+    # the four original puzzles, identified by their (translated) correct answer, in the order of their ToM level
+    puzzle_answers = ['May, 15', 'September, 14', 'September, 15', 'May, 18']
+
+    # encode the translated answers and the puzzle of each answer, and count them in one pass
+    answer_codes = encode_answers(df["Translated.answer"])
+    puzzle_idx = pd.Series(range(len(puzzle_answers)), index=puzzle_answers)[
+        question_bank["Translated answer"].reindex(df["Index"])].to_numpy()
+    counts = count_codes(answer_codes, puzzle_idx, len(puzzle_answers))
+
+    # keep the answers given at least once and the special answers; the codes are already sorted by month and day,
+    # followed by the special answers
+    return {ANSWERS[code]: dict(zip(puzzle_answers, counts[:, code].tolist())) for code in range(N_CODES)
+            if counts[:, code].sum() > 0 or ANSWERS[code] in SPECIAL_ANSWERS}
+
+
+def get_distrib_answers_figures(dataset):
+    """
+    For each of the four original birthday puzzles, plot the frequency of all answers in a bar plot (see
+    get_distrib_answers_data)
+
+    :param dataset: the AnswerDataset
+    :return: list of figures (see get_accuracy_figures)
+    """
+    dict_tom = memoize(get_distrib_answers_data, dataset)
+
+    return [("plot_multiple_bars_per_level", (dict_tom, "Answer selected", "Distribution of answers per puzzle type"),
+             dict(title_save_file="plots/distrib_answers_puzzle"))]
+
+
+def plot_distrib_answers(dataset):
+    """
+    Plot the frequency of all answers for each of the four original birthday puzzles (see get_distrib_answers_figures)
+
+    :param dataset: the AnswerDataset
+    """
+    render_figures(get_distrib_answers_figures(dataset))
+
+
+def get_figures(dataset=None):
+    """
+    Compute the data of all figures, in the configuration of the main run (used by ../modeling/figures.py)
+
+    :param dataset: the AnswerDataset (if None, then it is loaded)
+    :return: list of figures (see get_accuracy_figures)
+    """
+    dataset = dataset or AnswerDataset()
+    return get_accuracy_figures(dataset, orientation="horizontal") + get_accuracy_per_participant_figures(dataset) + \
+        get_time_distribution_figures(dataset, vertical=False) + get_p_beauty_figures(dataset) + \
+        get_distrib_answers_figures(dataset)
 
 
 if __name__ == '__main__':
-    get_form_data()
-    plot_accuracy_per_order_and_scenario(orientation="horizontal")
-    plot_accuracy_per_participant()
-    count_no_entries_per_participant()
-    plot_time_distribution(vertical=False)
-    plot_p_beauty()
-    plot_distrib_answers()
+    # every table is read (and every grouping computed) once, and shared by all functions
+    answer_dataset = AnswerDataset()
+    get_form_data(answer_dataset)
+    plot_accuracy_per_order_and_scenario(answer_dataset, orientation="horizontal")
+    plot_accuracy_per_participant(answer_dataset)
+    count_no_entries_per_participant(answer_dataset)
+    plot_time_distribution(answer_dataset, vertical=False)
+    plot_p_beauty(answer_dataset)
+    plot_distrib_answers(answer_dataset)
 
@@ -0,0 +1,118 @@
+import os
+from functools import cached_property
+import pandas as pd
+# the figure cache is shared with the modeling code (see utilities.MODELING_DIR)
+import utilities
+from plot_cache import hash_files
+
+# csv files with the answers (see enrich.py)
+ALL_ANSWERS_FILE = "All answers_all.csv"
+PUZZLE_ANSWERS_FILE = "All answers_puzzles.csv"
+ALL_TRIALS_FILE = "All answers_puzzles all trials.csv"
+QUESTION_BANK_FILE = "../interface/question_bank.csv"
+
+
+class AnswerDataset:
+    def __init__(self, all_answers_file=ALL_ANSWERS_FILE, puzzle_answers_file=PUZZLE_ANSWERS_FILE,
+                 all_trials_file=ALL_TRIALS_FILE):
+        """
+        The participants' answers, shared by all analysis functions: every table is read the first time it is used,
+        and every derived view is computed once and then cached
+        """
+        self.all_answers_file = all_answers_file
+        self.puzzle_answers_file = puzzle_answers_file
+        self.all_trials_file = all_trials_file
+
+    @classmethod
+    def from_store(cls):
+        """
+        Build the dataset directly from the store of ingested results, without reading the csv files
+
+        :return: the dataset
+        """
+        from enrich import enrich
+        from ingest import STORE_DIR, MANIFEST_FILE
+        dataset = cls()
+        # cached properties are stored in the instance dictionary, so the tables can be set directly
+        dataset.all_answers, dataset.puzzle_answers, dataset.all_trials_answers = enrich()
+        dataset.version = hash_files([os.path.join(STORE_DIR, MANIFEST_FILE)])
+        return dataset
+
+    @cached_property
+    def version(self):
+        """
+        :return: the version of the answers (hash of the csv files), which identifies the data of the figures computed
+        from them (see ../modeling/plot_cache.py)
+        """
+        return hash_files([self.all_answers_file, self.puzzle_answers_file, self.all_trials_file])
+
+    @cached_property
+    def all_answers(self):
+        """
+        :return: all answers (puzzles, p-beauty and background form)
+        """
+        return pd.read_csv(self.all_answers_file)
+
+    @cached_property
+    def puzzle_answers(self):
+        """
+        :return: the puzzle answers given within the time limit
+        """
+        return pd.read_csv(self.puzzle_answers_file)
+
+    @cached_property
+    def all_trials_answers(self):
+        """
+        :return: the puzzle answers of the participants who finished all trials
+        """
+        return pd.read_csv(self.all_trials_file)
+
+    @cached_property
+    def question_bank(self):
+        """
+        :return: the question bank, indexed by the puzzle index
+        """
+        return pd.read_csv(QUESTION_BANK_FILE).set_index("IDX")
+
+    @cached_property
+    def form_answers(self):
+        """
+        :return: the background form answers, one row per participant
+        """
+        return self.all_answers.drop_duplicates(subset=["Subject id"])
+
+    @cached_property
+    def p_beauty_answers(self):
+        """
+        :return: the p-beauty answers (the answers without puzzle index)
+        """
+        return self.all_answers.loc[self.all_answers["Index"].isnull()]
+
+    @cached_property
+    def all_trials_by_subject(self):
+        """
+        :return: the answers of the participants who finished all trials, grouped per participant
+        """
+        return self.all_trials_answers.groupby("Subject.id")
+
+    @cached_property
+    def puzzle_answers_by_subject(self):
+        """
+        :return: the puzzle answers, grouped per participant
+        """
+        return self.puzzle_answers.groupby("Subject.id")
+
+    @cached_property
+    def all_trials_by_level(self):
+        """
+        :return: the answers of the participants who finished all trials, grouped per ToM order
+        """
+        return self.all_trials_answers.groupby("Level")
+
+    @cached_property
+    def all_trials_by_scenario(self):
+        """
+        :return: the answers of the second block of the participants who finished all trials, grouped per scenario
+        (scenarios are only compared on the second block)
+        """
+        return self.all_trials_answers.loc[self.all_trials_answers["Block"] == 2].groupby("Scenario")
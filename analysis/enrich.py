@@ -0,0 +1,154 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+from utilities import add_puzzle_info, translate_answers
+from answer_codec import decode_answers
+from ingest import STORE_DIR, ingest_results, load_answers
+from dataset import QUESTION_BANK_FILE
+
+# file with all answers (puzzles, p-beauty and background form), with the puzzle information and translated answers
+ALL_ANSWERS_FILE = "All answers_all.csv"
+# file with the puzzle answers only, with the variables of analysis_stat.Rmd
+PUZZLE_ANSWERS_FILE = "All answers_puzzles.csv"
+# same as PUZZLE_ANSWERS_FILE, but only with the participants who finished all trials
+ALL_TRIALS_FILE = "All answers_puzzles all trials.csv"
+# folder the tables are written to when enrich.py is run, so that the committed csv files are only replaced on request
+ENRICHED_DIR = "enriched"
+# the number of trials of the experiment, and the number of trials per block
+N_TRIALS = 8
+BLOCK_SIZE = 4
+# puzzles whose index was not recorded by the interface, corrected by hand: (subject id, given answer) -> (index,
+# correct answer)
+INDEX_CORRECTIONS = {("38d9133a-6cd8-4748-a00a-20acc4afc74f", "May, 15"): ("#010", "May, 15")}
+
+
+def correct_missing_indices(all_answers, corrections=INDEX_CORRECTIONS):
+    """
+    Fill in the puzzle indices that were not recorded, see INDEX_CORRECTIONS
+
+    :param all_answers: dataframe with the raw answers
+    :param corrections: dictionary of (subject id, given answer) -> (index, correct answer)
+    :return: the corrected dataframe
+    """
+    all_answers = all_answers.copy()
+    for (subject, given_answer), (index, correct_answer) in corrections.items():
+        is_missing = (all_answers["Subject id"] == subject) & (all_answers["Given answer"] == given_answer) & \
+                     all_answers["Index"].isna()
+        all_answers.loc[is_missing, ["Index", "Correct answer"]] = [index, correct_answer]
+    return all_answers
+
+
+def translate_given_answers(all_answers):
+    """
+    Translate the given answers to the original birthday scenario (see utilities.translate_answers); the p-beauty
+    answers get missing values
+
+    :param all_answers: dataframe with the answers, with the "Scenario" and "Translation key" columns
+    (see utilities.add_puzzle_info)
+    :return: series with the translated answers
+    """
+    codes = translate_answers(all_answers["Given answer"], all_answers["Scenario"], all_answers["Translation key"])
+    return pd.Series(decode_answers(codes), index=all_answers.index, dtype=object)
+
+
+def to_r_names(columns):
+    """
+    Rename columns the way R does when reading a csv file (make.names): every character that is not a letter, a digit,
+    "_" or "." becomes "."
+
+    :param columns: list of column names
+    :return: list of the renamed columns
+    """
+    return [re.sub(r"[^0-9A-Za-z_.]", ".", column) for column in columns]
+
+
+def enrich_all_answers(all_answers, all_questions):
+    """
+    Enrichment of "All answers_all": puzzle level, scenario, translation key and translated answer
+
+    :param all_answers: dataframe with the raw answers (see ingest.load_answers)
+    :param all_questions: the question bank
+    :return: the enriched dataframe
+    """
+    all_answers = add_puzzle_info(correct_missing_indices(all_answers), all_questions)
+    all_answers["Translated answer"] = translate_given_answers(all_answers)
+    return all_answers
+
+
+def get_puzzle_answers(all_answers):
+    """
+    Enrichment of "All answers_puzzles" (previously done in analysis_stat.Rmd): only the puzzles that were answered
+    within the time limit, with the log of the time, the trial and block of each answer and whether it is correct
+
+    :param all_answers: dataframe with the enriched answers (see enrich_all_answers)
+    :return: the puzzle answers, with the column names used by R
+    """
+    puzzle_answers = all_answers.loc[all_answers["Given answer"].notna() & all_answers["Index"].notna()].copy()
+    puzzle_answers["logTime"] = np.log(puzzle_answers["Time"])
+    # the answers of a participant are in the order they were given; the columns are in the order of the committed
+    # csv files
+    trial = puzzle_answers.groupby("Subject id", sort=False).cumcount() + 1
+    puzzle_answers["Block"] = np.where(trial <= BLOCK_SIZE, 1, 2)
+    puzzle_answers["Trial"] = trial
+    puzzle_answers["Is.correct"] = (puzzle_answers["Correct answer"] == puzzle_answers["Given answer"]).astype(int)
+    puzzle_answers["Level"] = puzzle_answers["Level"].astype(int)
+    puzzle_answers.columns = to_r_names(puzzle_answers.columns)
+    return puzzle_answers.reset_index(drop=True)
+
+
+def get_all_trials_answers(puzzle_answers):
+    """
+    Keep only the participants who answered all trials within the time limit
+
+    :param puzzle_answers: see get_puzzle_answers
+    :return: the answers of these participants
+    """
+    n_answers = puzzle_answers.groupby("Subject.id")["Trial"].transform("size")
+    return puzzle_answers.loc[n_answers == N_TRIALS].reset_index(drop=True)
+
+
+def enrich_answers(all_answers, all_questions):
+    """
+    Compute all derived answer tables from the raw answers
+
+    :param all_answers: dataframe with the raw answers, as stored (see ingest.load_answers)
+    :param all_questions: the question bank
+    :return: the enriched tables of all answers, of the puzzle answers and of the participants who finished all trials
+    """
+    # the categorical types of the store are only needed for storage
+    all_answers = all_answers.drop(columns=["Session", "Source file"])
+    all_answers = all_answers.astype({column: object for column in all_answers.select_dtypes("category").columns})
+    all_answers = enrich_all_answers(all_answers, all_questions)
+    puzzle_answers = get_puzzle_answers(all_answers)
+    all_trials_answers = get_all_trials_answers(puzzle_answers)
+    return all_answers, puzzle_answers, all_trials_answers
+
+
+def enrich(store_dir=STORE_DIR, output_dir=None):
+    """
+    Build all derived answer tables in one step: ingest new result files, attach the puzzle information and compute
+    the variables of the statistical analysis
+
+    :param store_dir: the folder of the store (see ingest.py)
+    :param output_dir: if given, then the tables are written to their csv files in this folder (use "." to replace
+    the committed csv files)
+    :return: the enriched tables of all answers, of the puzzle answers and of the participants who finished all trials
+    """
+    ingest_results(store_dir=store_dir)
+    all_answers, puzzle_answers, all_trials_answers = enrich_answers(load_answers(store_dir),
+                                                                     pd.read_csv(QUESTION_BANK_FILE))
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        # the translation key is not part of the csv files
+        all_answers.drop(columns=["Translation key"]).to_csv(os.path.join(output_dir, ALL_ANSWERS_FILE), index=False)
+        puzzle_answers.drop(columns=["Translation.key"]).to_csv(os.path.join(output_dir, PUZZLE_ANSWERS_FILE),
+                                                                index=False)
+        all_trials_answers.drop(columns=["Translation.key"]).to_csv(os.path.join(output_dir, ALL_TRIALS_FILE),
+                                                                    index=False)
+    return all_answers, puzzle_answers, all_trials_answers
+
+
+if __name__ == "__main__":
+    enrich(output_dir=ENRICHED_DIR)
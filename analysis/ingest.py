@@ -0,0 +1,152 @@
+import os
+import glob
+import hashlib
+import pandas as pd
+
+# folder with one results_<DDMM> folder per experiment session date
+RESULTS_DIR = "all_results"
+# name pattern of the files with all answers (puzzles and background form) of one participant
+ANSWER_FILE_PATTERN = "All answers_*.csv"
+# folder of the consolidated store: one pickled partition per session date, plus the manifest
+STORE_DIR = "store"
+# manifest of the ingested files, used to detect new and modified files
+MANIFEST_FILE = "manifest.csv"
+# columns stored as categorical (few distinct values, repeated over the rows of a participant)
+CATEGORICAL_COLUMNS = ["Session", "Source file", "Subject id", "Index", "Correct answer", "Given answer", "Gender",
+                       "Student rug", "Student bachelor", "Study program", "Logic course", "Know puzzle?"]
+# columns stored as integers (nullable, since a missing value would otherwise turn them into floats)
+INTEGER_COLUMNS = ["Puzzle series no", "Age", "Difficulty instructions", "Enjoy puzzle", "Difficulty puzzle", "Mood"]
+
+
+def hash_file(file_path):
+    """
+    Compute the sha256 hash of a file
+
+    :param file_path: the path to the file
+    :return: the hexadecimal hash
+    """
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_partition_path(session, store_dir=STORE_DIR):
+    """
+    :param session: the session date (DDMM, as in the name of the results folder)
+    :param store_dir: the folder of the store
+    :return: the path to the partition of a session
+    """
+    return os.path.join(store_dir, f"results_{session}.pkl")
+
+
+def set_column_types(df):
+    """
+    Give the answer columns compact, explicit types
+
+    :param df: dataframe with the (raw) answers
+    :return: the same dataframe with categorical and integer columns
+    """
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype("category")
+    for column in INTEGER_COLUMNS:
+        df[column] = df[column].astype("Int64")
+    df["Time"] = df["Time"].astype(float)
+    return df
+
+
+def read_answer_file(file_path, session):
+    """
+    Read the answers of one participant
+
+    :param file_path: the path to the csv file
+    :param session: the session date of the file
+    :return: dataframe with the answers, and the session and file they come from
+    """
+    # parse the times exactly, so that they do not change when the store is written back to csv
+    df = pd.read_csv(file_path, float_precision="round_trip")
+    df.insert(0, "Session", session)
+    df.insert(1, "Source file", os.path.basename(file_path))
+    return df
+
+
+def load_manifest(store_dir=STORE_DIR):
+    """
+    :param store_dir: the folder of the store
+    :return: the manifest (one row per ingested file), empty if nothing was ingested yet
+    """
+    manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        return pd.read_csv(manifest_path, dtype={"Session": str})
+    return pd.DataFrame(columns=["File", "Session", "Size", "Mtime", "Hash"])
+
+
+def ingest_results(results_dir=RESULTS_DIR, store_dir=STORE_DIR):
+    """
+    Add new or modified participant files from the session folders to the store. A file is skipped if its size and
+    modification time are the same as in the manifest, or if its content hash is; only the partitions of the sessions
+    with new or modified files are rewritten.
+
+    :param results_dir: the folder with the session folders
+    :param store_dir: the folder of the store
+    :return: list of the ingested files
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = load_manifest(store_dir).set_index("File")
+
+    ingested = []
+    for file_path in sorted(glob.glob(os.path.join(results_dir, "results_*", ANSWER_FILE_PATTERN))):
+        session = os.path.basename(os.path.dirname(file_path)).split("_")[-1]
+        stat = os.stat(file_path)
+        if file_path in manifest.index:
+            entry = manifest.loc[file_path]
+            if entry["Size"] == stat.st_size and entry["Mtime"] == stat.st_mtime:
+                continue
+            file_hash = hash_file(file_path)
+            # the file was touched but not modified: only update the manifest
+            if entry["Hash"] == file_hash:
+                manifest.loc[file_path, ["Size", "Mtime"]] = [stat.st_size, stat.st_mtime]
+                continue
+        else:
+            file_hash = hash_file(file_path)
+        manifest.loc[file_path] = [session, stat.st_size, stat.st_mtime, file_hash]
+        ingested.append((session, file_path))
+
+    # rewrite the partitions of the sessions with new or modified files: the old rows of a modified file are replaced
+    for session in sorted({session for session, _ in ingested}):
+        partition_path = get_partition_path(session, store_dir)
+        new_files = [file_path for file_session, file_path in ingested if file_session == session]
+        new_df = pd.concat([read_answer_file(file_path, session) for file_path in new_files])
+        if os.path.exists(partition_path):
+            old_df = pd.read_pickle(partition_path)
+            old_df = old_df.loc[~old_df["Source file"].isin([os.path.basename(f) for f in new_files])]
+            new_df = pd.concat([old_df.astype(object), new_df])
+        set_column_types(new_df.reset_index(drop=True)).to_pickle(partition_path)
+
+    manifest.reset_index().to_csv(os.path.join(store_dir, MANIFEST_FILE), index=False)
+    return [file_path for _, file_path in ingested]
+
+
+def load_answers(store_dir=STORE_DIR, sessions=None):
+    """
+    Load the answers of all participants from the store
+
+    :param store_dir: the folder of the store
+    :param sessions: list of session dates to load (if None, then all sessions are loaded)
+    :return: dataframe with the answers of all participants, with the same types as in the partitions
+    """
+    if sessions is None:
+        partition_paths = sorted(glob.glob(get_partition_path("*", store_dir)))
+    else:
+        partition_paths = [get_partition_path(session, store_dir) for session in sessions]
+    df = pd.concat([pd.read_pickle(partition_path) for partition_path in partition_paths], ignore_index=True)
+    # the categories differ between partitions, so the concatenated categorical columns have to be typed again
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype("category")
+    return df
+
+
+if __name__ == "__main__":
+    new_files = ingest_results()
+    print(f"Ingested {len(new_files)} new or modified files")
+    answers = load_answers()
+    print(f"{len(answers)} answers of {answers['Subject id'].nunique()} participants in "
+          f"{answers['Session'].nunique()} sessions")
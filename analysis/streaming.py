@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import subprocess
+import numpy as np
+import pandas as pd
+from ingest import ingest_results, load_answers
+from enrich import enrich_answers, correct_missing_indices
+from dataset import QUESTION_BANK_FILE
+from summaries import summarize_answers, merge_summaries, get_accuracy, get_time_moments, get_time_quantiles
+# the chunk reader is shared with the modeling code (see utilities.MODELING_DIR)
+import utilities
+from chunks import CHUNK_SIZE, read_subject_chunks, get_peak_rss
+
+# the columns of the store that the streaming mode reads (the background form is not needed for the summaries)
+STREAM_COLUMNS = ["Session", "Source file", "Subject id", "Index", "Correct answer", "Given answer", "Time"]
+# file with the synthetic population of the benchmark, and its enriched puzzle answers (the input of the streaming
+# likelihoods, see modeling/streaming_likelihoods.py)
+SYNTHETIC_ANSWERS_FILE = "synthetic answers_all.csv"
+SYNTHETIC_PUZZLE_ANSWERS_FILE = "synthetic answers_puzzles.csv"
+# number of puzzle answers of the synthetic population
+N_SYNTHETIC_TRIALS = 10_000_000
+# number of synthetic participants generated at once
+N_SYNTHETIC_SUBJECTS_PER_CHUNK = 50_000
+# code run in a fresh interpreter by the benchmark, so that the peak memory is the one of the streaming mode only; it
+# prints the summary of the population (pickled to the file given as second argument) and the peak memory
+BENCHMARK_CODE = """
+import sys
+import pandas as pd
+from streaming import stream_summaries, get_peak_rss
+summary = stream_summaries(sys.argv[1], puzzle_answers_file=sys.argv[3], chunk_size=int(sys.argv[4]))
+pd.to_pickle(summary, sys.argv[2])
+print(get_peak_rss())
+"""
+
+
+def stream_answers(answers_file, chunk_size=CHUNK_SIZE, all_questions=None):
+    """
+    Read and enrich a csv file of raw answers (with the STREAM_COLUMNS of the store) chunk by chunk, with a bounded
+    memory: only one chunk of answers is loaded at a time
+
+    :param answers_file: the path to the csv file; the rows of a participant must be consecutive
+    :param chunk_size: the number of rows read at once
+    :param all_questions: the question bank (if None, then it is read)
+    :return: generator of the enriched tables of every chunk (see enrich.enrich_answers)
+    """
+    all_questions = pd.read_csv(QUESTION_BANK_FILE) if all_questions is None else all_questions
+    # every answer is read as a string (the p-beauty answers are numbers), as in the answer files of one participant
+    for chunk in read_subject_chunks(answers_file, "Subject id", chunk_size=chunk_size, usecols=STREAM_COLUMNS,
+                                     dtype={"Given answer": object, "Correct answer": object},
+                                     float_precision="round_trip"):
+        yield enrich_answers(chunk, all_questions)
+
+
+def stream_summaries(answers_file, puzzle_answers_file=None, chunk_size=CHUNK_SIZE):
+    """
+    Summarize a csv file of raw answers that does not fit in memory: every chunk is enriched and summarized on its own,
+    and the summaries are merged as they come (see summaries.merge_summaries), so the memory does not grow with the
+    number of answers
+
+    :param answers_file: the path to the csv file, see stream_answers
+    :param puzzle_answers_file: if given, then the enriched puzzle answers are written to this csv file, with the
+    columns of enrich.PUZZLE_ANSWERS_FILE except the background form
+    :param chunk_size: the number of rows read at once
+    :return: the summary of all answers (see summaries.summarize_answers)
+    """
+    summary = None
+    for idx, (all_answers, puzzle_answers, _) in enumerate(stream_answers(answers_file, chunk_size=chunk_size)):
+        chunk_summary = summarize_answers(all_answers, puzzle_answers)
+        summary = chunk_summary if summary is None else merge_summaries([summary, chunk_summary])
+        if puzzle_answers_file is not None:
+            # the translation key is not part of the csv file (see enrich.enrich)
+            puzzle_answers.drop(columns=["Translation.key"]).to_csv(puzzle_answers_file, index=False,
+                                                                    mode="w" if idx == 0 else "a", header=idx == 0)
+    return summary
+
+
+def generate_synthetic_answers(answers_file=SYNTHETIC_ANSWERS_FILE, n_trials=N_SYNTHETIC_TRIALS,
+                               subjects_per_chunk=N_SYNTHETIC_SUBJECTS_PER_CHUNK, seed=0):
+    """
+    Generate a large synthetic population by resampling the participants of the store (with all their answers), each
+    copy with its own participant id, and write it chunk by chunk to a csv file with the STREAM_COLUMNS
+
+    :param answers_file: the path to the csv file
+    :param n_trials: the (approximate) number of puzzle answers of the population
+    :param subjects_per_chunk: the number of participants generated at once
+    :param seed: the seed of the random generator
+    :return: the number of participants and the number of rows written
+    """
+    ingest_results()
+    # the hand corrections are keyed by the original participant ids, so they are applied before resampling
+    answers = load_answers()[STREAM_COLUMNS].astype(object)
+    answers = correct_missing_indices(answers).sort_values("Subject id", kind="stable").reset_index(drop=True)
+    subjects, starts, n_rows = np.unique(answers["Subject id"], return_index=True, return_counts=True)
+    n_puzzles = (answers["Index"].notna() & answers["Given answer"].notna()).groupby(answers["Subject id"]).sum()
+    n_subjects = int(round(n_trials / n_puzzles.mean()))
+
+    rng = np.random.default_rng(seed)
+    n_written = 0
+    for first_subject in range(0, n_subjects, subjects_per_chunk):
+        sampled = rng.integers(len(subjects), size=min(subjects_per_chunk, n_subjects - first_subject))
+        # row indices of all sampled participants, in the order they were sampled
+        sampled_rows = n_rows[sampled]
+        offsets = np.arange(sampled_rows.sum()) - np.repeat(np.cumsum(sampled_rows) - sampled_rows, sampled_rows)
+        chunk = answers.iloc[np.repeat(starts[sampled], sampled_rows) + offsets].copy()
+        new_ids = np.array([f"synthetic-{first_subject + idx:08d}" for idx in range(len(sampled))], dtype=object)
+        chunk["Subject id"] = np.repeat(new_ids, sampled_rows)
+        chunk["Source file"] = "All answers_" + chunk["Subject id"] + ".csv"
+        chunk.to_csv(answers_file, index=False, mode="w" if first_subject == 0 else "a", header=first_subject == 0)
+        n_written += len(chunk)
+    return n_subjects, n_written
+
+
+def benchmark_streaming(answers_file=SYNTHETIC_ANSWERS_FILE, puzzle_answers_file=SYNTHETIC_PUZZLE_ANSWERS_FILE,
+                        chunk_size=CHUNK_SIZE):
+    """
+    Summarize a (large) csv file of raw answers with the streaming mode in a fresh interpreter, and measure its peak
+    memory
+
+    :param answers_file: the path to the csv file of raw answers
+    :param puzzle_answers_file: the path to the csv file the enriched puzzle answers are written to
+    :param chunk_size: the number of rows read at once
+    :return: the summary (see summaries.summarize_answers), the peak resident memory (MB) and the time (s)
+    """
+    summary_file = f"{answers_file}.summary.pkl"
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", BENCHMARK_CODE, answers_file, summary_file, puzzle_answers_file,
+                             str(chunk_size)], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True,
+                            text=True, check=True).stdout
+    duration = time.perf_counter() - start
+    summary = pd.read_pickle(summary_file)
+    os.remove(summary_file)
+    return summary, float(output.strip().splitlines()[-1]), duration
+
+
+if __name__ == "__main__":
+    if not os.path.exists(SYNTHETIC_ANSWERS_FILE):
+        n_synthetic_subjects, n_synthetic_rows = generate_synthetic_answers()
+        print(f"Generated {n_synthetic_rows} answers of {n_synthetic_subjects} synthetic participants")
+    population, peak_rss, seconds = benchmark_streaming()
+    n_answers = int(population["cells"]["Count"].sum())
+    print(f"Streamed {n_answers} puzzle answers ({os.path.getsize(SYNTHETIC_ANSWERS_FILE) / 2 ** 20:.0f} MB of csv) "
+          f"in {seconds:.0f} s with chunks of {CHUNK_SIZE} rows: peak resident memory {peak_rss:.0f} MB")
+
+    all_trials = {"All.trials": True}
+    print("Accuracy per ToM order:", get_accuracy(population, "Level", all_trials).round(3).to_dict())
+    print("Time per ToM order:")
+    print(pd.concat([get_time_moments(population, "Level", filters=all_trials),
+                     get_time_quantiles(population, "Level", filters=all_trials)], axis=1).round(2).to_string())
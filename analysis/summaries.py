@@ -0,0 +1,254 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+from ingest import STORE_DIR, get_partition_path, ingest_results, load_answers
+from enrich import N_TRIALS, enrich_answers
+from dataset import QUESTION_BANK_FILE
+from aggregation import bin_answers
+# the answer codec is shared with the modeling code (see utilities.MODELING_DIR)
+import utilities
+from answer_codec import ANSWERS, encode_answers
+
+# the variables that define a cell of the summaries: every answer counts in exactly one cell
+CELL_COLUMNS = ["Level", "Scenario", "Block", "All.trials", "Is.correct"]
+# relative accuracy of the time quantiles: the times are counted in logarithmic buckets whose width is this fraction of
+# their value, so that the quantiles of merged summaries are as accurate as the quantiles of one session
+RELATIVE_ACCURACY = 0.01
+# ratio between the limits of two consecutive time buckets
+BUCKET_RATIO = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+
+def get_summary_path(session, store_dir=STORE_DIR):
+    """
+    :param session: the session date (see ingest.py)
+    :param store_dir: the folder of the store
+    :return: the path to the summary of a session, next to its partition
+    """
+    return os.path.join(store_dir, f"summary_{session}.pkl")
+
+
+def get_time_buckets(times):
+    """
+    :param times: array of times (in seconds, larger than 0)
+    :return: array with the logarithmic bucket of every time (see RELATIVE_ACCURACY)
+    """
+    return np.ceil(np.log(times) / np.log(BUCKET_RATIO)).astype(int)
+
+
+def summarize_answers(all_answers, puzzle_answers):
+    """
+    Summarize enriched answers into tables of counts and sums, which can be merged by adding them up (see
+    merge_summaries)
+
+    :param all_answers: dataframe with all enriched answers (see enrich.enrich_answers)
+    :param puzzle_answers: dataframe with the enriched puzzle answers (see enrich.enrich_answers)
+    :return: dictionary of table name -> table:
+        "cells": number of answers and sums (and sums of squares) of the (log-)times per cell (see CELL_COLUMNS)
+        "time_buckets": number of answers per cell and time bucket
+        "answers": number of answers per cell and (translated) answer
+        "completed": number of participants per number of completed puzzles
+        "participant_accuracy": number of participants who finished all trials per number of correct answers
+        "p_beauty": number of p-beauty answers per value
+    """
+    df = puzzle_answers.copy()
+    # the participants who answered all trials within the time limit (see enrich.get_all_trials_answers)
+    n_answers = df.groupby("Subject.id")["Trial"].transform("size")
+    df["All.trials"] = n_answers == N_TRIALS
+    df["Time.sq"] = df["Time"] ** 2
+    df["logTime.sq"] = df["logTime"] ** 2
+    df["Bucket"] = get_time_buckets(df["Time"].to_numpy())
+    df["Answer"] = encode_answers(df["Translated.answer"])
+
+    grouped = df.groupby(CELL_COLUMNS)
+    cells = grouped.agg(**{"Count": ("Time", "size"), "Time.sum": ("Time", "sum"), "Time.sumsq": ("Time.sq", "sum"),
+                           "logTime.sum": ("logTime", "sum"), "logTime.sumsq": ("logTime.sq", "sum")})
+
+    per_subject = df.groupby("Subject.id").agg(completed=("Trial", "size"), correct=("Is.correct", "sum"),
+                                               all_trials=("All.trials", "first"))
+    p_beauty = pd.to_numeric(all_answers.loc[all_answers["Index"].isnull(), "Given answer"]).dropna()
+    return {"cells": cells,
+            "time_buckets": df.groupby(CELL_COLUMNS + ["Bucket"]).size(),
+            "answers": df.groupby(CELL_COLUMNS + ["Answer"]).size(),
+            "completed": per_subject.groupby("completed").size().rename_axis("N.completed"),
+            "participant_accuracy": per_subject.loc[per_subject["all_trials"]].groupby("correct").size()
+            .rename_axis("N.correct"),
+            "p_beauty": p_beauty.value_counts().sort_index().rename_axis("Value")}
+
+
+def merge_summaries(summaries):
+    """
+    Merge summaries: the counts and sums of all tables are added up, so merging the summaries of several sessions
+    gives the summary of the pooled sessions
+
+    :param summaries: list of summaries (see summarize_answers)
+    :return: the merged summary
+    """
+    merged = {}
+    for name in summaries[0]:
+        table = pd.concat([summary[name] for summary in summaries])
+        merged[name] = table.groupby(level=list(range(table.index.nlevels))).sum()
+    return merged
+
+
+def summarize_session(session, store_dir=STORE_DIR, all_questions=None):
+    """
+    Summarize the answers of one session
+
+    :param session: the session date
+    :param store_dir: the folder of the store
+    :param all_questions: the question bank (if None, then it is read)
+    :return: the summary (see summarize_answers)
+    """
+    all_questions = pd.read_csv(QUESTION_BANK_FILE) if all_questions is None else all_questions
+    all_answers, puzzle_answers, _ = enrich_answers(load_answers(store_dir, [session]), all_questions)
+    return summarize_answers(all_answers, puzzle_answers)
+
+
+def update_summaries(store_dir=STORE_DIR):
+    """
+    Ingest new result files and summarize the sessions whose partition is new or was rewritten; the summaries of the
+    other sessions are kept, so adding a session only costs the summary of its own answers
+
+    :param store_dir: the folder of the store
+    :return: list of the summarized sessions
+    """
+    ingest_results(store_dir=store_dir)
+    all_questions = pd.read_csv(QUESTION_BANK_FILE)
+    updated = []
+    for partition_path in sorted(glob.glob(get_partition_path("*", store_dir))):
+        session = os.path.basename(partition_path)[len("results_"):-len(".pkl")]
+        summary_path = get_summary_path(session, store_dir)
+        if os.path.exists(summary_path) and os.path.getmtime(summary_path) >= os.path.getmtime(partition_path):
+            continue
+        pd.to_pickle(summarize_session(session, store_dir, all_questions), summary_path)
+        updated.append(session)
+    return updated
+
+
+def load_summaries(store_dir=STORE_DIR, sessions=None):
+    """
+    :param store_dir: the folder of the store
+    :param sessions: list of session dates (if None, then all summarized sessions)
+    :return: dictionary of session date -> summary
+    """
+    if sessions is None:
+        sessions = sorted(os.path.basename(path)[len("summary_"):-len(".pkl")]
+                          for path in glob.glob(get_summary_path("*", store_dir)))
+    return {session: pd.read_pickle(get_summary_path(session, store_dir)) for session in sessions}
+
+
+def select_cells(table, filters=None):
+    """
+    :param table: a table of a summary, indexed by (at least) CELL_COLUMNS
+    :param filters: dictionary of cell variable -> value to keep, e.g. {"Block": 2} (if None, then all cells are kept)
+    :return: the rows of the table in the selected cells
+    """
+    is_kept = np.ones(len(table), dtype=bool)
+    for column, value in (filters or {}).items():
+        is_kept &= table.index.get_level_values(column) == value
+    return table.loc[is_kept]
+
+
+def get_accuracy(summary, by, filters=None):
+    """
+    :param summary: see summarize_answers
+    :param by: the cell variable(s) to compute the accuracy for, e.g. "Level"
+    :param filters: see select_cells; e.g. the analysis uses the participants who finished all trials
+    ({"All.trials": True})
+    :return: series with the accuracy (between 0 and 1) per value of by
+    """
+    counts = select_cells(summary["cells"], filters)["Count"]
+    correct_counts = counts * (counts.index.get_level_values("Is.correct") == 1)
+    return correct_counts.groupby(level=by).sum() / counts.groupby(level=by).sum()
+
+
+def get_time_moments(summary, by, column="Time", filters=None):
+    """
+    :param summary: see summarize_answers
+    :param by: the cell variable(s) to group by
+    :param column: "Time" or "logTime"
+    :param filters: see select_cells
+    :return: dataframe with the number of answers, mean and standard deviation (with n - 1 degrees of freedom) of the
+    time per value of by
+    """
+    sums = select_cells(summary["cells"], filters).groupby(level=by)[["Count", f"{column}.sum", f"{column}.sumsq"]] \
+        .sum()
+    mean = sums[f"{column}.sum"] / sums["Count"]
+    variance = (sums[f"{column}.sumsq"] - sums["Count"] * mean ** 2) / (sums["Count"] - 1)
+    return pd.DataFrame({"N": sums["Count"], "Mean": mean, "SD": np.sqrt(variance.clip(lower=0))})
+
+
+def get_time_quantiles(summary, by, quantiles=(0.25, 0.5, 0.75), filters=None):
+    """
+    Quantiles of the time from the bucket counts: the quantile q is the time at rank q * (n - 1) (rounded down), within
+    RELATIVE_ACCURACY
+
+    :param summary: see summarize_answers
+    :param by: the cell variable(s) to group by
+    :param quantiles: list of quantiles (between 0 and 1)
+    :param filters: see select_cells
+    :return: dataframe with one column per quantile and one row per value of by
+    """
+    buckets = select_cells(summary["time_buckets"], filters)
+    by = [by] if isinstance(by, str) else list(by)
+    rows = {}
+    for group, counts in buckets.groupby(level=by):
+        counts = counts.groupby(level="Bucket").sum()
+        cumulative = counts.cumsum().to_numpy()
+        # the value of a bucket is the one with the smallest relative error for all times in it
+        values = 2 * BUCKET_RATIO ** counts.index.to_numpy() / (BUCKET_RATIO + 1)
+        rows[group] = [values[np.searchsorted(cumulative, q * (cumulative[-1] - 1), side="right")] for q in quantiles]
+    return pd.DataFrame.from_dict(rows, orient="index", columns=list(quantiles)).rename_axis(by)
+
+
+def get_answer_histogram(summary, by, filters=None):
+    """
+    :param summary: see summarize_answers
+    :param by: the cell variable(s) to group by
+    :param filters: see select_cells
+    :return: dataframe with the number of times each answer was given (columns) per value of by (rows)
+    """
+    counts = select_cells(summary["answers"], filters)
+    by = [by] if isinstance(by, str) else list(by)
+    histogram = counts.groupby(level=by + ["Answer"]).sum().unstack("Answer", fill_value=0)
+    return histogram.rename(columns=lambda code: ANSWERS[code])
+
+
+def get_p_beauty_histogram(summary, bin_size=20):
+    """
+    :param summary: see summarize_answers
+    :param bin_size: the number of bins (as in analysis.get_p_beauty_data)
+    :return: dictionary of interval -> number of p-beauty answers
+    """
+    bins = np.linspace(0, 100, bin_size, dtype=int)
+    return bin_answers(summary["p_beauty"].index, bins, weights=summary["p_beauty"].to_numpy())
+
+
+def compare_sessions(summaries, by="Level", filters=None):
+    """
+    Compare the accuracy of the sessions
+
+    :param summaries: dictionary of session date -> summary (see load_summaries)
+    :param by: the cell variable(s) to compute the accuracy for
+    :param filters: see select_cells
+    :return: dataframe with the accuracy (rows: values of by, columns: sessions)
+    """
+    return pd.DataFrame({session: get_accuracy(summary, by, filters) for session, summary in summaries.items()})
+
+
+if __name__ == "__main__":
+    updated_sessions = update_summaries()
+    print(f"Summarized {len(updated_sessions)} new or modified sessions")
+    session_summaries = load_summaries()
+    cohort = merge_summaries(list(session_summaries.values()))
+
+    # the numbers of analysis.py: the participants who finished all trials, and only the second block for the scenarios
+    all_trials = {"All.trials": True}
+    print("Accuracy per ToM order:", get_accuracy(cohort, "Level", all_trials).round(3).to_dict())
+    print("Accuracy per scenario:", get_accuracy(cohort, "Scenario", {"Block": 2, **all_trials}).round(3).to_dict())
+    print("Time per ToM order:")
+    print(pd.concat([get_time_moments(cohort, "Level", filters=all_trials),
+                     get_time_quantiles(cohort, "Level", filters=all_trials)], axis=1).round(2).to_string())
+    print("Accuracy per ToM order and session:")
+    print(compare_sessions(session_summaries, filters=all_trials).round(2).to_string())
@@ -1,11 +1,15 @@
 import pandas as pd
 import glob
+import os
+import sys
+from functools import lru_cache
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-
-matplotlib.use('TkAgg')
-matplotlib.rc('font', size=12)
+# folder of the modeling code, whose shared modules (answer codec, figure cache, chunk reader) the analysis modules
+# import once utilities is imported, from any working directory
+MODELING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modeling")
+if MODELING_DIR not in sys.path:
+    sys.path.append(MODELING_DIR)
+from answer_codec import MONTHS, DAYS, SPECIAL_ANSWERS, ANSWERS, ANSWER_CODES, N_CODES, MISSING_CODE, CODE_DTYPE
 
 
 def compute_mean_dict(d):
@@ -63,18 +67,99 @@ toy_to_bday = {v: k for (k, v) in toy.items()}
 hair_to_bday = {v: k for (k, v) in hair.items()}
 
 
+# scenario dictionaries, by the scenario name used in question_bank.csv
+SCENARIOS = {"birthday": birthday_original, "drink": drink, "toy": toy, "hair": hair}
+# compiled scenario tables: for each scenario, the answer (in that scenario) of every answer code of the birthday
+# scenario; the special answers ("No solution" etc.) are the same in all scenarios and keep their own code
+SCENARIO_ANSWERS = np.array([[f"{scenario_dict[month]}, {scenario_dict[str(day)]}" for month in MONTHS for day in DAYS]
+                             + SPECIAL_ANSWERS for scenario_dict in SCENARIOS.values()], dtype=object)
+# lookup table from (scenario, answer in that scenario) to the answer code in the birthday scenario
+SCENARIO_ANSWER_CODES = {(scenario, answer): code for scenario, answers in zip(SCENARIOS, SCENARIO_ANSWERS)
+                         for code, answer in enumerate(answers)}
+
+
+@lru_cache(maxsize=None)
+def compile_translation_key(transl_key):
+    """
+    Compile a translation key (mirroring of the months and days) into a lookup array over the answer codes
+
+    :param transl_key: the translation key, as the string found in question_bank.csv under Translation key
+    :return: array with the code of the translated answer for every answer code (special answers map to themselves)
+    """
+    config_key = eval(transl_key)
+    return np.array([ANSWER_CODES[f"{config_key[month]}, {config_key[str(day)]}"] for month in MONTHS for day in DAYS]
+                    + [ANSWER_CODES[answer] for answer in SPECIAL_ANSWERS])
+
+
+def translate_answers(answers, scenarios, transl_keys):
+    """
+    Translate answers to the original birthday scenario, all at once
+
+    :param answers: list or series of answers (as given in the scenario of their puzzle)
+    :param scenarios: list or series with the scenario of each answer
+    :param transl_keys: list or series with the translation key (string) of each answer
+    :return: array with the codes of the translated answers (see answer_codec); special answers keep their own code,
+    missing answers (or puzzles) get MISSING_CODE
+    """
+    answers, scenarios = pd.Series(list(answers), dtype=object), pd.Series(list(scenarios), dtype=object)
+    is_missing = answers.isna() | scenarios.isna() | pd.Series(list(transl_keys), dtype=object).isna()
+    codes = pd.Series(list(zip(scenarios, answers))).map(SCENARIO_ANSWER_CODES)
+    unknown = codes.isna() & ~is_missing
+    if unknown.any():
+        raise ValueError(f"Untranslatable answers: {sorted(set(answers[unknown]))}")
+
+    # one lookup array per distinct translation key, applied with a single fancy-indexing operation
+    key_idx, unique_keys = pd.factorize(pd.Series(list(transl_keys), dtype=object))
+    key_tables = np.stack([compile_translation_key(transl_key) for transl_key in unique_keys] +
+                          [np.full(N_CODES, MISSING_CODE)])
+    codes = codes.fillna(0).to_numpy(dtype=int)
+    translated = key_tables[np.where(is_missing, -1, key_idx), codes]
+    return np.where(is_missing, MISSING_CODE, translated).astype(CODE_DTYPE)
+
+
+def untranslate_answers(codes, scenarios, transl_keys):
+    """
+    Inverse of translate_answers: from the codes of answers in the birthday scenario to the answers in the scenario
+    (and mirroring) of their puzzle
+
+    :param codes: array of answer codes in the birthday scenario
+    :param scenarios: list or series with the scenario of each answer
+    :param transl_keys: list or series with the translation key (string) of each answer
+    :return: array of answers in the scenarios of the puzzles (None for missing answers)
+    """
+    codes = np.asarray(codes, dtype=int)
+    key_idx, unique_keys = pd.factorize(pd.Series(list(transl_keys), dtype=object))
+    inverse_tables = np.stack([np.argsort(compile_translation_key(transl_key)) for transl_key in unique_keys])
+    scenario_idx = pd.Series(range(len(SCENARIOS)), index=list(SCENARIOS)).reindex(list(scenarios)).to_numpy()
+    is_missing = (codes == MISSING_CODE) | (key_idx == -1) | np.isnan(scenario_idx)
+    scenario_codes = inverse_tables[np.where(is_missing, 0, key_idx), np.where(is_missing, 0, codes)]
+    return np.where(is_missing, None, SCENARIO_ANSWERS[np.nan_to_num(scenario_idx).astype(int), scenario_codes])
+
+
 def translate_answer(ans, scenario, config_key):
     """
     Given an answer to a puzzle and a scenario type, return the answer translated to the original birthday scenario
-    :param ans: original answer
+    :param ans: original answer, split into its two parts
     :param scenario: scenario type
     :param config_key: configuration key (mirroring), can be found in question_bank.csv under Translation key
     :return: the translated answer
     """
-    scenario_key = eval(f"{scenario}_to_bday")
-    new_answer = [scenario_key[x] for x in ans]
-    new_answer = [config_key[x] for x in new_answer]
-    return str(new_answer[0]) + ", " + str(new_answer[1])
+    code = compile_translation_key(str(config_key))[SCENARIO_ANSWER_CODES[(scenario, ", ".join(ans))]]
+    return ANSWERS[code]
+
+
+def add_puzzle_info(all_answers, all_questions):
+    """
+    Attach the level, scenario and translation key of each puzzle to the answers with a single merge on the puzzle
+    index (answers without a puzzle index, i.e. the p-beauty answers, get missing values)
+    :param all_answers: dataframe with the answers, with an "Index" column
+    :param all_questions: the question bank
+    :return: the answers with the "Level", "Scenario" and "Translation key" columns
+    """
+    puzzle_info = all_questions.set_index("IDX")[["Level of ToM", "Scenario", "Translation key"]].rename(
+        columns={"Level of ToM": "Level"})
+    all_answers = all_answers.drop(columns=puzzle_info.columns, errors="ignore")
+    return all_answers.join(puzzle_info, on="Index")
 
 
 def get_level_and_scen():
@@ -84,25 +169,55 @@ def get_level_and_scen():
     """
     all_questions = pd.read_csv("../interface/question_bank.csv")
     all_answers = pd.read_csv("All answers_all.csv")
-    all_answers.reset_index(inplace=True, drop=True)
-    all_answers["Level"] = None
-    all_answers["Scenario"] = None
-
-    # for each puzzle in "All answers_all"
-    for (idx, row) in all_answers.iterrows():
-        # find the level and scenario in "question_bank" based on a common index
-        if str(row["Index"]) != "nan":
-            all_answers["Level"].iloc[idx] = \
-                all_questions["Level of ToM"].loc[all_questions["IDX"] == row["Index"]].values[0]
-            all_answers["Scenario"].iloc[idx] = \
-                all_questions["Scenario"].loc[all_questions["IDX"] == row["Index"]].values[0]
+    columns = list(all_answers.columns)
+    all_answers = add_puzzle_info(all_answers, all_questions)
 
-    # update "All answers_all"
-    all_answers.to_csv("All answers_all.csv", index=False)
+    # update "All answers_all", keeping its columns (and their order)
+    for column in ["Level", "Scenario"]:
+        if column not in columns:
+            columns.append(column)
+    all_answers[columns].to_csv("All answers_all.csv", index=False)
 
 
 #########################PLOTTING HELP FUNCTIONS#################################################
 
+@lru_cache(maxsize=None)
+def get_pyplot():
+    """
+    Import and configure matplotlib the first time a figure is drawn (the answer tables do not need it)
+    :return: the matplotlib.pyplot module
+    """
+    import matplotlib
+    # render without a display by default; set MPLBACKEND (e.g. to TkAgg) to open figures in a window
+    matplotlib.use(os.environ.get("MPLBACKEND", "Agg"))
+    matplotlib.rc('font', size=12)
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def render_figure(function_name, args, kwargs):
+    """
+    Render one figure from its precomputed data
+    :param function_name: the name of the plotting function in this file
+    :param args: the positional arguments of the plotting function
+    :param kwargs: the keyword arguments of the plotting function (including title_save_file)
+    """
+    save_file = kwargs.get("title_save_file")
+    if save_file and os.path.dirname(save_file):
+        os.makedirs(os.path.dirname(save_file), exist_ok=True)
+    globals()[function_name](*args, **kwargs)
+    get_pyplot().close("all")
+
+
+def render_figures(figures):
+    """
+    Render a list of figures, see render_figure
+    :param figures: list of (plotting function name, arguments, keyword arguments)
+    """
+    for function_name, args, kwargs in figures:
+        render_figure(function_name, args, kwargs)
+
+
 def plot_bar(data_x, data_y, title_plot, x_label, y_label, y_range, x_range, title_save_file, orientation='vertical',
              chance_x=None, chance_y=None, rotation_x=90, rotation_y=0, bar_size=0.5):
     """
@@ -122,7 +237,7 @@ def plot_bar(data_x, data_y, title_plot, x_label, y_label, y_range, x_range, tit
     :param rotation_y: degree of rotation of the labels on the y-axis
     :param bar_size: width of the bars for vertical bar plots or height of the bars for horizontal bar plots
     """
-    plt.cla()
+    plt = get_pyplot()
     figure, ax = plt.subplots(nrows=1,
                               ncols=1,
                               figsize=(6, 2.5))
@@ -145,6 +260,7 @@ def plot_bar(data_x, data_y, title_plot, x_label, y_label, y_range, x_range, tit
         ax.hlines(chance_y, xmin=x_range[0], xmax=x_range[1], colors="gray", linestyles="dashed", linewidth=3)
     figure.tight_layout()
     figure.savefig(f"{title_save_file}.png", bbox_inches='tight')
+    plt.close(figure)
 
 
 def plot_multiple_bars_per_level(data_dict, x_label, title_plot, title_save_file):
@@ -155,7 +271,7 @@ def plot_multiple_bars_per_level(data_dict, x_label, title_plot, title_save_file
     :param title_plot: the title of the plot
     :param title_save_file: the name of the save file
     """
-    plt.cla()
+    plt = get_pyplot()
     figure, ax = plt.subplots(nrows=1,
                               ncols=1,
                               figsize=(6, 7))
@@ -178,6 +294,7 @@ def plot_multiple_bars_per_level(data_dict, x_label, title_plot, title_save_file
     ax.set_xticks(r + width, all_keys, rotation=90)
     ax.legend(all_bars, [f"{idx}-order puzzle" for idx in ["first", "second", "third", "fourth"]])
     figure.savefig(f"{title_save_file}.png", bbox_inches='tight')
+    plt.close(figure)
 
 
 def plot_violin(list_data, x_axis_levels, y_axis_levels, x_label, y_label, x_range, y_range, title_plot,
@@ -197,7 +314,7 @@ def plot_violin(list_data, x_axis_levels, y_axis_levels, x_label, y_label, x_ran
     :param rotation_x: degree of rotation of the labels on the x-axis
     :param rotation_y: degree of rotation of the labels on the y-axis
     """
-    plt.cla()
+    plt = get_pyplot()
     figure, ax = plt.subplots(nrows=1,
                               ncols=1,
                               figsize=(6, 1.75))
@@ -224,6 +341,7 @@ def plot_violin(list_data, x_axis_levels, y_axis_levels, x_label, y_label, x_ran
     if y_range:
         ax.set_ylim([y_range[0], y_range[1]])
     figure.savefig(f"{title_save_file}.png", bbox_inches='tight')
+    plt.close(figure)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+# months and days of the original birthday puzzle, to which the answers of all scenarios are translated
+MONTHS = ["May", "June", "July", "August", "September"]
+DAYS = [14, 15, 16, 17, 18]
+# answers that can be given to every puzzle, next to the dates
+SPECIAL_ANSWERS = ["Multiple solutions", "No solution", "I don't know"]
+# all possible answers, ordered by month and day; the code of an answer is its index in this list
+ANSWERS = [f"{month}, {day}" for month in MONTHS for day in DAYS] + SPECIAL_ANSWERS
+# the number of codes
+N_CODES = len(ANSWERS)
+# code of a missing answer
+MISSING_CODE = -1
+# the codes fit in one byte
+CODE_DTYPE = np.int8
+# lookup table from answer to code; the models abbreviate September (see utilities.format_text_states)
+ANSWER_CODES = {answer: code for code, answer in enumerate(ANSWERS)}
+ANSWER_CODES.update({f"Sept, {day}": ANSWER_CODES[f"September, {day}"] for day in DAYS})
+
+
+def encode_answers(answers):
+    """
+    Encode answers (translated to the birthday scenario) as integer codes
+
+    :param answers: list, array (of any shape) or series of answers; missing values get MISSING_CODE
+    :return: array of codes with the same shape as answers
+    """
+    answers = np.asarray(answers, dtype=object)
+    codes = pd.Series(answers.ravel()).map(ANSWER_CODES)
+    unknown = codes.isna() & pd.Series(answers.ravel()).notna()
+    if unknown.any():
+        raise ValueError(f"Unknown answers: {sorted(set(answers.ravel()[unknown.to_numpy()]))}")
+    return codes.fillna(MISSING_CODE).to_numpy(dtype=CODE_DTYPE).reshape(answers.shape)
+
+
+def decode_answers(codes):
+    """
+    Decode integer codes back to answers
+
+    :param codes: array (of any shape) of codes
+    :return: array of answers with the same shape as codes (None for missing answers)
+    """
+    codes = np.asarray(codes)
+    return np.where(codes == MISSING_CODE, None, np.array(ANSWERS, dtype=object)[codes])
+
+
+def count_codes(codes, group_idx=None, n_groups=1):
+    """
+    Count the occurrences of every code, optionally within groups, in one pass (missing answers are not counted)
+
+    :param codes: array of codes
+    :param group_idx: array with the group index of each code (if None, then all codes form one group)
+    :param n_groups: the number of groups
+    :return: array (groups x N_CODES) with the counts, or (N_CODES) if group_idx is None
+    """
+    codes = np.asarray(codes, dtype=int)
+    if group_idx is None:
+        return np.bincount(codes[codes != MISSING_CODE], minlength=N_CODES)
+    is_given = codes != MISSING_CODE
+    flat_idx = np.asarray(group_idx, dtype=int)[is_given] * N_CODES + codes[is_given]
+    return np.bincount(flat_idx, minlength=n_groups * N_CODES).reshape(n_groups, N_CODES)
@@ -0,0 +1,157 @@
+import os
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from fitting import CONFIG, SAVE_BOOL, get_likelihood_matrices, get_best_model_shares, compute_rfx_bms, \
+    compute_random_evidence, get_subject_arrays
+from utilities import plot_bar
+
+# number of bootstrap resamples
+N_RESAMPLES = 10_000
+# number of resamples processed together by one worker task
+CHUNK_SIZE = 250
+# root seed from which the independent random streams of all chunks are derived
+SEED = 42
+# confidence level of the percentile intervals
+CONFIDENCE = 0.95
+
+
+def load_bootstrap_data(name_likelihood_file="likelihoods", name_pred_file="predictions_tom"):
+    """
+    Load the cached prediction and likelihood tables and reshape them into the arrays needed for resampling
+
+    :param name_likelihood_file: the path to the likelihoods csv file
+    :param name_pred_file: the path to the predictions csv file
+    :return: the model names, the log-likelihood matrix (subjects x models), the correct rate matrix (subjects x
+    models) and the answer count matrix (subjects x answer codes)
+    """
+    likelihood_df = pd.read_csv(f"{name_likelihood_file}.csv")
+    pred_df = pd.read_csv(f"{name_pred_file}.csv")
+    subjects, model_names, log_likelihoods, correct_rates = get_likelihood_matrices(likelihood_df)
+    # count how many times each participant gave each answer, in the same subject order as the likelihoods
+    arrays = get_subject_arrays(pred_df)
+    answer_counts = arrays["answer_counts"][pd.Index(arrays["subjects"]).get_indexer(subjects)]
+    return model_names, log_likelihoods, correct_rates, answer_counts
+
+
+def evaluate_resamples(subj_idx, model_names, log_likelihoods, correct_rates, answer_counts):
+    """
+    Run the likelihood -> RFX-BMS -> best-model chain on a batch of resampled cohorts. Only the random model depends on
+    the answer distribution of the whole cohort, so only its evidence is recomputed per resample.
+
+    :param subj_idx: array of shape (number of resamples, number of subjects) with the indices of the drawn subjects
+    :param model_names: list of model names, in the column order of the matrices
+    :param log_likelihoods: the log-likelihood matrix (subjects x models)
+    :param correct_rates: the correct rate matrix (subjects x models)
+    :param answer_counts: the answer count matrix (subjects x answer codes)
+    :return: dictionary of statistic name -> array of shape (number of resamples, number of models)
+    """
+    random_idx = model_names.index("Random")
+    log_likelihoods = log_likelihoods[subj_idx]
+    correct_rates = correct_rates[subj_idx]
+    answer_counts = answer_counts[subj_idx]
+    # recompute the random model's evidence relative to the resampled population
+    log_likelihoods[..., random_idx], correct_rates[..., random_idx] = \
+        compute_random_evidence(answer_counts, answer_counts.sum(axis=-2))
+
+    alpha = compute_rfx_bms(log_likelihoods)
+    frequencies = alpha / alpha.sum(axis=-1, keepdims=True)
+
+    shares = get_best_model_shares(correct_rates)
+    is_best = shares > 0
+    best_rates = correct_rates.max(axis=-1)
+    only_random = is_best[..., random_idx] & (is_best.sum(axis=-1) == 1)
+
+    # mean coherence of the participants best described by each model, as in the coherence plots
+    with np.errstate(invalid="ignore"):
+        coherence = np.where(is_best, best_rates[..., np.newaxis], 0).sum(axis=-2) / is_best.sum(axis=-2)
+        coherence_non_random = np.where(only_random, 0, best_rates).sum(axis=-1) / (~only_random).sum(axis=-1)
+        coherence_random = np.where(only_random, best_rates, 0).sum(axis=-1) / only_random.sum(axis=-1)
+
+    # the model with the highest estimated frequency in each resample
+    best_model = np.zeros_like(frequencies, dtype=bool)
+    np.put_along_axis(best_model, frequencies.argmax(axis=-1)[..., np.newaxis], True, axis=-1)
+
+    return {"Estimated frequency": frequencies,
+            "Best-fitting proportion": shares.mean(axis=-2),
+            "Mean coherence": coherence,
+            "Probability best model": best_model.astype(float),
+            "Mean coherence (non-random)": coherence_non_random[..., np.newaxis],
+            "Mean coherence (random only)": coherence_random[..., np.newaxis]}
+
+
+def bootstrap_chunk(seed, n_resamples, model_names, log_likelihoods, correct_rates, answer_counts):
+    """
+    Draw and evaluate one chunk of subject-level bootstrap resamples with its own random stream
+
+    :param seed: the numpy SeedSequence of this chunk
+    :param n_resamples: the number of resamples in this chunk
+    :return: see evaluate_resamples
+    """
+    rng = np.random.default_rng(seed)
+    n_subjects = log_likelihoods.shape[0]
+    subj_idx = rng.integers(0, n_subjects, size=(n_resamples, n_subjects))
+    return evaluate_resamples(subj_idx, model_names, log_likelihoods, correct_rates, answer_counts)
+
+
+def bootstrap(name_likelihood_file="likelihoods", name_pred_file="predictions_tom", name_bootstrap_file="bootstrap",
+              n_resamples=N_RESAMPLES, chunk_size=CHUNK_SIZE, seed=SEED, n_workers=None, confidence=CONFIDENCE):
+    """
+    Compute subject-level bootstrap confidence intervals for the RFX-BMS frequencies, the best-fitting models and the
+    coherence values, reusing the cached prediction and likelihood tables. Every chunk of resamples gets an independent
+    random stream spawned from the same root seed, so the results do not depend on the number of workers.
+
+    :param name_likelihood_file: the path to the likelihoods csv file
+    :param name_pred_file: the path to the predictions csv file
+    :param name_bootstrap_file: file path where the confidence intervals will be saved
+    :param n_resamples: the number of bootstrap resamples
+    :param chunk_size: the number of resamples per worker task
+    :param seed: the root seed
+    :param n_workers: the number of worker processes (if None, then the number of CPUs)
+    :param confidence: the confidence level of the percentile intervals
+    :return: dataframe with the point estimate and the confidence interval for each statistic and model
+    """
+    model_names, log_likelihoods, correct_rates, answer_counts = load_bootstrap_data(name_likelihood_file,
+                                                                                     name_pred_file)
+    chunk_sizes = [chunk_size] * (n_resamples // chunk_size)
+    if n_resamples % chunk_size:
+        chunk_sizes.append(n_resamples % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    tasks = [(chunk_seed, size, model_names, log_likelihoods, correct_rates, answer_counts)
+             for chunk_seed, size in zip(seeds, chunk_sizes)]
+    with Pool(n_workers or os.cpu_count()) as pool:
+        chunks = pool.starmap(bootstrap_chunk, tasks)
+
+    # the point estimates are the statistics of the original cohort (the identity resample)
+    original_idx = np.arange(log_likelihoods.shape[0])[np.newaxis, :]
+    estimates = evaluate_resamples(original_idx, model_names, log_likelihoods, correct_rates, answer_counts)
+
+    rows = []
+    tail = (1 - confidence) / 2 * 100
+    for statistic, estimate in estimates.items():
+        resamples = np.concatenate([chunk[statistic] for chunk in chunks])
+        lower, upper = np.nanpercentile(resamples, [tail, 100 - tail], axis=0)
+        # for the best model, report how often each model wins over the resamples instead of an interval
+        if statistic == "Probability best model":
+            estimate = resamples.mean(axis=0, keepdims=True)
+            lower, upper = np.full_like(lower, np.nan), np.full_like(upper, np.nan)
+        names = model_names if estimate.shape[-1] == len(model_names) else [""]
+        for k, model_name in enumerate(names):
+            rows.append([statistic, model_name, estimate[0, k], lower[k], upper[k]])
+
+    bootstrap_df = pd.DataFrame(rows, columns=["Statistic", "Model.name", "Estimate", "CI.lower", "CI.upper"])
+    bootstrap_df.to_csv(f"{name_bootstrap_file}.csv", index=False)
+    return bootstrap_df
+
+
+if __name__ == "__main__":
+    df = bootstrap()
+    print(df.round(3).to_string(index=False))
+
+    # if SAVE_BOOL set to True, then plot the RFX-BMS results with their confidence intervals
+    if SAVE_BOOL:
+        freq_df = df.loc[df["Statistic"] == "Estimated frequency"].sort_values("Model.name")
+        plot_bar(dict(zip(freq_df["Model.name"], freq_df["Estimate"])), "Proportion of fit for each strategy", "Model",
+                 "Proportion of population", (0, 0.8), (0, len(freq_df)), f"plots/propfit_{CONFIG}_bootstrap",
+                 rotation_x=45, y_err=[freq_df["Estimate"] - freq_df["CI.lower"],
+                                       freq_df["CI.upper"] - freq_df["Estimate"]])
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+from puzzle_formalism import Puzzle
+from epistemic_model import EpistemicModel
+from fitting import get_model_configs
+from formula import PublicAnnouncement
+
+# cost of looking up the worlds that an agent considers possible in a world
+LOOKUP_COST = 1
+# cost of evaluating the propositional atom (the agent knows the birthday) in one world
+WORLD_COST = 1
+# budgets to sweep over
+BUDGET_GRID = list(range(0, 401, 5))
+# answer given when the budget runs out before the puzzle is solved
+GIVE_UP_ANSWER = "I don't know"
+
+
+class BudgetExhausted(Exception):
+    """
+    Raised by BoundedSolver when the budget runs out
+    """
+    pass
+
+
+class BoundedSolver(EpistemicModel):
+    def __init__(self, max_iter, max_tom_level, curr_tom_level, puzzle, lookup_cost=LOOKUP_COST,
+                 world_cost=WORLD_COST):
+        """
+        Resource-bounded version of the epistemic (and cutting) model: every accessibility lookup and every world
+        evaluated has a cost, and the solver gives up when a budget runs out
+        """
+        super().__init__(max_iter, max_tom_level, curr_tom_level, puzzle)
+        self.lookup_cost = lookup_cost
+        self.world_cost = world_cost
+        # the cost spent so far and the budget of the current run (if None, then the budget is unlimited)
+        self.cost = 0
+        self.budget = None
+
+    def charge(self, cost):
+        """
+        Spend part of the budget
+
+        :param cost: the cost to spend
+        """
+        self.cost += cost
+        if self.budget is not None and self.cost > self.budget:
+            raise BudgetExhausted
+
+    def get_accessible_worlds(self, relations, world):
+        """
+        Same as EpistemicModel.get_accessible_worlds, but charges lookup_cost
+        """
+        self.charge(self.lookup_cost)
+        return super().get_accessible_worlds(relations, world)
+
+    def check_validity(self, list_accessible_worlds, flag_negate=False):
+        """
+        Same as EpistemicModel.check_validity, but charges world_cost for every world evaluated
+        """
+        self.charge(self.world_cost * len(list_accessible_worlds))
+        return super().check_validity(list_accessible_worlds, flag_negate=flag_negate)
+
+    def trace_model(self, init_graph, budget=None, model_level=None, cutting_direction="lr", flag_not_reverse=True):
+        """
+        Processes the public announcements one by one (as EpistemicModel.run_model_once) and records the cost spent and
+        the answer after each of them, until all announcements are processed or the budget runs out
+
+        :param init_graph: the initial Kripke graph on which the public announcements are applied
+        :param budget: the budget (if None, then the budget is unlimited)
+        :param model_level: see EpistemicModel.run_model_once
+        :param cutting_direction: see EpistemicModel.run_model_once
+        :param flag_not_reverse: see EpistemicModel.run_model_once
+        :return: list of (cumulative cost, answer) pairs, one per completed announcement
+        """
+        self.cost = 0
+        self.budget = budget
+        self.curr_states = {node: False for node in list(init_graph)}
+        trace = []
+        try:
+            for ann in self.puzzle.all_announcements[self.curr_level]:
+                # check that announcement is of the correct type
+                if not isinstance(ann, PublicAnnouncement):
+                    raise TypeError("Public announcement must be of type PublicAnnouncement!")
+                # potentially cut off operators
+                if model_level:
+                    ann = self.cut_operators(ann.formula, model_level, cutting_direction)
+                self.process_announcement(ann.formula, self.curr_states)
+                graph = self.update_model(init_graph, flag_not_reverse)
+                # remove inconsistencies in naming for the month September (as in fitting.get_prediction_one_model)
+                trace.append((self.cost, self.get_answer(graph).replace("Sept", "September")))
+        except BudgetExhausted:
+            pass
+        finally:
+            self.budget = None
+        return trace
+
+    def run_model_once(self, init_graph, budget=None, partial_answer=True, **kwargs):
+        """
+        Solve the puzzle within a budget
+
+        :param init_graph: the initial Kripke graph on which the public announcements are applied
+        :param budget: the budget (if None, then the budget is unlimited)
+        :param partial_answer: see get_budget_answers
+        :param kwargs: arguments for trace_model (model_level, cutting_direction, flag_not_reverse)
+        :return: the answer
+        """
+        trace = self.trace_model(init_graph, budget=budget, **kwargs)
+        return self.get_budget_answers(trace, [np.inf], len(self.puzzle.all_announcements[self.curr_level]),
+                                       partial_answer=partial_answer)[0]
+
+    @staticmethod
+    def get_budget_answers(trace, budgets, n_announcements, partial_answer=True):
+        """
+        Answers for many budgets at once from the trace of one unbounded run: the answer for a budget only depends on
+        the number of announcements completed within it
+
+        :param trace: see trace_model
+        :param budgets: list of budgets
+        :param n_announcements: the number of public announcements of the puzzle
+        :param partial_answer: if True, then a solver that runs out of budget answers with the model left after the
+        completed announcements if it has at most one state; otherwise (or if several states are left) it answers
+        GIVE_UP_ANSWER
+        :return: list with one answer per budget
+        """
+        costs = np.array([cost for cost, _ in trace])
+        n_completed = np.searchsorted(costs, budgets, side="right")
+        answers = []
+        for n in n_completed:
+            if n == n_announcements:
+                answers.append(trace[-1][1])
+            elif partial_answer and n > 0 and trace[n - 1][1] != "Multiple solutions":
+                answers.append(trace[n - 1][1])
+            else:
+                answers.append(GIVE_UP_ANSWER)
+        return answers
+
+
+def predict_budget_answers(budgets=BUDGET_GRID, max_pa_tom_level=3, partial_answer=True):
+    """
+    Sweep the budget for all models and levels of ToM; every model is traced once per level and all budgets are
+    answered from that trace
+
+    :param budgets: list of budgets
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :param partial_answer: see BoundedSolver.get_budget_answers
+    :return: dataframe with one row per level of ToM, model and budget, and the cost of the full solution
+    """
+    cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
+    rows = []
+    for level in range(len(cb.all_states)):
+        solver = BoundedSolver(1, max_pa_tom_level, level, cb)
+        for model_name, kwargs in get_model_configs(max_pa_tom_level).items():
+            trace = solver.trace_model(solver.generate_full_model(), **kwargs)
+            answers = solver.get_budget_answers(trace, budgets, len(cb.all_announcements[level]),
+                                                partial_answer=partial_answer)
+            rows += [[level + 1, model_name, budget, answer, trace[-1][0]] for budget, answer in zip(budgets, answers)]
+    return pd.DataFrame(rows, columns=["ToM.level", "Model.name", "Budget", "Model.answer", "Full.cost"])
+
+
+def relate_budgets_to_time(name_budget_file="budget_time", budgets=BUDGET_GRID, max_pa_tom_level=3,
+                           partial_answer=True):
+    """
+    Relate the budgets to the time participants spent on each puzzle: for every answer and model, find the smallest
+    budget for which the model gives the participant's answer, and correlate it with the time (Spearman)
+
+    :param name_budget_file: file path where the budget of every answer will be saved
+    :param budgets: list of budgets
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :param partial_answer: see BoundedSolver.get_budget_answers
+    :return: dataframe with one row per answer and model, and dataframe with the correlation per model
+    """
+    from scipy.stats import spearmanr
+
+    budget_df = predict_budget_answers(budgets, max_pa_tom_level, partial_answer)
+    # smallest budget per (level, model, answer): budgets are sorted, so the first occurrence is the smallest
+    min_budget = budget_df.drop_duplicates(["ToM.level", "Model.name", "Model.answer"]).rename(
+        columns={"ToM.level": "Level", "Model.answer": "Translated.answer", "Budget": "Min.budget"})
+
+    subj_df = pd.read_csv("../analysis/All answers_puzzles.csv")[["Subject.id", "Trial", "Level", "Time",
+                                                                   "Translated.answer"]]
+    answer_df = subj_df.merge(pd.DataFrame({"Model.name": budget_df["Model.name"].unique()}), how="cross")
+    answer_df = answer_df.merge(min_budget[["Level", "Model.name", "Translated.answer", "Min.budget"]],
+                                on=["Level", "Model.name", "Translated.answer"], how="left")
+    answer_df.to_csv(f"{name_budget_file}.csv", index=False)
+
+    rows = []
+    for model_name, model_df in answer_df.groupby("Model.name", sort=False):
+        explained_df = model_df.dropna(subset=["Min.budget"])
+        rho, p_value = spearmanr(explained_df["Min.budget"], explained_df["Time"])
+        rows.append([model_name, len(explained_df), rho, p_value])
+    correlation_df = pd.DataFrame(rows, columns=["Model.name", "N.answers", "Spearman.rho", "P.value"])
+    return answer_df, correlation_df
+
+
+if __name__ == "__main__":
+    df = predict_budget_answers()
+    print(df.drop_duplicates(["ToM.level", "Model.name", "Model.answer"]).to_string(index=False))
+    _, corr_df = relate_budgets_to_time()
+    print(corr_df.to_string(index=False))
@@ -0,0 +1,41 @@
+import resource
+import numpy as np
+import pandas as pd
+
+# number of rows read at once by the streaming mode (a chunk holds a few more rows: those of its last participant)
+CHUNK_SIZE = 500_000
+
+
+def read_subject_chunks(file_path, subject_column, chunk_size=CHUNK_SIZE, **read_csv_kwargs):
+    """
+    Read a csv file in chunks of about chunk_size rows that never split the rows of a participant, so that every
+    per-participant variable (trial number, number of answers, likelihood) can be computed within one chunk. The rows
+    of a participant must be consecutive in the file, as in the store and in all files written from it.
+
+    :param file_path: the path to the csv file
+    :param subject_column: the column with the participant id
+    :param chunk_size: the number of rows read at once
+    :param read_csv_kwargs: keyword arguments of pandas.read_csv (e.g. usecols or dtype)
+    :return: generator of dataframes, each with all rows of its participants
+    """
+    carry = None
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size, **read_csv_kwargs):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        # the last participant of the chunk may continue in the next one: keep their rows for the next chunk
+        subjects = chunk[subject_column].to_numpy()
+        other_rows = np.flatnonzero(subjects != subjects[-1])
+        split = other_rows[-1] + 1 if len(other_rows) else 0
+        carry = chunk.iloc[split:]
+        if split > 0:
+            yield chunk.iloc[:split]
+    if carry is not None and len(carry):
+        yield carry
+
+
+def get_peak_rss():
+    """
+    :return: the peak resident memory of the current process so far, in MB
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
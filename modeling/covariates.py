@@ -0,0 +1,162 @@
+import re
+import numpy as np
+import pandas as pd
+from fitting import get_likelihood_matrices, compute_rfx_bms
+
+# background-form file with one row per answer and the form answers repeated on every row
+BACKGROUND_FILE = "../analysis/All answers_all.csv"
+# covariates taken from the background form and whether they are categorical or numerical
+COVARIATES = {"Logic course": "categorical", "Know puzzle?": "categorical", "Study program": "categorical",
+              "Age": "numerical", "Difficulty puzzle": "numerical", "Difficulty instructions": "numerical"}
+# the study programs are free text; they are grouped by the first pattern (lowercase) that matches, else "Other"
+STUDY_PROGRAM_GROUPS = {r"biolog|biomedical": "Life sciences",
+                        r"business|bedrijfskunde|economics": "Business & economics",
+                        r"engineering|engineerig|\biem\b": "Engineering",
+                        r"physics|astronomy|math": "Physics & mathematics",
+                        r"psych": "Psychology",
+                        r"computing|artificial|\bai\b": "Computing science & AI"}
+# standard deviation of the Gaussian prior on the regression weights; it plays the role of the Dirichlet prior of
+# RFX-BMS and keeps the weights finite for small groups
+PRIOR_SD = 2.0
+
+
+def group_study_program(study_program):
+    """
+    Map a free-text study program to one of the groups in STUDY_PROGRAM_GROUPS
+
+    :param study_program: the answer of the participant
+    :return: the name of the group
+    """
+    for pattern, group in STUDY_PROGRAM_GROUPS.items():
+        if re.search(pattern, str(study_program).lower()):
+            return group
+    return "Other"
+
+
+def load_subject_covariates(subjects, covariates=COVARIATES, background_file=BACKGROUND_FILE):
+    """
+    Build the table of covariates with one row per participant, indexed by subject id. The background form is reduced
+    to one row per participant once and then aligned with the given subjects by a single reindex.
+
+    :param subjects: list of subject ids, in the order of the likelihood matrix
+    :param covariates: dictionary of covariate name -> "categorical" or "numerical"
+    :param background_file: the path to the background-form csv file
+    :return: dataframe (subjects x covariates)
+    """
+    background_df = pd.read_csv(background_file).drop_duplicates("Subject id").set_index("Subject id")
+    covariate_df = background_df[list(covariates)].reindex(subjects)
+    if "Study program" in covariates:
+        covariate_df["Study program"] = covariate_df["Study program"].map(group_study_program)
+    return covariate_df
+
+
+def get_design_matrix(covariate_df, covariates=COVARIATES):
+    """
+    Encode the covariates as a design matrix: an intercept, one indicator per non-reference level of each categorical
+    covariate (the first level in alphabetical order is the reference) and the standardized numerical covariates
+
+    :param covariate_df: dataframe (subjects x covariates), see load_subject_covariates
+    :param covariates: dictionary of covariate name -> "categorical" or "numerical"
+    :return: the design matrix (subjects x columns) and the list of column names
+    """
+    columns = {"Intercept": np.ones(len(covariate_df))}
+    for name, kind in covariates.items():
+        if kind == "categorical":
+            dummies = pd.get_dummies(covariate_df[name].astype(str), prefix=name, prefix_sep=": ", drop_first=True)
+            columns.update({col: dummies[col].to_numpy(dtype=float) for col in dummies.columns})
+        else:
+            values = covariate_df[name].astype(float)
+            columns[name] = ((values - values.mean()) / values.std()).fillna(0).to_numpy()
+    return np.column_stack(list(columns.values())), list(columns)
+
+
+def fit_covariate_rfx_bms(log_likelihoods, design, prior_sd=PRIOR_SD, converge_diff=1e-6, max_iter=1000):
+    """
+    Random-effects model selection where the prior probability of each participant using each model is a
+    multinomial-logistic function of their covariates, instead of one Dirichlet shared by everyone. Fitted with EM:
+    the E-step computes the posterior model assignment of all participants at once, the M-step fits the regression
+    weights on these soft assignments under a Gaussian prior.
+
+    :param log_likelihoods: array (subjects x models), see get_likelihood_matrices
+    :param design: the design matrix (subjects x columns), see get_design_matrix
+    :param prior_sd: standard deviation of the Gaussian prior on the weights
+    :param converge_diff: stop iterating when the log-posterior improves by this value or less
+    :param max_iter: the maximum number of EM iterations
+    :return: dictionary with the "weights" (columns x models), the prior model probabilities of each participant
+    "frequencies" (subjects x models), the posterior "assignments" (subjects x models) and the "log-posterior"
+    """
+    from scipy.optimize import minimize
+    from scipy.special import logsumexp, softmax
+
+    n_columns, n_models = design.shape[1], log_likelihoods.shape[1]
+
+    def negative_objective(flat_weights, assignments):
+        # negative expected complete-data log-posterior and its gradient with respect to the weights
+        weights = flat_weights.reshape(n_columns, n_models)
+        logits = design @ weights
+        log_probs = logits - logsumexp(logits, axis=1, keepdims=True)
+        value = -(assignments * log_probs).sum() + (weights ** 2).sum() / (2 * prior_sd ** 2)
+        gradient = design.T @ (np.exp(log_probs) - assignments) + weights / prior_sd ** 2
+        return value, gradient.ravel()
+
+    weights = np.zeros((n_columns, n_models))
+    prev_objective = -np.inf
+    for _ in range(max_iter):
+        # E-step: posterior probability of each model for each participant
+        logits = design @ weights
+        log_joint = log_likelihoods + logits - logsumexp(logits, axis=1, keepdims=True)
+        log_evidence = logsumexp(log_joint, axis=1, keepdims=True)
+        assignments = np.exp(log_joint - log_evidence)
+        objective = log_evidence.sum() - (weights ** 2).sum() / (2 * prior_sd ** 2)
+
+        # M-step: multinomial-logistic regression on the soft assignments
+        weights = minimize(negative_objective, weights.ravel(), args=(assignments,), jac=True,
+                           method="L-BFGS-B").x.reshape(n_columns, n_models)
+
+        if objective - prev_objective <= converge_diff:
+            break
+        prev_objective = objective
+
+    return {"weights": weights, "frequencies": softmax(design @ weights, axis=1),
+            "assignments": assignments, "log-posterior": objective}
+
+
+def covariate_rfx_bms(name_likelihood_file="likelihoods", name_weights_file="covariate_weights",
+                      name_frequencies_file="covariate_frequencies", covariates=COVARIATES, prior_sd=PRIOR_SD):
+    """
+    Estimate the model frequencies as a function of the participants' covariates and save the regression weights and
+    the mean model frequencies within each level of the categorical covariates, next to the RFX-BMS frequencies of the
+    whole population
+
+    :param name_likelihood_file: the path to the likelihoods csv file
+    :param name_weights_file: file path where the regression weights will be saved
+    :param name_frequencies_file: file path where the model frequencies per covariate level will be saved
+    :param covariates: dictionary of covariate name -> "categorical" or "numerical"
+    :param prior_sd: standard deviation of the Gaussian prior on the weights
+    :return: the dataframes with the weights and with the frequencies
+    """
+    subjects, model_names, log_likelihoods, _ = get_likelihood_matrices(pd.read_csv(f"{name_likelihood_file}.csv"))
+    covariate_df = load_subject_covariates(subjects, covariates=covariates)
+    design, column_names = get_design_matrix(covariate_df, covariates=covariates)
+    fit = fit_covariate_rfx_bms(log_likelihoods, design, prior_sd=prior_sd)
+
+    weights_df = pd.DataFrame(fit["weights"], index=pd.Index(column_names, name="Covariate"), columns=model_names)
+    weights_df.to_csv(f"{name_weights_file}.csv")
+
+    alpha = compute_rfx_bms(log_likelihoods)
+    rows = [["RFX-BMS", "All", len(subjects)] + list(alpha / alpha.sum()),
+            ["Covariates", "All", len(subjects)] + list(fit["frequencies"].mean(axis=0))]
+    for name, kind in covariates.items():
+        if kind != "categorical":
+            continue
+        for value, subj_idx in covariate_df.reset_index().groupby(name).indices.items():
+            rows.append([name, value, len(subj_idx)] + list(fit["frequencies"][subj_idx].mean(axis=0)))
+    frequencies_df = pd.DataFrame(rows, columns=["Covariate", "Value", "N"] + model_names)
+    frequencies_df.to_csv(f"{name_frequencies_file}.csv", index=False)
+    return weights_df, frequencies_df
+
+
+if __name__ == "__main__":
+    weights, frequencies = covariate_rfx_bms()
+    print(weights.round(3).to_string())
+    print(frequencies.round(3).to_string(index=False))
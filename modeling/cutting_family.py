@@ -0,0 +1,191 @@
+from itertools import combinations, product
+import pandas as pd
+from formula import NOT, KNOW, PropositionalAtom
+from puzzle_formalism import Puzzle
+from epistemic_model import EpistemicModel
+from utilities import format_text_states
+from answer_codec import ANSWERS, ANSWER_CODES
+
+
+def enumerate_cutting_strategies(max_pa_tom_level=3):
+    """
+    Enumerate every way of cutting knowledge operators: a model that processes at most model_level levels of ToM
+    removes, from every announcement of ToM level n > model_level, a subset of n - model_level of its knowledge
+    operators (identified by their depth, 0 being the outermost). One subset is chosen for every n.
+
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :return: dictionary of model name -> (model_level, dictionary of announcement ToM level -> removed depths); the
+    strategies that always remove the outermost (innermost) operators keep the names of the "lr" ("rl") cutting models
+    """
+    strategies = {"Epistemic": (0, {})}
+    for model_level in range(1, max_pa_tom_level):
+        tom_levels = list(range(model_level + 1, max_pa_tom_level + 1))
+        for subsets in product(*[combinations(range(n), n - model_level) for n in tom_levels]):
+            if all(subset == tuple(range(len(subset))) for subset in subsets):
+                suffix = "lr"
+            elif all(subset == tuple(range(n - len(subset), n)) for n, subset in zip(tom_levels, subsets)):
+                suffix = "rl"
+            else:
+                suffix = ",".join("".join(str(depth) for depth in subset) for subset in subsets)
+            strategies[f"Cut {model_level}-{suffix}"] = (model_level, dict(zip(tom_levels, subsets)))
+    return strategies
+
+
+def remove_operators(solver, formula, depths):
+    """
+    Remove the knowledge operators at the given depths of a formula (with the same rules as the cutting models,
+    i.e. a negation directly in front of a removed operator is removed as well)
+
+    :param solver: an EpistemicModel, whose remove_operator_at_depth is used
+    :param formula: the formula
+    :param depths: the depths of the operators to be removed
+    :return: the cut formula
+    """
+    # removing the deepest operators first keeps the depths of the remaining ones unchanged
+    for depth in sorted(depths, reverse=True):
+        formula = solver.remove_operator_at_depth(formula, depth)
+    return formula
+
+
+class CuttingFamilyEvaluator:
+    def __init__(self, puzzle, max_pa_tom_level=3):
+        """
+        Evaluates the announcements of all cutting strategies on all puzzles, sharing every evaluation that the
+        strategies have in common. The evaluation is a DAG whose nodes are (sub)formulas evaluated on a set of worlds
+        within a Kripke model: a node is computed once and then looked up by every strategy and announcement that
+        reaches it. The semantics are those of EpistemicModel.process_announcement.
+        """
+        self.puzzle = puzzle
+        self.agents = list(puzzle.players.values())
+        # one solver per ToM level, for the initial accessibility relations and the cutting of operators
+        self.solvers = [EpistemicModel(1, max_pa_tom_level, level, puzzle) for level in range(len(puzzle.all_states))]
+        # evaluated nodes: (level, model, formula, worlds, negated) -> whether the worlds are marked for removal
+        self.removal_cache = {}
+        # applied announcements: (level, model, formula) -> model after the announcement
+        self.update_cache = {}
+
+    def get_accessible_worlds(self, level, model, agent, world):
+        """
+        Find the worlds that an agent considers possible in a world, among the worlds left in the model
+
+        :param level: the ToM level of the puzzle
+        :param model: frozenset of the worlds left in the Kripke model
+        :param agent: the agent
+        :param world: the world
+        :return: frozenset of the accessible worlds
+        """
+        relations = self.solvers[level].all_uncertainty[level][self.agents.index(agent)]
+        return frozenset(y for (x, y) in relations if x == world and y in model)
+
+    def is_removed(self, level, model, formula, worlds, negated=False):
+        """
+        Memoized version of EpistemicModel.process_announcement for a set of worlds
+
+        :param level: the ToM level of the puzzle
+        :param model: frozenset of the worlds left in the Kripke model
+        :param formula: the formula
+        :param worlds: frozenset of the worlds where the formula is tested
+        :param negated: whether the formula is negated
+        :return: True if the worlds are marked for removal
+        """
+        key = (level, model, str(formula), worlds, negated)
+        if key not in self.removal_cache:
+            if isinstance(formula, PropositionalAtom):
+                result = EpistemicModel.check_validity(worlds, flag_negate=negated)
+            elif isinstance(formula, NOT):
+                result = self.is_removed(level, model, formula.formula, worlds, not negated)
+            elif isinstance(formula, KNOW):
+                result = any(self.is_removed(level, model, formula.formula,
+                                             self.get_accessible_worlds(level, model, formula.agent, world), negated)
+                             for world in worlds)
+            else:
+                raise NotImplementedError("Operator logic in is_removed not implemented")
+            self.removal_cache[key] = result
+        return self.removal_cache[key]
+
+    def announce(self, level, model, formula, negated=False):
+        """
+        Apply a public announcement: remove the worlds where it is marked as not valid
+
+        :param level: the ToM level of the puzzle
+        :param model: frozenset of the worlds left in the Kripke model
+        :param formula: the formula of the announcement
+        :param negated: whether the formula is negated
+        :return: frozenset of the worlds left after the announcement
+        """
+        key = (level, model, str(formula), negated)
+        if key not in self.update_cache:
+            if isinstance(formula, NOT):
+                new_model = self.announce(level, model, formula.formula, not negated)
+            elif isinstance(formula, KNOW):
+                new_model = frozenset(world for world in model if not self.is_removed(
+                    level, model, formula.formula, self.get_accessible_worlds(level, model, formula.agent, world),
+                    negated))
+            else:
+                # a propositional atom at the top-most level does not mark any single world
+                new_model = model
+            self.update_cache[key] = new_model
+        return self.update_cache[key]
+
+    def solve(self, level, model_level, removed_depths):
+        """
+        Solve the puzzle of a ToM level with one cutting strategy
+
+        :param level: the ToM level of the puzzle (starting from 0)
+        :param model_level: the maximum ToM level processed by the strategy (0 means that cutting is disabled)
+        :param removed_depths: dictionary of announcement ToM level -> depths of the removed knowledge operators
+        :return: the answer, as in EpistemicModel.get_answer (with September written in full)
+        """
+        model = frozenset(range(len(self.puzzle.all_states[level])))
+        for announcement in self.puzzle.all_announcements[level]:
+            formula = announcement.formula
+            if model_level and formula.tom_level > model_level:
+                formula = remove_operators(self.solvers[level], formula, removed_depths[formula.tom_level])
+            model = self.announce(level, model, formula)
+
+        if len(model) == 0:
+            return "No solution"
+        elif len(model) == 1:
+            answer = format_text_states(self.puzzle.all_states[level][next(iter(model))])
+            return ANSWERS[ANSWER_CODES[answer]]
+        return "Multiple solutions"
+
+
+def predict_family_answers(max_pa_tom_level=3):
+    """
+    Compute the answers of all cutting strategies to the original birthday puzzle of every ToM level (to which all
+    puzzles of the question bank are translated) in one pass over a shared evaluator
+
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :return: dictionary of ToM level (starting from 1) -> dictionary of model name -> answer
+    """
+    cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
+    evaluator = CuttingFamilyEvaluator(cb, max_pa_tom_level)
+    strategies = enumerate_cutting_strategies(max_pa_tom_level)
+    return {level + 1: {model_name: evaluator.solve(level, model_level, removed_depths)
+                        for model_name, (model_level, removed_depths) in strategies.items()}
+            for level in range(len(cb.all_states))}
+
+
+def generate_family_predictions(name_predictions_file="predictions_cutting", max_pa_tom_level=3):
+    """
+    Generates the prediction file of the whole cutting family, in the same format as generate_all_predictions, so that
+    the likelihood and RFX-BMS stages can be run on it unchanged
+
+    :param name_predictions_file: path to file to save predictions in
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    """
+    # imported here, since fitting.py is not needed to compute the answers themselves
+    from fitting import predict_answers
+    subj_df = pd.read_csv("../analysis/All answers_puzzles.csv")
+    questions_df = pd.read_csv("../interface/question_bank.csv")
+    predictions_df = predict_answers(subj_df, questions_df, max_pa_tom_level=max_pa_tom_level,
+                                     level_predictions=predict_family_answers(max_pa_tom_level))
+    predictions_df.to_csv(f"{name_predictions_file}.csv", index=False)
+
+
+if __name__ == "__main__":
+    for level, answers in predict_family_answers().items():
+        print(f"Level of ToM: {level}")
+        for model_name, answer in answers.items():
+            print(f"\t{model_name}: {answer}")
@@ -106,22 +106,8 @@ class EpistemicModel(Solver):
         nodes_to_remove = [node for node in self.curr_states.keys() if self.curr_states[node] is flag_not_reverse]
 
         if draw:
-            # make yellow all nodes to be removed
-            for node in nodes_to_remove:
-                self.init_graph.nodes[node]['node_color'] = 'yellow'
-
-            # for the nodes to be removed, make reflexive arrows white (otherwise, the drawing does not look as
-            # intended)
-            for edge in self.init_graph.edges:
-                if (edge[0] in nodes_to_remove or edge[1] in nodes_to_remove) and edge[0] == edge[1]:
-                    self.init_graph.edges[edge]['color'] = 'white'
-
-            # remove all edges (except reflexive) from and to the nodes to be removed
-            self.init_graph.remove_edges_from([edge for edge in self.init_graph.edges if (edge[0] in nodes_to_remove
-                                               or edge[1] in nodes_to_remove) and edge[0] != edge[1]])
-
             # draw graph
-            draw_model(self.init_graph, f"{save_file_name}_{UPDATE_COUNT}")
+            draw_model(self.mark_removed_states(nodes_to_remove), f"{save_file_name}_{UPDATE_COUNT}")
 
         # remove nodes where the public announcement formula does not hold
         graph.remove_nodes_from([node for node in self.curr_states.keys()
@@ -133,6 +119,29 @@ class EpistemicModel(Solver):
             self.update_uncertainty(idx_player, self.curr_states.keys())
         return graph
 
+    def mark_removed_states(self, nodes_to_remove):
+        """
+        Marks the states removed by a public announcement in the drawing of the Kripke model (self.init_graph): the
+        states become yellow and lose their edges
+
+        :param nodes_to_remove: the states removed by the public announcement
+        :return: the marked graph, as drawn by utilities.draw_model
+        """
+        # make yellow all nodes to be removed
+        for node in nodes_to_remove:
+            self.init_graph.nodes[node]['node_color'] = 'yellow'
+
+        # for the nodes to be removed, make reflexive arrows white (otherwise, the drawing does not look as
+        # intended)
+        for edge in self.init_graph.edges:
+            if (edge[0] in nodes_to_remove or edge[1] in nodes_to_remove) and edge[0] == edge[1]:
+                self.init_graph.edges[edge]['color'] = 'white'
+
+        # remove all edges (except reflexive) from and to the nodes to be removed
+        self.init_graph.remove_edges_from([edge for edge in self.init_graph.edges if (edge[0] in nodes_to_remove
+                                           or edge[1] in nodes_to_remove) and edge[0] != edge[1]])
+        return self.init_graph
+
     def cut_operators(self, formula, wanted_level, cutting_direction):
         """
         Main logic for the cut operator model: recursively remove one random knowledge operator from a formula until
@@ -196,7 +205,7 @@ class EpistemicModel(Solver):
             raise NotImplementedError("Operator logic in remove_operator_at_death not implemented")
 
     def run_model_once(self, init_graph, model_level=None, cutting_direction="lr", flag_not_reverse=True, draw=False,
-                       save_file_name="temp"):
+                       save_file_name="temp", return_distribution=False, multiple_weight=1.0):
         """
         Processes all public announcement and updates the Kripke model
 
@@ -209,6 +218,10 @@ class EpistemicModel(Solver):
         :param draw: if True then the intermediary Kripke models after each public announcement is drawn and saved to
         a png
         :param save_file_name: the path to save the pngs at (applicable if draw is set to True)
+        :param return_distribution: if True, then a probability distribution over the answer codes is returned instead
+        of a single answer (see get_answer_distribution)
+        :param multiple_weight: the probability of answering "Multiple solutions" if several states are left (applicable
+        if return_distribution is set to True)
         :return: the left-over state(s) after all public announcement have been applied
         """
         assert len(self.puzzle.all_announcements[self.curr_level]), \
@@ -229,6 +242,8 @@ class EpistemicModel(Solver):
             # update the Kripke graph
             updated_graph = self.update_model(init_graph, flag_not_reverse, draw, save_file_name)
 
+        if return_distribution:
+            return self.get_answer_distribution(updated_graph, multiple_weight=multiple_weight)
         return self.get_answer(updated_graph)
 
     def get_answer(self, graph):
@@ -246,6 +261,35 @@ class EpistemicModel(Solver):
         else:
             return "Multiple solutions"
 
+    def get_answer_distribution(self, graph, multiple_weight=1.0):
+        """
+        Retrieve the states of the graph as a probability distribution over the answer codes (see answer_codec): all
+        mass on the state if only one is left, all mass on "No solution" if none is left and, if several states are left,
+        multiple_weight on "Multiple solutions" and the rest spread uniformly over the left-over states
+
+        :param graph: the Kripke graph after all public announcements
+        :param multiple_weight: the probability of answering "Multiple solutions" if several states are left (1 gives the
+        same answer as get_answer)
+        :return: array with one probability per answer code
+        """
+        # numpy and the answer codes are only needed for distributions, not to solve the puzzle
+        import numpy as np
+        from answer_codec import ANSWER_CODES, N_CODES
+
+        answer_list = list(graph)
+        distribution = np.zeros(N_CODES)
+
+        if len(answer_list) == 0:
+            distribution[ANSWER_CODES["No solution"]] = 1
+        elif len(answer_list) == 1:
+            distribution[ANSWER_CODES[self.get_answer(graph)]] = 1
+        else:
+            distribution[ANSWER_CODES["Multiple solutions"]] = multiple_weight
+            for state in answer_list:
+                answer = format_text_states(self.puzzle.all_states[self.curr_level][state])
+                distribution[ANSWER_CODES[answer]] += (1 - multiple_weight) / len(answer_list)
+        return distribution
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import hashlib
+import pickle
+from multiprocessing import Pool
+
+# the analysis and the modeling folders each have their own utilities module, so the figures of each folder are computed
+# and rendered by a separate pool of processes that runs in that folder (nothing from either folder is imported here)
+MODELING_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(MODELING_DIR)
+ANALYSIS_DIR = os.path.join(REPO_DIR, "analysis")
+# file with the hash of the data of every built figure (png file relative to the repository -> hash), used to skip the
+# figures whose data has not changed
+MANIFEST_FILE = os.path.join(MODELING_DIR, "figures_manifest.json")
+# the highest ToM level of the Kripke snapshots
+MAX_TOM_LEVEL = 4
+
+
+def init_worker(folder):
+    """
+    Make a worker process run in a folder, so that it imports the modules (and reads the files) of that folder
+
+    :param folder: the folder
+    """
+    os.chdir(folder)
+    sys.path.insert(0, folder)
+
+
+def get_analysis_figures():
+    """
+    :return: the figures of the paper, see analysis.get_figures (computed in the analysis folder)
+    """
+    from analysis import get_figures
+    return get_figures()
+
+
+def get_kripke_figures(max_tom_level=MAX_TOM_LEVEL):
+    """
+    Snapshots of the Kripke model of every level of ToM: the initial model, and the model after each public
+    announcement, with the removed states in yellow (as drawn by EpistemicModel.update_model)
+
+    :param max_tom_level: the highest level of ToM
+    :return: list of figures, see utilities.render_figure
+    """
+    from puzzle_formalism import Puzzle
+    from epistemic_model import EpistemicModel
+
+    cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
+    figures = []
+    for level in range(max_tom_level):
+        solver = EpistemicModel(1, max_tom_level, level, cb)
+        graph = solver.generate_full_model()
+        figures.append(("draw_model", (solver.init_graph.copy(),), dict(save_file=f"plots/level{level + 1}_0")))
+        solver.curr_states = {node: False for node in list(graph)}
+        for idx, ann in enumerate(cb.all_announcements[level]):
+            solver.process_announcement(ann.formula, solver.curr_states)
+            nodes_to_remove = [node for node in solver.curr_states.keys() if solver.curr_states[node] is True]
+            snapshot = solver.mark_removed_states(nodes_to_remove).copy()
+            figures.append(("draw_model", (snapshot,), dict(save_file=f"plots/level{level + 1}_{idx + 1}")))
+            graph = solver.update_model(graph, True)
+    return figures
+
+
+def get_modeling_figures():
+    """
+    The figures of the modeling folder: the RFX-BMS and coherence plots (if the likelihoods and correct rates were
+    computed, see fitting.rfx_bms), the sensitivity heatmap (if the sweep was run, see sensitivity.py) and the Kripke
+    snapshots
+
+    :return: list of figures, see utilities.render_figure
+    """
+    import pandas as pd
+    from fitting import get_likelihood_frequencies, get_rfx_bms_figures
+    from sensitivity import get_frequency_shifts, get_sensitivity_figures
+    from plot_cache import memoize
+
+    figures = []
+    if os.path.exists("likelihoods.csv") and os.path.exists("correct_rates.csv"):
+        # RFX-BMS only runs again if the likelihoods change
+        a = memoize(get_likelihood_frequencies, "likelihoods", input_files=["likelihoods.csv"])
+        figures += get_rfx_bms_figures(a, "correct_rates")
+    if os.path.exists("sensitivity.csv"):
+        figures += get_sensitivity_figures(get_frequency_shifts(pd.read_csv("sensitivity.csv")))
+    return figures + get_kripke_figures()
+
+
+def render(function_name, args, kwargs):
+    """
+    Render one figure in a worker process, see utilities.render_figure
+    """
+    from utilities import render_figure
+    render_figure(function_name, args, kwargs)
+
+
+def get_save_file(figure):
+    """
+    :param figure: (plotting function name, arguments, keyword arguments)
+    :return: the png file of a figure, relative to its folder
+    """
+    _, _, kwargs = figure
+    return f"{kwargs.get('title_save_file', kwargs.get('save_file'))}.png"
+
+
+def get_figure_hash(figure):
+    """
+    :param figure: (plotting function name, arguments, keyword arguments)
+    :return: the sha256 hash of everything a figure is drawn from
+    """
+    return hashlib.sha256(pickle.dumps(figure)).hexdigest()
+
+
+def build_folder_figures(folder, get_figures, manifest, force=False, n_workers=None):
+    """
+    Compute the figures of a folder, then render in parallel the ones that are new or whose data changed
+
+    :param folder: the folder the figures belong to (the analysis or the modeling folder)
+    :param get_figures: function that returns the figures of the folder (run in the folder)
+    :param manifest: see MANIFEST_FILE (updated in place)
+    :param force: if True, then all figures are rendered
+    :param n_workers: the number of worker processes (if None, then the number of CPUs)
+    :return: the number of rendered figures and the number of skipped figures
+    """
+    with Pool(n_workers or os.cpu_count(), initializer=init_worker, initargs=(folder,)) as pool:
+        figures = pool.apply(get_figures)
+        to_render = []
+        for figure in figures:
+            save_file = os.path.join(folder, get_save_file(figure))
+            manifest_key = os.path.relpath(save_file, REPO_DIR)
+            figure_hash = get_figure_hash(figure)
+            if force or manifest.get(manifest_key) != figure_hash or not os.path.exists(save_file):
+                to_render.append(figure)
+                manifest[manifest_key] = figure_hash
+        pool.starmap(render, to_render)
+    return len(to_render), len(figures) - len(to_render)
+
+
+def build_figures(force=False, n_workers=None):
+    """
+    Build all figures (paper figures, RFX-BMS and coherence plots, Kripke snapshots) on the Agg backend; figures whose
+    data did not change since the last build are skipped
+
+    :param force: if True, then all figures are rendered
+    :param n_workers: the number of worker processes per folder (if None, then the number of CPUs)
+    :return: the number of rendered figures and the number of skipped figures
+    """
+    manifest = {}
+    if os.path.exists(MANIFEST_FILE) and not force:
+        with open(MANIFEST_FILE) as f:
+            manifest = json.load(f)
+    n_rendered, n_skipped = 0, 0
+    for folder, get_figures in [(ANALYSIS_DIR, get_analysis_figures), (MODELING_DIR, get_modeling_figures)]:
+        rendered, skipped = build_folder_figures(folder, get_figures, manifest, force=force, n_workers=n_workers)
+        n_rendered, n_skipped = n_rendered + rendered, n_skipped + skipped
+        # save after every folder, so that the figures already rendered are not rendered again if a later one fails
+        with open(MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+    return n_rendered, n_skipped
+
+
+if __name__ == "__main__":
+    rendered_count, skipped_count = build_figures()
+    print(f"Rendered {rendered_count} figures, skipped {skipped_count} unchanged figures")
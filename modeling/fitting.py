@@ -4,12 +4,21 @@ import pandas as pd
 from puzzle_formalism import Puzzle
 from epistemic_model import EpistemicModel
 import os
-import math
-import scipy
-from utilities import plot_bar, plot_coherence
+import numpy as np
+from utilities import get_coherence_figures, render_figures
+from answer_codec import ANSWERS, encode_answers, count_codes
 
 CONFIG = "cut_1_lrrl_2_lr_all" # identification string for plots with the same configuration
 SAVE_BOOL = True
+# penalty of the error model: an error is spread evenly over the answers other than the predicted one (the 9 other
+# dates of a puzzle and the 3 special answers), so that the error probabilities sum to epsilon
+PENALTY = 1/12
+# error rates evaluated by fit_error_model, and penalties evaluated by error_model_sensitivity
+PENALTY_GRID = [1/24, 1/18, 1/15, 1/12]
+EPSILON_GRID = np.round(np.linspace(0.01, 0.99, 99), 2)
+# suffix of the likelihoods and correct rates files computed with the error rate fitted by fit_error_model, so that
+# they never replace the files with an error rate per participant-model pair
+FITTED_ERROR_SUFFIX = "_fitted_error"
 ################## MODEL PREDICTIONS ##################
 
 
@@ -27,6 +36,99 @@ def get_prediction_one_model(solver, kwargs):
     return model_answer.replace("Sept", "September")
 
 
+def get_model_configs(max_pa_tom_level=3):
+    """
+    List the configurations of all ToM models
+
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :return: dictionary of model name -> keyword arguments for run_model_once
+    """
+    model_configs = {}
+    model_cutting_dirs_config = ["lr", "rl"]
+    # model_level is defined as the maximum level of ToM that the model can process; the model cuts off
+    # operators in statements with higher ToM level than model_level, until the statement reaches model_level
+    # ToM
+    # note: model_level = 0 means that cutting is disabled
+    for model_level in range(max_pa_tom_level):
+        for model_cutting_dir in model_cutting_dirs_config:
+            # get the name of the current model configuration
+            if model_level == 0:
+                model_name = "Epistemic"
+            else:
+                model_name = f"Cut {model_level}-{model_cutting_dir}"
+
+            # for epistemic model (model_level=0) compute answer only once (model_cutting_dir has no effect;
+            # for cut-2 model (model_level=2), only cut from left or from right (both give the same answer)
+            if model_level in [0, 2] and model_cutting_dir != model_cutting_dirs_config[0]:
+                continue
+            model_configs[model_name] = {"model_level": model_level, "cutting_direction": model_cutting_dir}
+    return model_configs
+
+
+def predict_answer_distributions(max_pa_tom_level=3, multiple_weight=1.0):
+    """
+    Computes all ToM models' answer distributions (see EpistemicModel.get_answer_distribution) for the original
+    birthday puzzle of each level of ToM, to which all puzzles are translated
+
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :param multiple_weight: the probability of answering "Multiple solutions" if several states are left
+    :return: the model names and an array (ToM levels x models x answer codes)
+    """
+    cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
+    model_configs = get_model_configs(max_pa_tom_level)
+    distributions = []
+    for level in range(len(cb.all_states)):
+        temp_solver = EpistemicModel(1, max_pa_tom_level, level, cb)
+        distributions.append([temp_solver.run_model_once(temp_solver.generate_full_model(), **kwargs,
+                                                         return_distribution=True, multiple_weight=multiple_weight)
+                              for kwargs in model_configs.values()])
+    return list(model_configs), np.array(distributions)
+
+
+def predict_answers(subj_df, questions_df, max_pa_tom_level=3, level_predictions=None):
+    """
+    Computes all ToM models' predictions for the answers of the given participant data entries
+
+    :param subj_df: dataframe with the participants' answers (one row per puzzle)
+    :param questions_df: the question bank
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :param level_predictions: dictionary of level of ToM -> dictionary of model name -> answer, with precomputed
+    predictions of other models (e.g. the cutting family, see cutting_family.py); if None, then the models of
+    get_model_configs are run
+    :return: dataframe with one row of predictions per participant answer
+    """
+    # all puzzles are translated to the original birthday puzzle of their ToM level, so the model predictions only
+    # depend on the level and are computed once per level
+    if level_predictions is None:
+        level_predictions = {}
+    # initialize puzzle object
+    cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
+    # index the question bank once
+    correct_answers = questions_df.set_index("IDX")["Translated answer"]
+
+    rows = []
+    # for each data entry
+    for idx, row in subj_df.iterrows():
+        # get the correct answer to the current puzzle
+        correct_answer = correct_answers[row["Index"]]
+
+        if row["Level"] not in level_predictions:
+            # initialize epistemic model
+            temp_solver = EpistemicModel(1, max_pa_tom_level, row["Level"] - 1, cb)
+            # get the answer predicted by each model and store the predictions
+            level_predictions[row["Level"]] = {model_name: get_prediction_one_model(temp_solver, kwargs)
+                                               for model_name, kwargs in get_model_configs(max_pa_tom_level).items()}
+
+        model_predictions = level_predictions[row["Level"]]
+        # determine whether the predicted answers are the correct answer
+        model_is_correct = [bool(model_answer == correct_answer) for model_answer in model_predictions.values()]
+        rows.append([row["Subject.id"], row["Trial"], row["Level"], correct_answer, row["Translated.answer"],
+                     bool(row["Is.correct"]), model_predictions, model_is_correct])
+
+    return pd.DataFrame(rows, columns=["Subject.id", "Trial", "ToM.level", "Correct.answer", "Subject.answer",
+                                       "Is.subject.correct", "Model.predictions", "Is.model.correct"])
+
+
 def generate_all_predictions(name_predictions_file="predictions_tom", max_pa_tom_level=3):
     """
     Generates file with all ToM models' predictions for the answers of the human participants
@@ -34,191 +136,375 @@ def generate_all_predictions(name_predictions_file="predictions_tom", max_pa_tom
     :param name_predictions_file: path to file to save predictions in
     :param max_pa_tom_level: the maximum possible level of ToM for public announcements
     """
-    # read in subject data
+    # read in subject data; to compare the models on a subset of the answers only (e.g. one level of ToM or only the
+    # correct answers), use stratified.py on the full prediction table instead of filtering here
     subj_df = pd.read_csv("../analysis/All answers_puzzles.csv")
-    # uncomment below to only process wrong answers; change to value 1 for only correct answers
-    # subj_df = subj_df.loc[(subj_df["Is.correct"] == 1)]
-    # uncomment and adjust below to only process certain levels of ToM
-    # subj_df = subj_df.loc[(subj_df["Level"] == 4)]
     # read in question bank
     questions_df = pd.read_csv("../interface/question_bank.csv")
-    # initialize prediction dataframe
-    predictions_df = pd.DataFrame(columns=["Subject.id", "Trial", "ToM.level", "Correct.answer", "Subject.answer",
-                                           "Is.subject.correct", "Model.predictions", "Is.model.correct"])
-    # initialize puzzle object
-    cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
 
-    # for each data entry
-    for idx, row in subj_df.iterrows():
-        # get the correct answer to the current puzzle
-        correct_answer = questions_df["Translated answer"].loc[questions_df["IDX"] == row["Index"]].values[0]
-
-        model_predictions = {}
-        model_is_correct = []
-        model_cutting_dirs_config = ["lr", "rl"]
-
-        # initialize epistemic model
-        temp_solver = EpistemicModel(1, max_pa_tom_level, row["Level"] - 1, cb)
-        # model_level is defined as the maximum level of ToM that the model can process; the model cuts off operators
-        # in statements with higher ToM level than model_level, until the statement reaches model_level ToM
-        # note: model_level = 0 means that cutting is disabled
-        for model_level in range(max_pa_tom_level):
-            for model_cutting_dir in model_cutting_dirs_config:
-                # get the name of the current model configuration
-                if model_level == 0:
-                    model_name = "Epistemic"
-                else:
-                    model_name = f"Cut {model_level}-{model_cutting_dir}"
-
-                # for epistemic model (model_level=0) compute answer only once (model_cutting_dir has no effect;
-                # for cut-2 model (model_level=2), only cut from left or from right (both give the same answer)
-                if model_level in [0, 2] and model_cutting_dir != model_cutting_dirs_config[0]:
-                    continue
-                # get the answer predicted by the model
-                model_answer = get_prediction_one_model(temp_solver, {"model_level": model_level,
-                                                                      "cutting_direction": model_cutting_dir})
-                # store the prediction
-                model_predictions[model_name] = model_answer
-                # determine whether the predicted answer is the correct answer
-                model_is_correct.append(bool(model_answer == correct_answer))
-
-        predictions_df.loc[predictions_df.shape[0]] = [row["Subject.id"], row["Trial"], row["Level"], correct_answer,
-                                                       row["Translated.answer"], bool(row["Is.correct"]),
-                                                       model_predictions, model_is_correct]
-
-    predictions_df.reset_index(drop=True, inplace=True)
+    predictions_df = predict_answers(subj_df, questions_df, max_pa_tom_level=max_pa_tom_level)
     predictions_df.to_csv(f"{name_predictions_file}.csv", index=False)
 
 ################## MODEL EVIDENCE ##################
 
 
-def get_accuracy(answer_bool_list):
+def get_answer_frequency_figures(population_counts):
+    """
+    Bar plot of the frequency of answers within the sample of participants
+
+    :param population_counts: the number of occurrences of each answer code over all participants (see answer_codec)
+    :return: list of figures, see utilities.render_figure
     """
-    Compute accuracy as follows:
-        the number of correct answer/the total number of answers
+    # only the answers that were given, from the most to the least frequent
+    all_subj_answer_dict = {ANSWERS[code]: int(population_counts[code]) for code in np.argsort(-population_counts,
+                                                                                               kind="stable")
+                            if population_counts[code] > 0}
+    return [("plot_bar", (all_subj_answer_dict, f"Frequency of answers aggregated\nover all participants and puzzles",
+                          "Answer", "Frequency of answer", (0, max(all_subj_answer_dict.values())),
+                          (0, len(all_subj_answer_dict))), dict(title_save_file="plots/paper/freq_all_answers"))]
 
-    :param answer_bool_list: list of booleans where answer_bool_list[i] is True if the i-th answer is correct
-    and False otherwise
-    :return: the accuracy value
+
+def compute_likelihood(correct, incorrect, penalty=PENALTY, epsilon=None):
     """
-    return sum(answer_bool_list) / len(answer_bool_list)
+    Calculate log-likelihood as correct * ln(1 - e) + incorrect * ln(e * penalty)
 
+    Function adapted from https://github.com/jdtoprug/EpistemicToMProject
 
-def count_common_answers(subj_answers, model_answers):
+    :param correct: number of times model predictions corresponded to participant answers (number or array)
+    :param incorrect: number of times model predictions deviated from participant answers (number or array of the
+    same shape as correct)
+    :param penalty: p in n(1-e)*ln(1-e) + ne*ln(pe) (number or array broadcastable with correct)
+    :param epsilon: the error rate e (number or array broadcastable with correct); if None, then e is estimated
+    separately for each count as incorrect / n
+    :return: log-likelihood of participant using this model's strategy (element-wise for arrays)
     """
-    Count how many answers predicted by the model are the same as the participant's answers
+    correct = np.asarray(correct, dtype=float)
+    incorrect = np.asarray(incorrect, dtype=float)
+    # epsilon, error rate - incoherent answers divided by n
+    e = incorrect / (correct + incorrect) if epsilon is None else np.asarray(epsilon, dtype=float)
+    # terms with zero counts do not contribute (their logarithm may be undefined)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        likelihood = np.where(correct > 0, correct * np.log(1 - e), 0) \
+            + np.where(incorrect > 0, incorrect * np.log(e * penalty), 0)  # n(1-e)*ln(1-e) + ne*ln(pe)
+    return likelihood
 
-    :param subj_answers: list of a participant's answer
-    :param model_answers: list of answers predicted by the model for that participant
-    :return: the number of answers predicted by the model that correspond with the participant's answers
+
+def compute_random_evidence(answer_counts, population_counts):
     """
-    count_same_answer = 0
-    for idx in range(len(subj_answers)):
-        if subj_answers[idx] == model_answers[idx]:
-            count_same_answer += 1
-    return count_same_answer
+    Log-likelihood and coherence of the random model, taking into account the answer distribution of all
+    participants, for many participants (and optionally many populations, e.g. bootstrap resamples) at once
 
+    Function adapted from https://github.com/jdtoprug/EpistemicToMProject
 
-def count_subject_answers(answer_list):
+    :param answer_counts: array of shape (..., number of subjects, number of unique answers), where each row counts
+    the occurrences of each unique answer for one participant
+    :param population_counts: array of shape (..., number of unique answers) with the occurrences of each unique
+    answer over all participants
+    :return: the log-likelihoods and the coherences of the random model, each of shape (..., number of subjects)
     """
-    Given a list of a participant's answers, count how many times each unique answer occurred
+    population_freq = population_counts / population_counts.sum(axis=-1, keepdims=True)
+    population_freq = population_freq[..., np.newaxis, :]
+    # answers never given by the participant do not contribute (and may not occur in the population at all)
+    with np.errstate(divide="ignore"):
+        log_freq = np.where(answer_counts > 0, np.log(population_freq), 0)
+    likelihood = (answer_counts * log_freq).sum(axis=-1)
+    rate = (answer_counts * population_freq).sum(axis=-1) / answer_counts.sum(axis=-1)
+    return likelihood, rate
 
-    :param answer_list: the list of a participant's answers
-    :return: dictionary where the keys are unique answers and the values are the occurrences
+
+def get_answer_codes(prediction_model_df):
     """
-    dict_ans = {}
+    Parse the stored model predictions once and encode them and the participants' answers as integer codes
 
-    for ans in answer_list:
-        try:
-            dict_ans[ans] += 1
-        except KeyError:
-            dict_ans[ans] = 1
-    return dict_ans
+    :param prediction_model_df: dataframe with all model predictions, as saved by generate_all_predictions
+    :return: the names of the (non-random) models, the codes of the model predictions (answers x models) and the codes
+    of the participants' answers (answers)
+    """
+    model_predictions = pd.DataFrame([eval(x) for x in prediction_model_df["Model.predictions"]])
+    return list(model_predictions.columns), encode_answers(model_predictions), \
+        encode_answers(prediction_model_df["Subject.answer"])
 
 
-def count_all_answers(all_part_answers_list, plot_population_distrib=False):
+def get_subject_arrays(prediction_model_df):
     """
-    Compute and plot the frequency of answers within the sample of participants.
-    
-    :param all_part_answers_list: list of all answers given by all participants
-    :param plot_population_distrib: if True, then plot the frequency of answers
-    :return: a dict, where the keys are unique answers and the values are the number of occurrences per unique answer
+    Group the prediction dataframe by participant in a single pass and collect everything needed to compute the
+    evidence for all participants and models at once
+
+    :param prediction_model_df: dataframe with all model predictions, as saved by generate_all_predictions
+    :return: dictionary with
+        "subjects": the participant ids (the row order of all arrays below)
+        "models": the names of the (non-random) models (the column order of the subject x model arrays)
+        "subject_accuracy": the accuracy of each participant
+        "matches": the number of answers predicted by each model that correspond with each participant's answers
+        "trials": the number of answers given by each participant
+        "model_accuracy": the accuracy of each model on the puzzles seen by each participant
+        "answer_counts": the number of occurrences of each answer code (see answer_codec) for each participant
     """
-    # compute frequency of each unique answer
-    all_subj_answer_dict = {}
-    for ans in all_part_answers_list:
-        try:
-            all_subj_answer_dict[ans] += 1
-        except KeyError:
-            all_subj_answer_dict[ans] = 1
-
-    # optionally, plot the frequency of answers
-    if plot_population_distrib:
-        all_subj_answer_dict = dict(sorted(all_subj_answer_dict.items(), key=lambda item: item[1], reverse=True))
-        plot_bar(all_subj_answer_dict, f"Frequency of answers aggregated\nover all participants and puzzles",
-                 "Answer", "Frequency of answer", (0, max(all_subj_answer_dict.values())),
-                 (0, len(all_subj_answer_dict)),
-                 "plots/paper/freq_all_answers")
+    # parse the stored predictions once, into one column of answer codes per model
+    model_names, model_codes, subj_codes = get_answer_codes(prediction_model_df)
+    model_correct = pd.DataFrame([eval(x) for x in prediction_model_df["Is.model.correct"]],
+                                 index=prediction_model_df.index, columns=model_names)
+    subj_ids = prediction_model_df["Subject.id"]
+    subjects, subj_idx = np.unique(subj_ids, return_inverse=True)
+
+    matches = pd.DataFrame(model_codes == subj_codes[:, np.newaxis], index=prediction_model_df.index,
+                           columns=model_names).groupby(subj_ids).sum()
+    return {"subjects": list(matches.index),
+            "models": model_names,
+            "subject_accuracy": prediction_model_df["Is.subject.correct"].astype(float).groupby(subj_ids).mean()
+            .reindex(matches.index).to_numpy(),
+            "matches": matches.to_numpy(),
+            "trials": subj_ids.value_counts().reindex(matches.index).to_numpy(),
+            "model_accuracy": model_correct.astype(float).groupby(subj_ids).mean().reindex(matches.index).to_numpy(),
+            "answer_counts": count_codes(subj_codes, subj_idx, len(subjects))}
+
+
+def get_trial_arrays(prediction_model_df):
+    """
+    Reshape the prediction dataframe into subject x trial arrays, padded to the largest number of trials, for models
+    that score every trial separately
+
+    :param prediction_model_df: dataframe with all model predictions, as saved by generate_all_predictions
+    :return: dictionary with
+        "subjects": the participant ids (the first axis of all arrays below)
+        "models": the names of the (non-random) models (the last axis of "matches")
+        "matches": boolean array (subjects x trials x models), True where the model predicted the participant's answer
+        "random_probs": array (subjects x trials) with the frequency of the given answer over all participants, i.e.
+        the probability of that answer under the random model
+        "trial": array (subjects x trials) with the trial number of each answer
+        "mask": boolean array (subjects x trials), False for padding
+        "block": array (subjects x trials) with the block of each answer (0 for padding), only if the dataframe has a
+        Block column (see stratified.load_stratified_table)
+    """
+    prediction_model_df = prediction_model_df.sort_values(["Subject.id", "Trial"])
+    model_names, model_codes, subj_codes = get_answer_codes(prediction_model_df)
+    matches = model_codes == subj_codes[:, np.newaxis]
+    population_freq = (count_codes(subj_codes) / len(subj_codes))[subj_codes]
+
+    # position of every answer in its subject row
+    subjects, subj_idx = np.unique(prediction_model_df["Subject.id"], return_inverse=True)
+    trial_idx = prediction_model_df.groupby("Subject.id").cumcount().to_numpy()
+    shape = (len(subjects), trial_idx.max() + 1)
+
+    padded_matches = np.zeros(shape + (matches.shape[1],), dtype=bool)
+    padded_matches[subj_idx, trial_idx] = matches
+    random_probs = np.ones(shape)
+    random_probs[subj_idx, trial_idx] = population_freq
+    trial = np.zeros(shape, dtype=int)
+    trial[subj_idx, trial_idx] = prediction_model_df["Trial"]
+    mask = np.zeros(shape, dtype=bool)
+    mask[subj_idx, trial_idx] = True
+    arrays = {"subjects": list(subjects), "models": model_names, "matches": padded_matches,
+              "random_probs": random_probs, "trial": trial, "mask": mask}
+    if "Block" in prediction_model_df:
+        arrays["block"] = np.zeros(shape, dtype=int)
+        arrays["block"][subj_idx, trial_idx] = prediction_model_df["Block"]
+    return arrays
+
+
+def compute_trial_likelihoods(matches, random_probs, penalty=PENALTY, epsilon=0.25):
+    """
+    Compute the likelihood of every single answer under every model, with the same error model as compute_likelihood:
+    an answer has probability 1 - e if the model predicted it and e * penalty otherwise. Under the random model, an
+    answer has its frequency over all participants as probability.
+
+    :param matches: boolean array (..., models), True where the model predicted the answer
+    :param random_probs: array (...) with the probability of each answer under the random model
+    :param penalty: p in (1-e) and pe
+    :param epsilon: the error rate e (number or array broadcastable with matches)
+    :return: array (..., models + 1), with the random model last
+    """
+    likelihoods = np.where(matches, 1 - epsilon, epsilon * penalty)
+    return np.concatenate([likelihoods, random_probs[..., np.newaxis]], axis=-1)
 
-    return all_subj_answer_dict
 
+def sum_per_subject(values, subj_idx, n_subjects):
+    """
+    Sum answer-level values per participant (values may be -inf)
 
-def compute_likelihood(correct, incorrect, penalty=1/12):
+    :param values: array (answers x ...)
+    :param subj_idx: array with the participant index of each answer
+    :param n_subjects: the number of participants
+    :return: array (subjects x ...)
     """
-    Calculate log-likelihood as correct * ln(1 - e) + incorrect * ln(e * penalty)
+    sums = np.zeros((n_subjects,) + values.shape[1:])
+    np.add.at(sums, subj_idx, values)
+    return sums
 
-    Function adapted from https://github.com/jdtoprug/EpistemicToMProject
 
-    :param correct: number of times model predictions corresponded to participant answers
-    :param incorrect: number of times model predictions deviated from participant answers
-    :param penalty: p in n(1-e)*ln(1-e) + ne*ln(pe)
-    :return: log-likelihood of participant using this model's strategy
+def compute_distribution_likelihoods(answer_probs, subj_idx, n_subjects, penalty=PENALTY, epsilon=None,
+                                     converge_diff=1e-9, max_iter=1000):
     """
-    # epsilon, error rate - incoherent answers divided by n
-    e = incorrect / (correct + incorrect)
-    likelihood = 0
-    if correct > 0:
-        likelihood += correct * math.log(1 - e)  # n(1-e)*ln(1-e)
-    if incorrect > 0:
-        likelihood += incorrect * math.log(e * penalty)  # ne*ln(pe)
-    return likelihood
-
+    Generalization of compute_likelihood to models that predict a probability distribution q over the answers: with
+    probability 1 - e the participant answers according to q, otherwise they make an error, so that an answer a has
+    probability (1 - e) * q(a) + e * penalty * (1 - q(a)). If q puts all mass on one answer, then this is the error
+    model of compute_likelihood.
+
+    :param answer_probs: array (answers x models) with the probability q of each participant answer under each model
+    :param subj_idx: array with the participant index of each answer
+    :param n_subjects: the number of participants
+    :param penalty: the penalty of the error model
+    :param epsilon: the shared error rate e; if None, then the maximum-likelihood error rate of each participant-model
+    pair is found with EM (for models predicting single answers, this gives incorrect / n as in compute_likelihood)
+    :param converge_diff: stop the EM iterations when no error rate changes by more than this value
+    :param max_iter: the maximum number of EM iterations
+    :return: the log-likelihoods and the error rates, both of shape (subjects x models)
+    """
+    error_probs = penalty * (1 - answer_probs)
+    trials = np.bincount(subj_idx, minlength=n_subjects)[:, np.newaxis]
+    if epsilon is None:
+        e = np.full((n_subjects, answer_probs.shape[1]), 0.5)
+        for _ in range(max_iter):
+            # posterior probability that each answer was an error, given the current error rates
+            error_mass = e[subj_idx] * error_probs
+            total_mass = (1 - e[subj_idx]) * answer_probs + error_mass
+            responsibilities = np.divide(error_mass, total_mass, out=np.zeros_like(total_mass), where=total_mass > 0)
+            prev_e, e = e, sum_per_subject(responsibilities, subj_idx, n_subjects) / trials
+            if np.all(np.abs(e - prev_e) <= converge_diff):
+                break
+    else:
+        e = np.broadcast_to(np.asarray(epsilon, dtype=float), (n_subjects, answer_probs.shape[1]))
+
+    with np.errstate(divide="ignore"):
+        log_probs = np.log((1 - e[subj_idx]) * answer_probs + e[subj_idx] * error_probs)
+    return sum_per_subject(log_probs, subj_idx, n_subjects), e
+
+
+def compute_distribution_evidence(prediction_model_df, max_pa_tom_level=3, multiple_weight=1.0, penalty=PENALTY,
+                                  epsilon=None):
+    """
+    Score the participants' answers against the answer distributions of all models, looking up the log-probability
+    of every answer under every model at once
 
-def compute_error_likelihood_random(subj_answer_dict, population_answer_dict):
+    :param prediction_model_df: dataframe with all model predictions, as saved by generate_all_predictions
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :param multiple_weight: the probability of answering "Multiple solutions" if several states are left
+    :param penalty: the penalty of the error model
+    :param epsilon: the shared error rate of the error model (if None, then it is estimated per participant-model pair)
+    :return: the model names and, per participant and model, the log-likelihoods, the correct rates (mean
+    probability of the participant's answers) and the model accuracies (mean probability of the correct answers)
     """
-    Calculates likelihood for random model, taking into account the answer distribution of all participants.
+    model_names, distributions = predict_answer_distributions(max_pa_tom_level, multiple_weight=multiple_weight)
+    subjects, subj_idx = np.unique(prediction_model_df["Subject.id"], return_inverse=True)
+    level_idx = prediction_model_df["ToM.level"].to_numpy() - 1
+    # probability of each given (and correct) answer under each model: answers x models
+    answer_probs = distributions[level_idx, :, encode_answers(prediction_model_df["Subject.answer"])]
+    correct_probs = distributions[level_idx, :, encode_answers(prediction_model_df["Correct.answer"])]
+
+    likelihoods, _ = compute_distribution_likelihoods(answer_probs, subj_idx, len(subjects), penalty=penalty,
+                                                      epsilon=epsilon)
+    trials = np.bincount(subj_idx, minlength=len(subjects))[:, np.newaxis]
+    return model_names, likelihoods, sum_per_subject(answer_probs, subj_idx, len(subjects)) / trials, \
+        sum_per_subject(correct_probs, subj_idx, len(subjects)) / trials
 
-    Function adapted from https://github.com/jdtoprug/EpistemicToMProject
 
-    :param subj_answer_dict: dictionary where the keys are unique answers given by the participant and the values are
-    the number of occurrences
-    :poaram population_answer_dict: dictionary where the keys are unique answers given by all participants and the
-    values are the number of occurrences
-    :return: log-likelihood of random model corresponding to participant
+def get_error_model_surface(arrays, penalties, epsilons):
     """
-    likelihood = 0
-    for ans in subj_answer_dict.keys():
-        likelihood += subj_answer_dict[ans] * math.log(population_answer_dict[ans]/sum(population_answer_dict.values()))
-    return likelihood
+    Evaluate the group log-likelihood of the error model in compute_likelihood over a grid of penalty and epsilon
+    values for all participants and models in one broadcasted computation: the sum over participants of the
+    log-likelihood averaged over all models (including the random model, whose evidence does not depend on them)
+
+    :param arrays: the arrays of the participants, see get_subject_arrays
+    :param penalties: the penalty values to evaluate
+    :param epsilons: the shared error rates to evaluate; if None, then the error rate is free, i.e. estimated
+    separately for each participant-model pair (as in compute_likelihood)
+    :return: array (penalties x epsilons) with the group log-likelihoods
+    """
+    from scipy.special import logsumexp
 
+    matches = arrays["matches"]
+    incorrect = arrays["trials"][:, np.newaxis] - matches
+    likelihood_random, _ = compute_random_evidence(arrays["answer_counts"], arrays["answer_counts"].sum(axis=0))
+
+    # axes of the surface: penalty x epsilon x subject x model
+    penalty_grid = np.asarray(penalties, dtype=float)[:, np.newaxis, np.newaxis, np.newaxis]
+    epsilon_grid = None if epsilons is None else np.asarray(epsilons, dtype=float)[np.newaxis, :, np.newaxis, np.newaxis]
+    surface = compute_likelihood(matches, incorrect, penalty=penalty_grid, epsilon=epsilon_grid)
+    surface = np.concatenate([surface, np.broadcast_to(likelihood_random[:, np.newaxis],
+                                                       surface.shape[:-1] + (1,))], axis=-1)
+    return (logsumexp(surface, axis=-1) - np.log(surface.shape[-1])).sum(axis=-1)
 
-def compute_correct_rate_random(subj_answer_dict, population_answer_dict):
-    """
-    Calculates coherence for random model, taking into account the answer distribution of all participants
 
-    :param subj_answer_dict: dictionary where the keys are unique answers given by the participant and the values are
-    the number of occurrences
-    :param population_answer_dict: dictionary where the keys are unique answers given by all participants and the
-    values are the number of occurrences
-    :return: proportion of times random model corresponds to participant
+def fit_error_model(name_pred_file="predictions_tom", epsilons=EPSILON_GRID, penalty=PENALTY, name_surface_file=None):
     """
-    rate = 0
-    for ans in subj_answer_dict.keys():
-        rate += subj_answer_dict[ans] * (population_answer_dict[ans]/sum(population_answer_dict.values()))
-    return rate/sum(subj_answer_dict.values())
+    Fit the shared error rate of the error model in compute_likelihood by maximum likelihood over a grid of epsilon
+    values. The penalty is fixed: the error probabilities are not normalized over the alternative answers, so the
+    log-likelihood only grows with the penalty and the penalty cannot be fitted (see error_model_sensitivity for its
+    effect on the results).
+
+    :param name_pred_file: file path where all model predictions for participants' answers have been saved
+    :param epsilons: the shared error rates to evaluate
+    :param penalty: the penalty of the error model
+    :param name_surface_file: if given, file path where the group log-likelihood for each epsilon will be saved
+    :return: dictionary with the "penalty", the maximum-likelihood "epsilon" and the corresponding group
+    "log-likelihood" (see get_error_model_surface)
+    """
+    arrays = get_subject_arrays(pd.read_csv(f"{name_pred_file}.csv"))
+    group_likelihood = get_error_model_surface(arrays, [penalty], epsilons)[0]
+    best_epsilon = np.argmax(group_likelihood)
+    if name_surface_file:
+        pd.DataFrame({"Epsilon": epsilons, "Group.log-likelihood": group_likelihood}).to_csv(
+            f"{name_surface_file}.csv", index=False)
+    return {"penalty": penalty, "epsilon": epsilons[best_epsilon], "log-likelihood": group_likelihood[best_epsilon]}
 
 
-def generate_log_likelihoods(name_likelihood_file="likelihoods", name_pred_file="predictions_tom", replace_all=False):
+def error_model_sensitivity(name_pred_file="predictions_tom", penalties=PENALTY_GRID, epsilons=EPSILON_GRID,
+                            converge_diff=0.001):
+    """
+    Sensitivity of the results to the penalty of the error model: for every penalty, the error rate is fitted (see
+    fit_error_model) and the model frequencies are estimated with RFX-BMS. The group log-likelihoods of different
+    penalties are not comparable (see fit_error_model), so the penalty is not estimated.
+
+    :param name_pred_file: file path where all model predictions for participants' answers have been saved
+    :param penalties: the penalty values to evaluate
+    :param epsilons: the shared error rates to evaluate
+    :param converge_diff: see compute_rfx_bms
+    :return: dataframe with one row per penalty: the fitted epsilon, its group log-likelihood and the estimated
+    frequency of each model
+    """
+    arrays = get_subject_arrays(pd.read_csv(f"{name_pred_file}.csv"))
+    group_likelihood = get_error_model_surface(arrays, penalties, epsilons)
+    likelihood_random, _ = compute_random_evidence(arrays["answer_counts"], arrays["answer_counts"].sum(axis=0))
+    trials = arrays["trials"][:, np.newaxis]
+
+    rows = []
+    for idx, penalty in enumerate(penalties):
+        best_epsilon = np.argmax(group_likelihood[idx])
+        likelihoods = compute_likelihood(arrays["matches"], trials - arrays["matches"], penalty=penalty,
+                                         epsilon=epsilons[best_epsilon])
+        frequencies = get_model_frequencies(np.column_stack([likelihoods, likelihood_random]),
+                                            arrays["models"] + ["Random"], converge_diff=converge_diff)
+        rows.append({"Penalty": penalty, "Epsilon": epsilons[best_epsilon],
+                     "Group.log-likelihood": group_likelihood[idx, best_epsilon], **frequencies})
+    return pd.DataFrame(rows)
+
+
+def get_likelihood_df(arrays, likelihoods, correct_rates, model_accuracy, population_counts):
+    """
+    Add the random model to the evidence of the models and arrange everything in the format of the likelihoods file
+
+    :param arrays: the arrays of the participants, see get_subject_arrays
+    :param likelihoods: the log-likelihoods (subjects x models)
+    :param correct_rates: the correct rates (subjects x models)
+    :param model_accuracy: the model accuracies (subjects x models)
+    :param population_counts: the number of occurrences of each answer code over all participants, which defines the
+    random model (see compute_random_evidence)
+    :return: dataframe with one row per participant and model, with the random model last
+    """
+    likelihood_random, coherence_random = compute_random_evidence(arrays["answer_counts"], population_counts)
+    n_subjects, n_models = likelihoods.shape
+    model_names = arrays["models"] + ["Random"]
+    return pd.DataFrame({
+        "Subject.id": np.repeat(arrays["subjects"], n_models + 1),
+        "Model.name": np.tile(model_names, n_subjects),
+        "Log-likelihood": np.column_stack([likelihoods, likelihood_random]).ravel(),
+        "Correct.rate": np.column_stack([correct_rates, coherence_random]).ravel(),
+        "Subject.accuracy": np.repeat(arrays["subject_accuracy"], n_models + 1),
+        "Model.accuracy": np.column_stack([model_accuracy, np.full(n_subjects, np.nan)]).ravel()})
+
+
+def generate_log_likelihoods(name_likelihood_file="likelihoods", name_pred_file="predictions_tom", replace_all=False,
+                             penalty=PENALTY, epsilon=None, multiple_weight=None, plot_population_distrib=False):
     """
     Computes evidence for each model and saves to file
 
@@ -226,73 +512,140 @@ def generate_log_likelihoods(name_likelihood_file="likelihoods", name_pred_file=
     :param name_pred_file: file path where all model predictions for participants' answers have been/will be saved
     :param replace_all: if True, then the model predictions are computed from scratch; if False, then the model
     predictions are read in from file
+    :param penalty: the penalty of the error model (see compute_likelihood)
+    :param epsilon: the shared error rate of the error model; if None, then it is estimated for each participant-model
+    pair (see compute_likelihood)
+    :param multiple_weight: if given, then the answers are scored against the models' answer distributions, with this
+    probability of answering "Multiple solutions" if several states are left (see compute_distribution_evidence);
+    if None, then against the single stored predictions
+    :param plot_population_distrib: if True, then plot the frequency of answers (see get_answer_frequency_figures)
     """
     # if the predictions file does not exist or replace_all is True, then first generate it
     if not os.path.exists(f"{name_pred_file}.csv") or replace_all:
         generate_all_predictions(name_predictions_file=name_pred_file)
     # load the prediction file
     prediction_model_df = pd.read_csv(f"{name_pred_file}.csv")
-
-    # initialize dataframe for model evidence
-    likelihood_df = pd.DataFrame(columns=["Subject.id", "Model.name", "Log-likelihood", "Correct.rate",
-                                          "Subject.accuracy", "Model.accuracy"])
-
-    # for each participant
-    for subj_id in set(prediction_model_df["Subject.id"]):
-        # retrieve the list of given answers
-        subj_answers = prediction_model_df["Subject.answer"].loc[
-            prediction_model_df["Subject.id"] == subj_id].values
-        # retrieve which answers were correct and which incorrect
-        subj_bool_answers = prediction_model_df["Is.subject.correct"].loc[
-            prediction_model_df["Subject.id"] == subj_id].values
-        # compute accuracy for the current participant
-        subj_accuracy_score = get_accuracy(subj_bool_answers)
-
-        # retrieve all the answers predicted by all models
-        all_models_answers = [list(eval(x).values()) for x in prediction_model_df["Model.predictions"].loc[
-            prediction_model_df["Subject.id"] == subj_id].values]
-        # retrieve which answers were correct and which incorrect for all models
-        all_models_bool_answers = [eval(x) for x in prediction_model_df["Is.model.correct"].loc[
-            prediction_model_df["Subject.id"] == subj_id].values]
-        # iterate through all ToM models
-        for model_idx, model_name in enumerate(eval(prediction_model_df["Model.predictions"][0])):
-            # extract all the answers predicted by the current model
-            model_answers = [x[model_idx] for x in all_models_answers]
-            # extract which answers were correct and which incorrect for the current model
-            model_bool_answers = [x[model_idx] for x in all_models_bool_answers]
-
-            # compute the current model's accuracy
-            model_accuracy_score = get_accuracy(model_bool_answers)
-            # find how many answers were correctly predicted by the model, relative to the answers given by the
-            # current participant
-            number_same_answer = count_common_answers(subj_answers, model_answers)
-            # compute the log-likelihood that the current participants used the current model's strategy
-            likelihood = compute_likelihood(number_same_answer, len(model_answers) - number_same_answer)
-            # store data
-            likelihood_df.loc[likelihood_df.shape[0]] = [subj_id, model_name, likelihood,
-                                                         number_same_answer/len(model_answers), subj_accuracy_score,
-                                                         model_accuracy_score]
-
-        # count the number of occurrences for each unique answer for the current participant
-        dict_count_subj_answers = count_subject_answers(subj_answers)
-        dict_count_all_answers = count_all_answers(list(prediction_model_df["Subject.answer"]))
-        # compute the log-likelihood that the current participants used random model's strategy, given the distribution
-        # of answers for that participant
-        likelihood_random = compute_error_likelihood_random(dict_count_subj_answers, dict_count_all_answers)
-        # compute the coherence of the random model
-        coherence_random = compute_correct_rate_random(dict_count_subj_answers, dict_count_all_answers)
-
-        # store data
-        likelihood_df.loc[likelihood_df.shape[0]] = [subj_id, "Random", likelihood_random, coherence_random,
-                                                     subj_accuracy_score, ""]
-
-    likelihood_df.reset_index(drop=True, inplace=True)
+    arrays = get_subject_arrays(prediction_model_df)
+    trials = arrays["trials"][:, np.newaxis]
+
+    # compute the log-likelihood that each participant used each model's strategy
+    if multiple_weight is None:
+        likelihoods = compute_likelihood(arrays["matches"], trials - arrays["matches"], penalty=penalty,
+                                         epsilon=epsilon)
+        correct_rates, model_accuracy = arrays["matches"] / trials, arrays["model_accuracy"]
+    else:
+        _, likelihoods, correct_rates, model_accuracy = compute_distribution_evidence(
+            prediction_model_df, multiple_weight=multiple_weight, penalty=penalty, epsilon=epsilon)
+    # the random model uses the distribution of answers of all participants (counted only once)
+    population_counts = arrays["answer_counts"].sum(axis=0)
+    likelihood_df = get_likelihood_df(arrays, likelihoods, correct_rates, model_accuracy, population_counts)
     likelihood_df.to_csv(f"{name_likelihood_file}.csv", index=False)
+    # optionally, plot the frequency of answers
+    if plot_population_distrib:
+        render_figures(get_answer_frequency_figures(population_counts))
 
 
 ################## RFX-BMS ##################
 
 
+def get_likelihood_matrices(likelihood_df):
+    """
+    Reshape the long-format likelihood dataframe into subject x model matrices
+
+    :param likelihood_df: dataframe with one row per subject-model pair, as saved by generate_log_likelihoods
+    :return: the list of subject ids (rows), the list of model names (columns), the matrix of log-likelihoods and the
+    matrix of correct rates
+    """
+    log_likelihoods = likelihood_df.pivot(index="Subject.id", columns="Model.name", values="Log-likelihood")
+    correct_rates = likelihood_df.pivot(index="Subject.id", columns="Model.name", values="Correct.rate")
+    return list(log_likelihoods.index), list(log_likelihoods.columns), log_likelihoods.to_numpy(dtype=float), \
+        correct_rates.to_numpy(dtype=float)
+
+
+def get_best_model_shares(correct_rates):
+    """
+    For each participant, find the model(s) with the best correct rate. If several models share the best correct rate,
+    the participant is split evenly between them.
+
+    :param correct_rates: array of shape (..., number of subjects, number of models)
+    :return: array of the same shape, where each subject row sums to 1 over its best model(s)
+    """
+    is_best = correct_rates == correct_rates.max(axis=-1, keepdims=True)
+    return is_best / is_best.sum(axis=-1, keepdims=True)
+
+
+def compute_rfx_bms_beta(log_likelihoods, a, weights=None):
+    """
+    One variational update of RFX-BMS (see compute_rfx_bms): beta is a sum over the participants, so it can also be
+    computed over chunks of participants and added up
+
+    :param log_likelihoods: array of shape (..., number of subjects, number of models)
+    :param a: the current alpha, of shape (..., number of models)
+    :param weights: see compute_rfx_bms
+    :return: beta, of shape (..., number of models)
+    """
+    # scipy is only needed by RFX-BMS and the error model, so it is imported here rather than when fitting is imported
+    from scipy.special import digamma
+
+    # for each k, Psi(alpha_k) - Psi(sum over k of alpha_k)
+    listdg = digamma(a) - digamma(a.sum(axis=-1, keepdims=True))
+    # u_nk for all subjects and models at once; subtracting the maximum per subject does not change u_nk / sum_k u_nk
+    log_unk = log_likelihoods + listdg[..., np.newaxis, :]
+    unk = np.exp(log_unk - log_unk.max(axis=-1, keepdims=True))
+    # beta_k is the (weighted) sum over subjects of the normalized u_nk
+    unk = unk / unk.sum(axis=-1, keepdims=True)
+    if weights is not None:
+        unk = unk * weights[..., np.newaxis]
+    return unk.sum(axis=-2)
+
+
+def compute_rfx_bms(log_likelihoods, a0=None, converge_diff=0.001, verbose=False, weights=None):
+    """
+    Vectorized variational update of RFX-BMS, as detailed in 'Bayesian model selection for group studies'
+    (Stephan et al., 2009). Any leading dimensions of log_likelihoods are treated as independent datasets (e.g.
+    bootstrap resamples) that are updated together.
+
+    :param log_likelihoods: array of shape (..., number of subjects, number of models)
+    :param a0: prior alpha, one element per model (if None, then 1 for every model)
+    :param converge_diff: if, between iterations, each element in alpha has changed by this value or less,
+    stop iterating
+    :param verbose: if True, prints alpha after each iteration
+    :param weights: optional array of shape (..., number of subjects) weighting the contribution of each participant
+    (e.g. 0 for participants without any answer in a subset of the data); if None, then all participants count once
+    :return: array of shape (..., number of models) with alpha after convergence (not normalized)
+    """
+    log_likelihoods = np.asarray(log_likelihoods, dtype=float)
+    if a0 is None:
+        a0 = np.ones(log_likelihoods.shape[-1])
+    a = np.broadcast_to(a0, log_likelihoods.shape[:-2] + log_likelihoods.shape[-1:]).astype(float)
+    while True:
+        prev = a
+        a = a0 + compute_rfx_bms_beta(log_likelihoods, a, weights=weights)  # alpha = alpha_0 + beta
+        if verbose:
+            print("a: " + str(a))
+        # Check whether convergence has been achieved
+        if np.all(np.abs(a - prev) <= converge_diff):
+            return a
+
+
+def generate_correct_rates(name_likelihood_file="likelihoods", name_correct_rates_file="correct_rates"):
+    """
+    For each participant, find the model(s) with the best correct rate and save them, together with the best correct
+    rate, to file (one column per participant)
+
+    :param name_likelihood_file: the path to the likelihoods csv file
+    :param name_correct_rates_file: file path where correct rates will be saved
+    """
+    likelihood_df = pd.read_csv(f"{name_likelihood_file}.csv")
+    subjects, model_names, _, correct_rates = get_likelihood_matrices(likelihood_df)
+    is_best = get_best_model_shares(correct_rates) > 0
+
+    correct_rates_df = pd.DataFrame(
+        [[[model_names[k] for k in np.flatnonzero(best_row)] for best_row in is_best], list(correct_rates.max(axis=1))],
+        columns=subjects, dtype=object)
+    correct_rates_df.to_csv(f"{name_correct_rates_file}.csv", index=False)
+
+
 def get_best_models_for_each_subj(name_likelihood_file="likelihoods", name_pred_file="predictions_tom",
                                   name_correct_rates_file="correct_rates", replace_all=False):
     """
@@ -310,50 +663,58 @@ def get_best_models_for_each_subj(name_likelihood_file="likelihoods", name_pred_
     if not os.path.exists(f"{name_likelihood_file}.csv") or replace_all:
         generate_log_likelihoods(name_likelihood_file=name_likelihood_file, name_pred_file=name_pred_file,
                                  replace_all=replace_all)
-    pred_df = pd.read_csv(f"{name_pred_file}.csv")
+    generate_correct_rates(name_likelihood_file=name_likelihood_file, name_correct_rates_file=name_correct_rates_file)
+
     likelihood_df = pd.read_csv(f"{name_likelihood_file}.csv")
+    return dict(zip(zip(likelihood_df["Subject.id"], likelihood_df["Model.name"]), likelihood_df["Log-likelihood"]))
 
-    likelihoods_dict = {}
-    correct_rates_dict = {}
-    correct_rates_df = pd.DataFrame(columns=list(set(pred_df["Subject.id"])))
-    correct_rates_df = correct_rates_df.append(pd.Series(), ignore_index=True)
-    correct_rates_df = correct_rates_df.append(pd.Series(), ignore_index=True)
-    # extract relevant information from the likelihood dataframe
-    for idx, row in likelihood_df.iterrows():
-        likelihoods_dict[(row[0], row[1])] = row[2]
-        correct_rates_dict[(row[0], row[1])] = row[3]
-
-    all_best_correct_rates = []
-    best_correct_rates_per_model = {model_name: [] for model_name in set(likelihood_df["Model.name"])}
-    number_choices_best_per_model = {model_name: 0 for model_name in set(likelihood_df["Model.name"])}
-    # get and store the model(s) with the best correct rate for each participant
-    for subj_idx, subj in enumerate(set(likelihood_df["Subject.id"])):
-        best_correct_rate = 0
-        best_models = []
-
-        for model_id in set(likelihood_df["Model.name"]):
-            curr_correct_rate = correct_rates_dict[(subj, model_id)]
-            if curr_correct_rate > best_correct_rate:
-                best_correct_rate = curr_correct_rate
-                best_models = [model_id]
-            elif curr_correct_rate == best_correct_rate:
-                best_models.append(model_id)
-
-        all_best_correct_rates.append(best_correct_rate)
-
-        for m in best_models:
-            best_correct_rates_per_model[m].append(best_correct_rate)
-            number_choices_best_per_model[m] += 1/len(best_models)
-
-        correct_rates_df[subj][0] = best_models
-        correct_rates_df[subj][1] = best_correct_rate
 
-    correct_rates_df.to_csv(f"{name_correct_rates_file}.csv", index=False)
-    return likelihoods_dict
+def get_model_frequencies(log_likelihoods, model_names, converge_diff=0.001, verbose=False):
+    """
+    Estimate the frequency of each model in the population with RFX-BMS
+
+    :param log_likelihoods: the log-likelihood matrix (subjects x models), see get_likelihood_matrices
+    :param model_names: list of model names, in the column order of log_likelihoods
+    :param converge_diff: see compute_rfx_bms
+    :param verbose: see compute_rfx_bms
+    :return: dictionary of model name -> estimated frequency, sorted by model name
+    """
+    alpha = compute_rfx_bms(log_likelihoods, converge_diff=converge_diff, verbose=verbose)
+    # Normalize final alpha so elements sum to 1
+    a = {model_name: round(alpha[k] / alpha.sum(), 3) for k, model_name in enumerate(model_names)}
+    return dict(sorted(a.items()))
+
+
+def get_likelihood_frequencies(name_likelihood_file="likelihoods", converge_diff=0.001):
+    """
+    Estimate the frequency of each model with RFX-BMS from the likelihoods csv file (see get_model_frequencies)
+
+    :param name_likelihood_file: the path to the likelihoods csv file
+    :param converge_diff: see compute_rfx_bms
+    :return: dictionary of model name -> estimated frequency, sorted by model name
+    """
+    _, model_names, log_likelihoods, _ = get_likelihood_matrices(pd.read_csv(f"{name_likelihood_file}.csv"))
+    return get_model_frequencies(log_likelihoods, model_names, converge_diff=converge_diff)
+
+
+def get_rfx_bms_figures(a, name_correct_rates_file, config=CONFIG):
+    """
+    The RFX-BMS plots: the estimated frequency of each model, and the coherence plots of the best model
+
+    :param a: the estimated frequencies (see get_model_frequencies)
+    :param name_correct_rates_file: the path to the correct rates csv file (see get_best_models_for_each_subj)
+    :param config: identification string of the configuration, used in the file names
+    :return: list of figures, see utilities.render_figure
+    """
+    return [("plot_bar", (a, "Proportion of fit for each strategy", "Model", "Proportion of population", (0, 0.8),
+                          (0, len(a))),
+             dict(title_save_file=f"plots/propfit_{config}", rotation_x=45))] + \
+        get_coherence_figures(name_correct_rates_file, max(a, key=a.get), f"plots/distribcoh_{config}")
 
 
 def rfx_bms(name_likelihood_file="likelihoods", name_pred_file="predictions_tom",
-            name_correct_rates_file="correct_rates", replace_all=False, verbose=False, converge_diff=0.001):
+            name_correct_rates_file="correct_rates", replace_all=False, verbose=False, converge_diff=0.001,
+            fit_error_parameters=False):
     """
     Run RFX-BMS on a model of Cheryl's Puzzle.
 
@@ -366,88 +727,37 @@ def rfx_bms(name_likelihood_file="likelihoods", name_pred_file="predictions_tom"
     :param verbose: if True, prints debug statements
     :param converge_diff: if, between iterations, each element in alpha has changed by this value or less,
     stop iterating
+    :param fit_error_parameters: if True, then one error rate for all participants and models is first fitted with
+    fit_error_model and the log-likelihoods are recomputed with it, in the likelihoods and correct rates files with the
+    FITTED_ERROR_SUFFIX; if False, then the error rate is estimated per participant-model pair
     """
-    logdict = get_best_models_for_each_subj(name_likelihood_file=name_likelihood_file, name_pred_file=name_pred_file,
-                                            name_correct_rates_file=name_correct_rates_file, replace_all=replace_all)
-    likelihood_df = pd.read_csv(f"{name_likelihood_file}.csv")
+    if fit_error_parameters:
+        name_likelihood_file = f"{name_likelihood_file}{FITTED_ERROR_SUFFIX}"
+        name_correct_rates_file = f"{name_correct_rates_file}{FITTED_ERROR_SUFFIX}"
+        # if the predictions file does not exist or replace_all is True, then first generate it
+        if not os.path.exists(f"{name_pred_file}.csv") or replace_all:
+            generate_all_predictions(name_predictions_file=name_pred_file)
+        error_params = fit_error_model(name_pred_file=name_pred_file)
+        print(f"error model: penalty = {error_params['penalty']:.4f} (fixed), epsilon = {error_params['epsilon']}")
+        generate_log_likelihoods(name_likelihood_file=name_likelihood_file, name_pred_file=name_pred_file,
+                                 penalty=error_params["penalty"], epsilon=error_params["epsilon"])
+        replace_all = False
 
-    # Algorithm for RFX-BMS as detailed in 'Bayesian model selection for group studies' (Stephan et al., 2009)
-    a0 = {model_name: 1 for model_name in (set(likelihood_df["Model.name"]))}  # alpha_0, with one element for levels 0 through level maxtom, and an additional element for the random model
-    a = a0.copy()  # We don't change a0
-    # Until convergence:
-    cont = True
-    while (cont):
-        prev = a.copy()  # Previous alpha
-        sumdg = scipy.special.digamma(sum(a.values()))  # Digamma of sum over k of alpha_k
-        if verbose:
-            print("a: " + str(a))
-            print("sum(a): " + str(sum(a.values())))
-            print("scipy.special.digamma(sum(a)) (sumdg): " + str(sumdg))
-        listdg = []  # For each k, Psi(alpha_k) - Psi(sum over k of alpha_k)
-        for model_name in a.keys():  # For each model
-            if verbose:
-                print("scipy.special.digamma(" + str(a[model_name]) + ") = " + str(scipy.special.digamma(a[k])))
-            listdg.append(
-                scipy.special.digamma(a[model_name]) - sumdg)  # Digamma of alpha_k - digamma of sum over k of alpha_k
-        # Loop over models and subjects
-        b = [0] * len(set(likelihood_df["Model.name"]))  # For each k a beta_k
-        if verbose:
-            print("scipy.special.digamma(a[k]) - sumdg for each k: " + str(listdg))
-            print("b before adding: " + str(b))
-        for player in set(likelihood_df["Subject.id"]):  # Loop over all 211 players
-            if verbose:
-                print("player: " + str(player))
-            sumunk = 0  # Sum over k of player's u_{nk}'s
-            unklist = []
-            for k, model_name in enumerate(list(a.keys())):  # Loop over models
-                unk = math.exp(logdict[(player, model_name)] + listdg[k])  # Calculate u_{nk}
-                if verbose:
-                    print("model " + str(model_name))
-                    print("listdg[k]: " + str(listdg[k]))
-                    print("logdict[(player,k)]: " + str(logdict[(player, model_name)]))
-                    print("unk: " + str(unk))
-                unklist.append(unk)
-                sumunk = sumunk + unk
-            for k in range(len(a)):  # Loop over models again
-                b[k] = b[k] + (unklist[k] / sumunk)  # Update b_k
-            if verbose:
-                print("unklist: " + str(unklist))
-                print("sumunk: " + str(sumunk))
-                print("new b: " + str(b))
-        for k, model_name in enumerate(list(a.keys())):  # Update alpha
-            a[model_name] = a0[model_name] + b[k]  # alpha = alpha_0 + beta
-        if verbose:
-            print("final b: " + str(b))
-        cont = False
+    get_best_models_for_each_subj(name_likelihood_file=name_likelihood_file, name_pred_file=name_pred_file,
+                                  name_correct_rates_file=name_correct_rates_file, replace_all=replace_all)
+    likelihood_df = pd.read_csv(f"{name_likelihood_file}.csv")
+    _, model_names, log_likelihoods, _ = get_likelihood_matrices(likelihood_df)
 
-        # Check whether convergence has been achieved
-        highestdiff = 0
-        for model_name in a.keys():
-            if abs(a[model_name] - prev[model_name]) > highestdiff:
-                highestdiff = abs(a[model_name] - prev[model_name])
-            if abs(a[model_name] - prev[model_name]) > converge_diff:
-                cont = True
-        if verbose:
-            input("Press enter to continue")
-            print("%\n\n\n@")
-    # Normalize final alpha so elements sum to 1
-    suma = 0
-    for ak in a.values():
-        suma += ak
-    for model_name in a.keys():
-        a[model_name] = round(a[model_name] / suma, 3)
+    a = get_model_frequencies(log_likelihoods, model_names, converge_diff=converge_diff, verbose=verbose)
 
     print("alpha after convergence:")
-    a = dict(sorted(a.items()))
     print("model" + 10*" " + "estimated frequency")
     for idx, model_name in enumerate(list(a.keys())):
         print(str(model_name) + (10 - abs(len("model") - len(model_name))) * " " + str(a[model_name]))
 
     # if SAVE_BOOL set to True, then plot RFX-BMS results and coherence plots
     if SAVE_BOOL:
-        plot_bar(a, "Proportion of fit for each strategy", "Model", "Proportion of population", (0, 0.8), (0, len(a)),
-                 f"plots/propfit_{CONFIG}", rotation_x=45)
-        plot_coherence(name_correct_rates_file, max(a, key=a.get), f"plots/distribcoh_{CONFIG}")
+        render_figures(get_rfx_bms_figures(a, name_correct_rates_file))
 
 
 if __name__ == "__main__":
@@ -1,8 +1,6 @@
 from puzzle_formalism import Puzzle
 from epistemic_model import EpistemicModel
-from utilities import get_common_ratio
-import pandas as pd
-from collections import Counter
+import os
 from utilities import draw_model
 
 # the highest ToM level possible
@@ -13,21 +11,23 @@ MAX_ITERATIONS = 1
 MODEL_TYPE = EpistemicModel
 # dictionary of keyword argument for the run_model_once function (NOTE: function must be implemented for all model)
 KWARGS = {EpistemicModel: {"model_level": 2, "cutting_direction": "rl", "draw":False, "save_file_name":"./plots/tmp"}}
-# path to file to save results in
-FILE_PATH = "results.txt"
+# path to file to save results in (one row per configuration, subset of the answers and level of ToM)
+FILE_PATH = "results.csv"
 
 
 if __name__ == "__main__":
+    # pandas is only needed for the participants' answers and the results table (see startup.py)
+    import pandas as pd
+    from metrics import explained_data_table
+
     # read in the participants' answers
     subj_df = pd.read_csv("../analysis/All answers_puzzles all trials.csv")
 
     # define puzzle
     cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
 
-    # open file to save results in
-    f = open(FILE_PATH, "a+")
-    f.write(f"\nModel configuration: {str(MODEL_TYPE)} - {KWARGS[MODEL_TYPE]}\n\n")
-
+    # initialize dictionary to save the model answers per level of ToM in
+    model_answers = {}
     # iterate through all levels of ToM
     for level in range(3, MAX_TOM_LEVEL):
         # initialize solver object
@@ -42,14 +42,10 @@ if __name__ == "__main__":
             draw_model(graph, f"plots/level{level+1}_0")
             # solve puzzle and return answer
             list_answers.append(solver.run_model_once(graph, **KWARGS[MODEL_TYPE]))
+        model_answers[level + 1] = list_answers
 
-        # save answers to file
-        f.write(f"Level of ToM: {level+1}\n")
-        f.write(f"\t Explained data: {get_common_ratio(list_answers, subj_df.loc[subj_df['Level'] == level+1]['Translated.answer'].values)}\n")
-        f.write(f"\t Model answers: {dict(Counter(list_answers))}\n")
-
-    f.close()
-
-
-
-
+    # compute the explained data for all levels and subsets of the participants' answers at once
+    results_df = explained_data_table({f"{MODEL_TYPE.__name__} - {KWARGS[MODEL_TYPE]}": model_answers}, subj_df)
+    print(results_df.round(2).to_string(index=False))
+    # append the results to the table of earlier configurations
+    results_df.to_csv(FILE_PATH, mode="a", header=not os.path.exists(FILE_PATH), index=False)
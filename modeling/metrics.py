@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from answer_codec import N_CODES, encode_answers, count_codes
+
+# subsets of the participants' answers: subset name -> (column, value), or None for all answers
+SUBSETS = {"All": None, "Block 1": ("Block", 1), "Block 2": ("Block", 2), "Correct": ("Is.correct", 1),
+           "Incorrect": ("Is.correct", 0)}
+
+
+def compute_explained_data(model_counts, subj_counts):
+    """
+    Vectorized version of get_common_ratio: the number of answers shared by the model and the participants (as
+    multisets) divided by the number of answers of the participants, in percentages
+
+    :param model_counts: array (..., codes) with the answer counts of the models
+    :param subj_counts: array (..., codes) with the answer counts of the participants, broadcastable with model_counts
+    :return: array with the percentage of explained data for every combination
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.minimum(model_counts, subj_counts).sum(axis=-1) * 100 / subj_counts.sum(axis=-1)
+
+
+def explained_data_table(model_answers, subj_df, subsets=SUBSETS):
+    """
+    Compute the percentage of explained data for all models, levels of ToM and subsets of the participants' answers at
+    once and collect it in a tidy table
+
+    :param model_answers: dictionary of model name -> dictionary of level of ToM -> list of answers given by the model
+    :param subj_df: dataframe with the participants' answers ("Level", "Translated.answer" and the subset columns)
+    :param subsets: dictionary of subset name -> (column, value), or None for all answers
+    :return: dataframe with one row per model, subset and level of ToM
+    """
+    model_names = list(model_answers)
+    levels = sorted({level for answers in model_answers.values() for level in answers})
+    subset_names = list(subsets)
+    # flatten the model answers, keeping track of their (model, level) group
+    model_list = [(k, l, answer) for k, model_name in enumerate(model_names)
+                  for l, level in enumerate(levels) for answer in model_answers[model_name].get(level, [])]
+    model_codes = encode_answers([answer for _, _, answer in model_list])
+    subj_codes = encode_answers(subj_df["Translated.answer"])
+
+    model_group = np.array([k * len(levels) + l for k, l, _ in model_list], dtype=int)
+    model_counts = count_codes(model_codes, model_group, len(model_names) * len(levels))
+    model_counts = model_counts.reshape(len(model_names), 1, len(levels), N_CODES)
+
+    # one count matrix per subset: an answer belongs to a (subset, level) group if it passes the subset filter
+    level_idx = pd.Series(range(len(levels)), index=levels).reindex(subj_df["Level"]).to_numpy()
+    subj_counts = np.zeros((len(subset_names), len(levels), N_CODES), dtype=int)
+    for s, subset in enumerate(subsets.values()):
+        in_subset = ~np.isnan(level_idx)
+        if subset is not None:
+            in_subset &= (subj_df[subset[0]] == subset[1]).to_numpy()
+        subj_counts[s] = count_codes(subj_codes[in_subset], level_idx[in_subset].astype(int), len(levels))
+
+    explained = compute_explained_data(model_counts, subj_counts[np.newaxis])
+    shape = explained.shape
+    return pd.DataFrame({"Model.name": np.repeat(model_names, shape[1] * shape[2]),
+                         "Subset": np.tile(np.repeat(subset_names, shape[2]), shape[0]),
+                         "ToM.level": np.tile(levels, shape[0] * shape[1]),
+                         "Explained.data": explained.ravel(),
+                         "N.model.answers": np.broadcast_to(model_counts.sum(axis=-1), shape).ravel(),
+                         "N.subject.answers": np.broadcast_to(subj_counts.sum(axis=-1), shape).ravel()})
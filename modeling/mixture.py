@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+from fitting import PENALTY, get_trial_arrays, compute_trial_likelihoods, get_likelihood_matrices, compute_rfx_bms
+
+# initial value of the error rate, if it is estimated by EM
+INIT_EPSILON = 0.25
+
+
+def fit_trial_mixture(matches, random_probs, mask, penalty=PENALTY, epsilon=None, prior=1.0, converge_diff=1e-6,
+                      max_iter=1000):
+    """
+    Fit a trial-level mixture model with EM: every answer of a participant is generated by one of the models, drawn
+    independently per trial with the participant's own mixing weights. All participants are updated at once.
+
+    :param matches: boolean array (subjects x trials x non-random models), see get_trial_arrays
+    :param random_probs: array (subjects x trials) with the probability of each answer under the random model
+    :param mask: boolean array (subjects x trials), False for padding
+    :param penalty: the penalty of the error model (see compute_trial_likelihoods)
+    :param epsilon: the error rate of the error model; if None, then one error rate shared by all non-random models is
+    estimated together with the weights
+    :param prior: concentration of the symmetric Dirichlet prior on the mixing weights, at least 1 (1 means maximum
+    likelihood; below 1 the MAP weights can be negative)
+    :param converge_diff: stop iterating when the log-likelihood improves by this value or less
+    :param max_iter: the maximum number of EM iterations
+    :return: the mixing weights (subjects x models), the responsibilities (subjects x trials x models), the error rate
+    and the log-likelihood
+    """
+    if prior < 1:
+        raise ValueError("The prior concentration must be at least 1")
+    n_models = matches.shape[-1] + 1
+    n_trials = mask.sum(axis=-1, keepdims=True)
+    weights = np.full((matches.shape[0], n_models), 1 / n_models)
+    eps = INIT_EPSILON if epsilon is None else epsilon
+    prev_likelihood = -np.inf
+
+    for _ in range(max_iter):
+        # E-step: posterior probability of each model having generated each answer
+        joint = weights[:, np.newaxis, :] * compute_trial_likelihoods(matches, random_probs, penalty=penalty,
+                                                                      epsilon=eps)
+        marginal = joint.sum(axis=-1)
+        responsibilities = joint / marginal[..., np.newaxis] * mask[..., np.newaxis]
+        likelihood = np.log(np.where(mask, marginal, 1)).sum()
+
+        # M-step: mixing weights (maximum a posteriori under the Dirichlet prior) and shared error rate
+        weights = (responsibilities.sum(axis=1) + prior - 1) / (n_trials + n_models * (prior - 1))
+        if epsilon is None:
+            non_random = responsibilities[..., :-1]
+            eps = (non_random * ~matches).sum() / non_random.sum()
+
+        if likelihood - prev_likelihood <= converge_diff:
+            break
+        prev_likelihood = likelihood
+
+    return weights, responsibilities, eps, likelihood
+
+
+def trial_mixture(name_pred_file="predictions_tom", name_likelihood_file="likelihoods",
+                  name_mixture_file="mixture_weights", penalty=PENALTY, epsilon=None, prior=1.0):
+    """
+    Fit the trial-level mixture model on the participants' data and compare the population frequencies (mean mixing
+    weight of each model) with the ones estimated by RFX-BMS, which assumes one model per participant
+
+    :param name_pred_file: the path to the predictions csv file
+    :param name_likelihood_file: the path to the likelihoods csv file (used for the RFX-BMS comparison)
+    :param name_mixture_file: file path where the mixing weights of each participant will be saved
+    :param penalty: the penalty of the error model
+    :param epsilon: the error rate of the error model (if None, then it is estimated)
+    :param prior: concentration of the symmetric Dirichlet prior on the mixing weights, at least 1
+    :return: dataframe with the population frequency of each model under both approaches
+    """
+    arrays = get_trial_arrays(pd.read_csv(f"{name_pred_file}.csv"))
+    weights, _, eps, likelihood = fit_trial_mixture(arrays["matches"], arrays["random_probs"], arrays["mask"],
+                                                    penalty=penalty, epsilon=epsilon, prior=prior)
+    model_names = arrays["models"] + ["Random"]
+    print(f"trial-level mixture: epsilon = {eps:.3f}, log-likelihood = {likelihood:.3f}")
+
+    weights_df = pd.DataFrame(weights, columns=model_names)
+    weights_df.insert(0, "Subject.id", arrays["subjects"])
+    weights_df.to_csv(f"{name_mixture_file}.csv", index=False)
+
+    _, rfx_model_names, log_likelihoods, _ = get_likelihood_matrices(pd.read_csv(f"{name_likelihood_file}.csv"))
+    alpha = compute_rfx_bms(log_likelihoods)
+    return pd.DataFrame({"Model.name": model_names,
+                         "Mixture.frequency": weights.mean(axis=0),
+                         "RFX-BMS.frequency": pd.Series(alpha / alpha.sum(), index=rfx_model_names)[model_names]
+                        .to_numpy()}).sort_values("Model.name")
+
+
+if __name__ == "__main__":
+    print(trial_mixture().round(3).to_string(index=False))
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import pandas as pd
+from fitting import PENALTY, predict_answers, generate_log_likelihoods, generate_correct_rates, \
+    get_likelihood_matrices, compute_rfx_bms
+
+# input files of the pipeline
+SUBJECT_FILE = "../analysis/All answers_puzzles.csv"
+QUESTION_FILE = "../interface/question_bank.csv"
+# output files of the stages (without extension, as in fitting.py)
+NAME_PRED_FILE = "predictions_tom"
+NAME_LIKELIHOOD_FILE = "likelihoods"
+NAME_CORRECT_RATES_FILE = "correct_rates"
+NAME_RFX_BMS_FILE = "rfx_bms"
+# file storing the hash of the inputs and outputs of every stage
+MANIFEST_FILE = "pipeline_manifest.json"
+# configuration of the pipeline; changing a value only reruns the stages that depend on it
+PIPELINE_CONFIG = {"max_pa_tom_level": 3, "penalty": PENALTY, "epsilon": None, "multiple_weight": None,
+                   "converge_diff": 0.001}
+
+
+def hash_text(text):
+    """
+    Compute the content hash of a string
+
+    :param text: the string
+    :return: the hexadecimal sha256 digest
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(file_path):
+    """
+    Compute the content hash of a file
+
+    :param file_path: path to the file
+    :return: the hexadecimal sha256 digest, or None if the file does not exist
+    """
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def hash_stage_inputs(*inputs):
+    """
+    Combine the hashes and configuration values a stage depends on into one key
+
+    :param inputs: hashes or json-serializable configuration values
+    :return: the key of the stage
+    """
+    return hash_text(json.dumps(inputs, sort_keys=True))
+
+
+def is_up_to_date(manifest, stage, key, output_file):
+    """
+    Check whether a stage was already run with the same inputs and its output has not been changed or removed since
+
+    :param manifest: the manifest dictionary
+    :param stage: the name of the stage
+    :param key: the key of the current inputs of the stage
+    :param output_file: the output file of the stage
+    :return: True if the stage can be skipped, False otherwise
+    """
+    entry = manifest.get(stage, {})
+    return entry.get("key") == key and entry.get("output") == hash_file(output_file)
+
+
+def run_predictions_stage(manifest, force=False):
+    """
+    Solve the puzzles for all new or changed participants and merge their predictions into the stored prediction table.
+    Each participant is keyed by the hash of their answers, the question bank and the solver configuration.
+
+    :param manifest: the manifest dictionary (updated in place)
+    :param force: if True, then the predictions of all participants are recomputed
+    :return: True if the prediction table changed, False otherwise
+    """
+    subj_df = pd.read_csv(SUBJECT_FILE)
+    questions_df = pd.read_csv(QUESTION_FILE)
+    pred_file = f"{NAME_PRED_FILE}.csv"
+    config_key = hash_stage_inputs(hash_file(QUESTION_FILE), PIPELINE_CONFIG["max_pa_tom_level"])
+    subject_keys = {subj_id: hash_stage_inputs(config_key, subj_rows.to_csv(index=False))
+                    for subj_id, subj_rows in subj_df.groupby("Subject.id")}
+
+    entry = manifest.get("predictions", {})
+    stored_keys = entry.get("subjects", {})
+    # if the stored table was changed or removed, then it cannot be merged into
+    if force or entry.get("output") != hash_file(pred_file):
+        stored_keys = {}
+    changed = [subj_id for subj_id, key in subject_keys.items() if stored_keys.get(subj_id) != key]
+    removed = set(stored_keys) - set(subject_keys)
+    if not changed and not removed:
+        return False
+
+    print(f"predictions: {len(changed)} new or changed participants, {len(removed)} removed")
+    new_predictions = predict_answers(subj_df.loc[subj_df["Subject.id"].isin(changed)], questions_df,
+                                      max_pa_tom_level=PIPELINE_CONFIG["max_pa_tom_level"])
+    if stored_keys:
+        # keep the stored predictions of the unchanged participants
+        stored_predictions = pd.read_csv(pred_file)
+        stored_predictions = stored_predictions.loc[~stored_predictions["Subject.id"].isin(set(changed) | removed)]
+        # rows read from file store the dictionaries and lists as strings; write them back the same way
+        new_predictions = pd.concat([stored_predictions, new_predictions.astype({"Model.predictions": str,
+                                                                                  "Is.model.correct": str})])
+    new_predictions.sort_values(["Subject.id", "Trial"]).to_csv(pred_file, index=False)
+
+    manifest["predictions"] = {"subjects": subject_keys, "output": hash_file(pred_file)}
+    return True
+
+
+def run_likelihoods_stage(manifest, force=False):
+    """
+    Compute the evidence of all models for all participants. The random model depends on the answers of the whole
+    population, so the (vectorized) stage is rerun as a whole whenever the prediction table changes.
+
+    :param manifest: the manifest dictionary (updated in place)
+    :param force: if True, then the stage is rerun even if its inputs did not change
+    :return: True if the stage was rerun, False otherwise
+    """
+    key = hash_stage_inputs(hash_file(f"{NAME_PRED_FILE}.csv"), PIPELINE_CONFIG["penalty"],
+                            PIPELINE_CONFIG["epsilon"], PIPELINE_CONFIG["multiple_weight"])
+    if not force and is_up_to_date(manifest, "likelihoods", key, f"{NAME_LIKELIHOOD_FILE}.csv"):
+        return False
+    print("likelihoods: recomputing")
+    generate_log_likelihoods(name_likelihood_file=NAME_LIKELIHOOD_FILE, name_pred_file=NAME_PRED_FILE,
+                             penalty=PIPELINE_CONFIG["penalty"], epsilon=PIPELINE_CONFIG["epsilon"],
+                             multiple_weight=PIPELINE_CONFIG["multiple_weight"])
+    manifest["likelihoods"] = {"key": key, "output": hash_file(f"{NAME_LIKELIHOOD_FILE}.csv")}
+    return True
+
+
+def run_correct_rates_stage(manifest, force=False):
+    """
+    Find the best model(s) for each participant
+
+    :param manifest: the manifest dictionary (updated in place)
+    :param force: if True, then the stage is rerun even if its inputs did not change
+    :return: True if the stage was rerun, False otherwise
+    """
+    key = hash_stage_inputs(hash_file(f"{NAME_LIKELIHOOD_FILE}.csv"))
+    if not force and is_up_to_date(manifest, "correct_rates", key, f"{NAME_CORRECT_RATES_FILE}.csv"):
+        return False
+    print("correct rates: recomputing")
+    generate_correct_rates(name_likelihood_file=NAME_LIKELIHOOD_FILE, name_correct_rates_file=NAME_CORRECT_RATES_FILE)
+    manifest["correct_rates"] = {"key": key, "output": hash_file(f"{NAME_CORRECT_RATES_FILE}.csv")}
+    return True
+
+
+def run_rfx_bms_stage(manifest, force=False):
+    """
+    Estimate the frequency of each model in the population with RFX-BMS and save them to file
+
+    :param manifest: the manifest dictionary (updated in place)
+    :param force: if True, then the stage is rerun even if its inputs did not change
+    :return: True if the stage was rerun, False otherwise
+    """
+    key = hash_stage_inputs(hash_file(f"{NAME_LIKELIHOOD_FILE}.csv"), PIPELINE_CONFIG["converge_diff"])
+    if not force and is_up_to_date(manifest, "rfx_bms", key, f"{NAME_RFX_BMS_FILE}.csv"):
+        return False
+    print("RFX-BMS: recomputing")
+    _, model_names, log_likelihoods, _ = get_likelihood_matrices(pd.read_csv(f"{NAME_LIKELIHOOD_FILE}.csv"))
+    alpha = compute_rfx_bms(log_likelihoods, converge_diff=PIPELINE_CONFIG["converge_diff"])
+    pd.DataFrame({"Model.name": model_names, "Estimated.frequency": alpha / alpha.sum()}).to_csv(
+        f"{NAME_RFX_BMS_FILE}.csv", index=False)
+    manifest["rfx_bms"] = {"key": key, "output": hash_file(f"{NAME_RFX_BMS_FILE}.csv")}
+    return True
+
+
+# the stages in the order in which they depend on each other
+STAGES = [run_predictions_stage, run_likelihoods_stage, run_correct_rates_stage, run_rfx_bms_stage]
+
+
+def run_pipeline(force=False):
+    """
+    Run all stages of the fitting pipeline, skipping the stages whose inputs and configuration did not change. The
+    manifest is saved after every stage, so an interrupted run resumes from the first stage that did not finish.
+
+    :param force: if True, then all stages are rerun from scratch
+    """
+    manifest = {}
+    if os.path.exists(MANIFEST_FILE) and not force:
+        with open(MANIFEST_FILE, "r") as f:
+            manifest = json.load(f)
+
+    for stage in STAGES:
+        if not stage(manifest, force=force):
+            print(f"{stage.__name__}: up to date")
+        with open(MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f, indent=1)
+
+
+if __name__ == "__main__":
+    run_pipeline()
+    print(pd.read_csv(f"{NAME_RFX_BMS_FILE}.csv").round(3).to_string(index=False))
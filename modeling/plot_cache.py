@@ -0,0 +1,91 @@
+import os
+import hashlib
+import pickle
+
+# folder of the cache, relative to the folder the code runs in (analysis or modeling)
+CACHE_DIR = "plot_cache"
+# hash of every file read so far: path -> (size, modification time, hash), so that a file is only hashed again when it
+# changes
+FILE_HASHES = {}
+
+
+def hash_files(file_paths):
+    """
+    Compute the version of input data stored in files: the sha256 hash of their content
+
+    :param file_paths: list of paths to the files
+    :return: the hexadecimal hash
+    """
+    version = hashlib.sha256()
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        cached = FILE_HASHES.get(file_path)
+        if cached is None or cached[:2] != (stat.st_size, stat.st_mtime_ns):
+            file_hash = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    file_hash.update(block)
+            cached = (stat.st_size, stat.st_mtime_ns, file_hash.hexdigest())
+            FILE_HASHES[file_path] = cached
+        version.update(cached[2].encode())
+    return version.hexdigest()
+
+
+def get_argument_key(argument):
+    """
+    :param argument: an argument of a memoized function
+    :return: what identifies the argument in the cache key: the version of a dataset (any object with a "version"
+    attribute, e.g. analysis/dataset.AnswerDataset), otherwise the argument itself
+    """
+    return ("version", argument.version) if hasattr(argument, "version") else argument
+
+
+def memoize(function, *args, input_files=(), cache_dir=CACHE_DIR, **kwargs):
+    """
+    Compute the data of a figure, or load it from the cache if it was computed before from the same input data and
+    with the same arguments. Only the data is cached, so styling changes (titles, colors, orientation) are rendered
+    from the cache without computing it again. The code of the function is not part of the key: after changing how
+    the data is computed, clear the cache (see clear_cache).
+
+    :param function: the function that computes the data
+    :param args: the positional arguments of the function
+    :param input_files: files that the function reads (their content is part of the cache key)
+    :param cache_dir: the folder of the cache
+    :param kwargs: the keyword arguments of the function
+    :return: the data
+    """
+    key = pickle.dumps((function.__qualname__, hash_files(input_files),
+                        [get_argument_key(arg) for arg in args],
+                        sorted((name, get_argument_key(arg)) for name, arg in kwargs.items())))
+    cache_path = os.path.join(cache_dir, f"{function.__name__}_{hashlib.sha256(key).hexdigest()[:16]}.pkl")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+
+    data = function(*args, **kwargs)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first, so that parallel processes never read a partially written entry
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(data, f)
+    os.replace(tmp_path, cache_path)
+    return data
+
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """
+    Remove all cached data
+
+    :param cache_dir: the folder of the cache
+    :return: the number of removed entries
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = [entry for entry in os.listdir(cache_dir) if entry.endswith(".pkl")]
+    for entry in entries:
+        os.remove(os.path.join(cache_dir, entry))
+    return len(entries)
+
+
+if __name__ == "__main__":
+    print(f"Removed {clear_cache()} cached entries")
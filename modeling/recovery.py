@@ -0,0 +1,251 @@
+import os
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from fitting import compute_likelihood, compute_random_evidence, compute_rfx_bms
+from puzzle_formalism import Puzzle
+from utilities import format_text_states
+from answer_codec import ANSWERS, SPECIAL_ANSWERS, encode_answers, count_codes
+
+# ToM level of each of the eight trials of a synthetic participant (two puzzles per level, as in the experiment)
+TRIAL_LEVELS = [1, 2, 3, 4, 1, 2, 3, 4]
+# cohort sizes for which recovery is simulated
+COHORT_SIZES = [10, 25, 50, 100, 200]
+# number of synthetic experiments per cohort size (spread evenly over the generating models for model recovery)
+N_EXPERIMENTS = 1000
+# number of synthetic experiments simulated together by one worker task
+CHUNK_SIZE = 100
+# error rates of the synthetic participants are drawn uniformly from [0, MAX_EPSILON]
+MAX_EPSILON = 0.5
+# root seed from which the independent random streams of all chunks are derived
+SEED = 42
+
+
+def load_recovery_data(name_pred_file="predictions_tom"):
+    """
+    Collect the cached model predictions per ToM level and encode all answers as integer codes
+
+    :param name_pred_file: the path to the predictions csv file
+    :return: dictionary with
+        "models": the model names (the random model last)
+        "vocabulary": the list of all answers; answers are represented by their index in this list (see answer_codec)
+        "options": array (ToM levels x answer options) with the codes of the answers available for each puzzle
+        "predictions": array (non-random models x ToM levels) with the code of each model's answer
+        "population": the probability of each answer in the participants' data (used by the random model)
+    """
+    pred_df = pd.read_csv(f"{name_pred_file}.csv")
+    level_predictions = {row["ToM.level"]: eval(row["Model.predictions"])
+                         for _, row in pred_df.drop_duplicates("ToM.level").iterrows()}
+    model_names = list(level_predictions[1].keys())
+
+    # the answers available for each puzzle are the states of its ToM level and the special answers
+    cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
+    level_options = [[format_text_states(state) for state in states] + SPECIAL_ANSWERS for states in cb.all_states]
+    subj_codes = encode_answers(pred_df["Subject.answer"])
+
+    return {"models": model_names + ["Random"],
+            "vocabulary": ANSWERS,
+            "options": encode_answers(level_options),
+            "predictions": encode_answers([[level_predictions[level][model_name] for level in range(1, 5)]
+                                           for model_name in model_names]),
+            "population": count_codes(subj_codes) / len(subj_codes)}
+
+
+def simulate_answers(rng, true_models, epsilons, data, levels=None):
+    """
+    Sample the answers of synthetic participants with the error model of compute_likelihood: with probability 1 - e
+    the participant gives the answer of their model, otherwise one of the other answer options, chosen uniformly. The
+    random model samples answers from the answer distribution of the participants.
+
+    :param rng: the numpy random generator
+    :param true_models: array (..., trials) with the index of the model generating each answer; a trial axis of length
+    1 means that the participant uses the same model for all trials
+    :param epsilons: array broadcastable to true_models with the error rates
+    :param data: see load_recovery_data
+    :param levels: array broadcastable to true_models with the ToM level of each trial (if None, then TRIAL_LEVELS)
+    :return: array (..., trials) of answer codes
+    """
+    levels = np.asarray(TRIAL_LEVELS if levels is None else levels) - 1
+    shape = np.broadcast_shapes(true_models.shape, levels.shape)
+    true_models = np.broadcast_to(true_models, shape)
+    levels = np.broadcast_to(levels, shape)
+    options = data["options"][levels]
+    n_options = options.shape[-1]
+    random_idx = len(data["models"]) - 1
+
+    # answer of the generating model (a placeholder for the random model) and its position among the options
+    model_answers = data["predictions"][np.minimum(true_models, random_idx - 1), levels]
+    model_positions = np.argmax(options == model_answers[..., np.newaxis], axis=-1)
+    # uniformly chosen wrong answer: skip the position of the model's answer
+    wrong_positions = rng.integers(0, n_options - 1, size=shape)
+    wrong_positions += wrong_positions >= model_positions
+    wrong_answers = np.take_along_axis(options, wrong_positions[..., np.newaxis], axis=-1)[..., 0]
+    is_error = rng.random(shape) < epsilons
+    answers = np.where(is_error, wrong_answers, model_answers)
+
+    random_answers = rng.choice(len(data["vocabulary"]), size=shape, p=data["population"])
+    return np.where(true_models == random_idx, random_answers, answers)
+
+
+def fit_answers(answers, data):
+    """
+    Run the fitting chain (likelihoods -> RFX-BMS) on synthetic cohorts
+
+    :param answers: array (experiments x subjects x trials) of answer codes
+    :param data: see load_recovery_data
+    :return: the log-likelihoods (experiments x subjects x models), the matches with each non-random model
+    (experiments x subjects x non-random models) and the normalized RFX-BMS frequencies (experiments x models)
+    """
+    levels = np.array(TRIAL_LEVELS) - 1
+    n_trials = len(levels)
+    matches = (answers[..., np.newaxis, :] == data["predictions"][:, levels]).sum(axis=-1)
+    answer_counts = (answers[..., np.newaxis] == np.arange(len(data["vocabulary"]))).sum(axis=-2)
+
+    likelihoods = compute_likelihood(matches, n_trials - matches)
+    likelihood_random, _ = compute_random_evidence(answer_counts, answer_counts.sum(axis=-2))
+    log_likelihoods = np.concatenate([likelihoods, likelihood_random[..., np.newaxis]], axis=-1)
+
+    alpha = compute_rfx_bms(log_likelihoods)
+    return log_likelihoods, matches, alpha / alpha.sum(axis=-1, keepdims=True)
+
+
+def get_assignment_shares(log_likelihoods):
+    """
+    Assign each participant to the model with the highest log-likelihood (splitting ties evenly) and compute the share
+    of participants assigned to each model
+
+    :param log_likelihoods: array (experiments x subjects x models)
+    :return: array (experiments x models)
+    """
+    is_best = log_likelihoods == log_likelihoods.max(axis=-1, keepdims=True)
+    return (is_best / is_best.sum(axis=-1, keepdims=True)).mean(axis=-2)
+
+
+def model_recovery_chunk(seed, first_experiment, n_experiments, n_subjects, data):
+    """
+    Simulate and fit homogeneous cohorts, in which all participants use the same model
+
+    :param seed: the numpy SeedSequence of this chunk
+    :param first_experiment: the index of the first experiment of this chunk (determines the generating models)
+    :param n_experiments: the number of experiments in this chunk
+    :param n_subjects: the number of participants per cohort
+    :param data: see load_recovery_data
+    :return: the generating model of each experiment, the RFX-BMS frequencies and the assignment shares
+    """
+    rng = np.random.default_rng(seed)
+    true_model = (first_experiment + np.arange(n_experiments)) % len(data["models"])
+    true_models = np.repeat(true_model[:, np.newaxis], n_subjects, axis=1)
+    epsilons = rng.uniform(0, MAX_EPSILON, size=true_models.shape)
+    log_likelihoods, _, frequencies = fit_answers(
+        simulate_answers(rng, true_models[..., np.newaxis], epsilons[..., np.newaxis], data), data)
+    return true_model, frequencies, get_assignment_shares(log_likelihoods)
+
+
+def parameter_recovery_chunk(seed, n_experiments, n_subjects, data):
+    """
+    Simulate and fit mixed cohorts, with model frequencies drawn from a flat Dirichlet distribution and an error rate
+    drawn for every participant
+
+    :param seed: the numpy SeedSequence of this chunk
+    :param n_experiments: the number of experiments in this chunk
+    :param n_subjects: the number of participants per cohort
+    :param data: see load_recovery_data
+    :return: the true and the estimated model frequencies (experiments x models), and the true and the estimated
+    error rates of all non-random participants
+    """
+    rng = np.random.default_rng(seed)
+    n_models = len(data["models"])
+    true_frequencies = rng.dirichlet(np.ones(n_models), size=n_experiments)
+    # draw each participant's model from the cohort's frequencies
+    cumulative = true_frequencies.cumsum(axis=-1)[:, np.newaxis, :]
+    true_models = np.minimum((rng.random((n_experiments, n_subjects, 1)) > cumulative).sum(axis=-1), n_models - 1)
+    epsilons = rng.uniform(0, MAX_EPSILON, size=true_models.shape)
+    _, matches, frequencies = fit_answers(
+        simulate_answers(rng, true_models[..., np.newaxis], epsilons[..., np.newaxis], data), data)
+
+    # the error rate is estimated as in compute_likelihood, from the matches with the generating model
+    is_random = true_models == n_models - 1
+    true_matches = np.take_along_axis(matches, np.minimum(true_models, n_models - 2)[..., np.newaxis], axis=-1)[..., 0]
+    estimated_epsilons = 1 - true_matches / len(TRIAL_LEVELS)
+    return true_frequencies, frequencies, epsilons[~is_random], estimated_epsilons[~is_random]
+
+
+def split_chunks(n_experiments, chunk_size):
+    """
+    Split a number of experiments into chunks
+
+    :param n_experiments: the number of experiments
+    :param chunk_size: the maximum number of experiments per chunk
+    :return: list of (index of the first experiment, number of experiments) per chunk
+    """
+    return [(start, min(chunk_size, n_experiments - start)) for start in range(0, n_experiments, chunk_size)]
+
+
+def run_recovery(name_pred_file="predictions_tom", name_recovery_file="recovery", cohort_sizes=COHORT_SIZES,
+                 n_experiments=N_EXPERIMENTS, chunk_size=CHUNK_SIZE, seed=SEED, n_workers=None):
+    """
+    Simulate synthetic cohorts from each model with the error model of compute_likelihood, fit them with the whole
+    fitting chain in parallel and save
+        i) the confusion matrices of model recovery (mean RFX-BMS frequency and mean share of participants assigned
+        to each fitted model, for each generating model and cohort size)
+        ii) the recovery rates (how often the generating model gets the highest RFX-BMS frequency) and the parameter
+        recovery errors (model frequencies and error rates) for each cohort size
+
+    :param name_pred_file: the path to the predictions csv file (its cached predictions are reused)
+    :param name_recovery_file: prefix of the file paths where the results will be saved
+    :param cohort_sizes: the numbers of participants per synthetic cohort
+    :param n_experiments: the number of synthetic experiments per cohort size, for each type of recovery
+    :param chunk_size: the number of experiments per worker task
+    :param seed: the root seed
+    :param n_workers: the number of worker processes (if None, then the number of CPUs)
+    :return: the confusion dataframe and the recovery rates dataframe
+    """
+    data = load_recovery_data(name_pred_file)
+    model_names = data["models"]
+    chunks = split_chunks(n_experiments, chunk_size)
+    seeds = iter(np.random.SeedSequence(seed).spawn(2 * len(cohort_sizes) * len(chunks)))
+    model_tasks = [(next(seeds), start, size, n_subjects, data) for n_subjects in cohort_sizes for start, size in chunks]
+    parameter_tasks = [(next(seeds), size, n_subjects, data) for n_subjects in cohort_sizes for _, size in chunks]
+    with Pool(n_workers or os.cpu_count()) as pool:
+        model_results = pool.starmap(model_recovery_chunk, model_tasks)
+        parameter_results = pool.starmap(parameter_recovery_chunk, parameter_tasks)
+
+    confusion_rows = []
+    rate_rows = []
+    for size_idx, n_subjects in enumerate(cohort_sizes):
+        size_results = model_results[size_idx * len(chunks):(size_idx + 1) * len(chunks)]
+        true_model = np.concatenate([result[0] for result in size_results])
+        frequencies = np.concatenate([result[1] for result in size_results])
+        shares = np.concatenate([result[2] for result in size_results])
+        for k, true_name in enumerate(model_names):
+            is_true = true_model == k
+            for j, fitted_name in enumerate(model_names):
+                confusion_rows.append([n_subjects, true_name, fitted_name, frequencies[is_true, j].mean(),
+                                       shares[is_true, j].mean()])
+            # how often the generating model is the one with the highest estimated frequency
+            rate_rows.append([n_subjects, true_name, "Recovery rate",
+                              np.mean(frequencies[is_true].argmax(axis=-1) == k)])
+
+        size_results = parameter_results[size_idx * len(chunks):(size_idx + 1) * len(chunks)]
+        true_frequencies, est_frequencies, true_epsilons, est_epsilons = \
+            [np.concatenate([result[i] for result in size_results]) for i in range(4)]
+        rate_rows.append([n_subjects, "", "Frequency MAE", np.abs(true_frequencies - est_frequencies).mean()])
+        rate_rows.append([n_subjects, "", "Epsilon MAE", np.abs(true_epsilons - est_epsilons).mean()])
+        rate_rows.append([n_subjects, "", "Epsilon correlation", np.corrcoef(true_epsilons, est_epsilons)[0, 1]])
+
+    confusion_df = pd.DataFrame(confusion_rows, columns=["Cohort.size", "True.model", "Fitted.model",
+                                                         "Estimated.frequency", "Assigned.share"])
+    rates_df = pd.DataFrame(rate_rows, columns=["Cohort.size", "True.model", "Statistic", "Value"])
+    confusion_df.to_csv(f"{name_recovery_file}_confusion.csv", index=False)
+    rates_df.to_csv(f"{name_recovery_file}_rates.csv", index=False)
+    return confusion_df, rates_df
+
+
+if __name__ == "__main__":
+    confusion, rates = run_recovery()
+    for size in COHORT_SIZES:
+        print(f"\nCohort size {size}: mean RFX-BMS frequency (rows: generating model, columns: fitted model)")
+        print(confusion.loc[confusion["Cohort.size"] == size].pivot(
+            index="True.model", columns="Fitted.model", values="Estimated.frequency").round(3).to_string())
+    print()
+    print(rates.pivot(index=["True.model", "Statistic"], columns="Cohort.size", values="Value").round(3).to_string())
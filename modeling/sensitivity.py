@@ -0,0 +1,101 @@
+import os
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from fitting import CONFIG, SAVE_BOOL, get_likelihood_matrices, compute_rfx_bms
+from utilities import render_figures
+
+# symmetric Dirichlet priors (a0 of every model) to sweep over
+PRIOR_GRID = [0.1, 0.5, 1, 2, 5, 10]
+# convergence tolerances (converge_diff) to sweep over
+TOLERANCE_GRID = [1e-1, 1e-2, 1e-3, 1e-4, 1e-6]
+# model subsets to sweep over: subset name -> models left out of the comparison
+MODEL_SUBSETS = {"All": [], "Without Random": ["Random"], "Without Cut 1-rl": ["Cut 1-rl"],
+                 "Without Epistemic": ["Epistemic"]}
+# the configuration of rfx_bms, against which the other configurations are compared
+REFERENCE = {"Subset": "All", "Prior": 1, "Tolerance": 1e-3}
+
+
+def run_configuration(subset_name, left_out, prior, tolerance, model_names, log_likelihoods):
+    """
+    Run RFX-BMS on one configuration of the sweep
+
+    :param subset_name: the name of the model subset
+    :param left_out: list of the models left out of the comparison in this subset
+    :param prior: the prior alpha of every model
+    :param tolerance: the convergence tolerance
+    :param model_names: list of all model names, in the column order of log_likelihoods
+    :param log_likelihoods: the log-likelihood matrix (subjects x models) of all models
+    :return: list with the configuration followed by the estimated frequency of each model (NaN if left out)
+    """
+    kept = np.array([model_name not in left_out for model_name in model_names])
+    alpha = compute_rfx_bms(log_likelihoods[:, kept], a0=np.full(kept.sum(), prior), converge_diff=tolerance)
+    frequencies = np.full(len(model_names), np.nan)
+    frequencies[kept] = alpha / alpha.sum()
+    return [subset_name, prior, tolerance] + list(frequencies)
+
+
+def sensitivity_sweep(name_likelihood_file="likelihoods", name_sensitivity_file="sensitivity", priors=PRIOR_GRID,
+                      tolerances=TOLERANCE_GRID, subsets=MODEL_SUBSETS, n_workers=None):
+    """
+    Check how robust the RFX-BMS model frequencies are to the prior, the convergence tolerance and the set of compared
+    models. Every configuration is run separately (so each one stops at its own tolerance) by parallel workers on the
+    cached likelihood matrix.
+
+    :param name_likelihood_file: the path to the likelihoods csv file
+    :param name_sensitivity_file: file path where the results of the sweep will be saved
+    :param priors: list of symmetric priors
+    :param tolerances: list of convergence tolerances
+    :param subsets: dictionary of subset name -> models left out of the comparison (see MODEL_SUBSETS)
+    :param n_workers: the number of worker processes (if None, then the number of CPUs)
+    :return: dataframe with one row per configuration and one frequency column per model
+    """
+    _, model_names, log_likelihoods, _ = get_likelihood_matrices(pd.read_csv(f"{name_likelihood_file}.csv"))
+    tasks = [(subset_name, left_out, prior, tolerance, model_names, log_likelihoods)
+             for subset_name, left_out in subsets.items() for prior in priors for tolerance in tolerances]
+    with Pool(n_workers or os.cpu_count()) as pool:
+        rows = pool.starmap(run_configuration, tasks)
+
+    sensitivity_df = pd.DataFrame(rows, columns=["Subset", "Prior", "Tolerance"] + model_names)
+    sensitivity_df.to_csv(f"{name_sensitivity_file}.csv", index=False)
+    return sensitivity_df
+
+
+def get_frequency_shifts(sensitivity_df):
+    """
+    Compute how much each model frequency moves away from the reference configuration. Only the configurations that
+    use the reference tolerance, or that differ from the reference in the tolerance alone, are kept.
+
+    :param sensitivity_df: see sensitivity_sweep
+    :return: dataframe with one row per kept configuration (labelled by its settings) and one column per model
+    """
+    model_names = list(sensitivity_df.columns[3:])
+    is_reference = (sensitivity_df["Subset"] == REFERENCE["Subset"]) & (sensitivity_df["Prior"] == REFERENCE["Prior"])
+    reference = sensitivity_df.loc[is_reference & (sensitivity_df["Tolerance"] == REFERENCE["Tolerance"]),
+                                   model_names].iloc[0]
+    kept_df = sensitivity_df.loc[(sensitivity_df["Tolerance"] == REFERENCE["Tolerance"]) | is_reference]
+    labels = [f"{subset}, a0={prior:g}, tol={tolerance:g}"
+              for subset, prior, tolerance in zip(kept_df["Subset"], kept_df["Prior"], kept_df["Tolerance"])]
+    return pd.DataFrame(kept_df[model_names].to_numpy() - reference.to_numpy(), index=labels, columns=model_names)
+
+
+def get_sensitivity_figures(shifts, config=CONFIG):
+    """
+    Heatmap of how much each model frequency moves away from the reference configuration
+
+    :param shifts: see get_frequency_shifts
+    :param config: identification string of the configuration, used in the file name
+    :return: list of figures, see utilities.render_figure
+    """
+    return [("plot_heatmap", (shifts, "Change in estimated frequency w.r.t. a0=1, tol=0.001", "Model", "Configuration"),
+             dict(title_save_file=f"plots/sensitivity_{config}", color_label="Change in proportion of population"))]
+
+
+if __name__ == "__main__":
+    df = sensitivity_sweep()
+    shifts = get_frequency_shifts(df)
+    print(shifts.round(3).to_string())
+
+    # if SAVE_BOOL set to True, then plot how the frequencies move with respect to the reference configuration
+    if SAVE_BOOL:
+        render_figures(get_sensitivity_figures(shifts))
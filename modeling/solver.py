@@ -1,10 +1,79 @@
 import random
 from utilities import format_text_states
-import networkx as nx
 
 SEED = 42
 
 
+class KripkeGraph:
+    def __init__(self):
+        """
+        Minimal directed graph for the Kripke models, with the part of the networkx.DiGraph interface used by the
+        solvers: the solvers only need the states and their relations, so networkx is only imported to draw a model
+        (see to_networkx)
+        """
+        # dictionary of node -> attributes and (node, node) -> attributes, in insertion order (as in networkx)
+        self.nodes = {}
+        self.edges = {}
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def add_node(self, node, **attributes):
+        """
+        Add a node, or update the attributes of an existing node
+        """
+        self.nodes.setdefault(node, {}).update(attributes)
+
+    def add_edge(self, node_from, node_to, **attributes):
+        """
+        Add an edge (and its nodes), or update the attributes of an existing edge
+        """
+        self.nodes.setdefault(node_from, {})
+        self.nodes.setdefault(node_to, {})
+        self.edges.setdefault((node_from, node_to), {}).update(attributes)
+
+    def remove_nodes_from(self, nodes):
+        """
+        Remove nodes together with all their edges; nodes that are not in the graph are ignored
+        """
+        nodes = set(nodes)
+        self.nodes = {node: attributes for node, attributes in self.nodes.items() if node not in nodes}
+        self.edges = {edge: attributes for edge, attributes in self.edges.items()
+                      if edge[0] not in nodes and edge[1] not in nodes}
+
+    def remove_edges_from(self, edges):
+        """
+        Remove edges; edges that are not in the graph are ignored
+        """
+        for edge in edges:
+            self.edges.pop(edge, None)
+
+    def copy(self):
+        """
+        :return: a copy of the graph (the attributes are copied as well)
+        """
+        graph = KripkeGraph()
+        graph.nodes = {node: dict(attributes) for node, attributes in self.nodes.items()}
+        graph.edges = {edge: dict(attributes) for edge, attributes in self.edges.items()}
+        return graph
+
+    def to_networkx(self):
+        """
+        :return: the graph as a networkx.DiGraph (e.g. to draw it)
+        """
+        import networkx as nx
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.nodes.items())
+        graph.add_edges_from((node_from, node_to, attributes) for (node_from, node_to), attributes in self.edges.items())
+        return graph
+
+
 class Solver:
     def __init__(self, max_iter, max_tom_level, curr_tom_level, puzzle):
         """
@@ -102,12 +171,12 @@ class Solver:
 
     def generate_full_model(self):
         """
-        Generates the full initial epistemic structure as a networkx graph
+        Generates the full initial epistemic structure as a graph
 
-        :return: the graph
+        :return: the graph (see KripkeGraph)
         """
         # define a directed graph
-        G = nx.DiGraph()
+        G = KripkeGraph()
         # get the number of states (note that the states are hardcoded in the Puzzle class)
         num_all_states = len(self.puzzle.all_states[self.curr_level])
         # compute players' uncertainty (the R relation)
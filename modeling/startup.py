@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import subprocess
+import tempfile
+from statistics import median
+
+# folder of the modeling code, in which every scenario is run
+MODELING_DIR = os.path.dirname(os.path.abspath(__file__))
+# target for the time from the first import to the first answer of the solver, in milliseconds
+SOLVER_TARGET_MS = 100
+# number of fresh interpreters per scenario (the median is reported)
+N_RUNS = 7
+# code run in a fresh interpreter for each scenario: it prints the time from its first import to its first answer (in
+# milliseconds) and the answer; the first command line argument is a temporary folder for the drawings
+SCENARIOS = {
+    # only solve the first-order puzzle
+    "solver": """
+import time
+start = time.perf_counter()
+from puzzle_formalism import Puzzle
+from epistemic_model import EpistemicModel
+cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
+solver = EpistemicModel(1, 4, 0, cb)
+answer = solver.run_model_once(solver.generate_full_model())
+print((time.perf_counter() - start) * 1000, answer, sep="|")
+""",
+    # the first answer of main.py: draw the initial Kripke model, then solve the puzzle with the configured model
+    "main.py": """
+import sys, time
+start = time.perf_counter()
+import main
+from puzzle_formalism import Puzzle
+cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
+level = 3
+solver = main.MODEL_TYPE(main.MAX_ITERATIONS, main.MAX_TOM_LEVEL, level, cb)
+graph = solver.generate_full_model()
+main.draw_model(graph, f"{sys.argv[1]}/level{level + 1}_0")
+answer = solver.run_model_once(graph, **main.KWARGS[main.MODEL_TYPE])
+print((time.perf_counter() - start) * 1000, answer, sep="|")
+""",
+}
+
+
+def run_scenario(code, n_runs=N_RUNS):
+    """
+    Run a scenario in fresh interpreters, so that nothing is imported beforehand
+
+    :param code: the code of the scenario (see SCENARIOS)
+    :param n_runs: the number of runs
+    :return: the median time from the first import to the first answer, the median time of the whole process
+    (including the start of the interpreter) in milliseconds, and the answer
+    """
+    answer_times, process_times = [], []
+    with tempfile.TemporaryDirectory() as plot_dir:
+        for _ in range(n_runs):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", code, plot_dir], cwd=MODELING_DIR, capture_output=True,
+                                    text=True, check=True).stdout
+            process_times.append((time.perf_counter() - start) * 1000)
+            answer_time, answer = output.strip().splitlines()[-1].split("|")
+            answer_times.append(float(answer_time))
+    return median(answer_times), median(process_times), answer
+
+
+def benchmark_startup(scenarios=SCENARIOS, n_runs=N_RUNS):
+    """
+    Measure the import-to-first-answer time of every scenario
+
+    :param scenarios: dictionary of scenario name -> code
+    :param n_runs: the number of runs per scenario
+    :return: dictionary of scenario name -> (import-to-first-answer time, process time, answer)
+    """
+    return {name: run_scenario(code, n_runs) for name, code in scenarios.items()}
+
+
+if __name__ == "__main__":
+    results = benchmark_startup()
+    print("scenario" + 8 * " " + "import to first answer (ms)   whole process (ms)   answer")
+    for scenario_name, (first_answer_ms, process_ms, first_answer) in results.items():
+        print(f"{scenario_name:<16}{first_answer_ms:>27.1f}{process_ms:>21.1f}   {first_answer}")
+    solver_ms = results["solver"][0]
+    print(f"solver: {solver_ms:.1f} ms, target {SOLVER_TARGET_MS} ms "
+          f"({'met' if solver_ms < SOLVER_TARGET_MS else 'not met'})")
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+from fitting import PENALTY, compute_likelihood, compute_random_evidence, compute_rfx_bms, get_answer_codes, \
+    sum_per_subject
+from answer_codec import N_CODES, count_codes
+
+# file with the participants' answers, used for the columns that are not stored in the prediction table
+SUBJECT_FILE = "../analysis/All answers_puzzles.csv"
+# stratification factors: stratum name -> column of the (enriched) prediction table
+STRATA = {"Level": "ToM.level", "Scenario": "Scenario", "Block": "Block", "Correct": "Is.subject.correct"}
+
+
+def load_stratified_table(name_pred_file="predictions_tom", subject_file=SUBJECT_FILE):
+    """
+    Load the prediction table and add the scenario and block of every answer with a single indexed join
+
+    :param name_pred_file: the path to the predictions csv file
+    :param subject_file: the path to the csv file with the participants' answers
+    :return: the prediction dataframe with the extra columns
+    """
+    prediction_model_df = pd.read_csv(f"{name_pred_file}.csv")
+    subj_df = pd.read_csv(subject_file).set_index(["Subject.id", "Trial"])[["Scenario", "Block"]]
+    return prediction_model_df.join(subj_df, on=["Subject.id", "Trial"])
+
+
+def get_stratum_masks(prediction_model_df, strata=STRATA):
+    """
+    Build one boolean mask over the answers for every stratum, plus one for all answers
+
+    :param prediction_model_df: see load_stratified_table
+    :param strata: dictionary of stratum name -> column name
+    :return: list of (stratum name, stratum value) pairs and the boolean array (strata x answers)
+    """
+    labels = [("All", "All")]
+    masks = [np.ones(len(prediction_model_df), dtype=bool)]
+    for stratum, column in strata.items():
+        for value in sorted(prediction_model_df[column].unique()):
+            labels.append((stratum, value))
+            masks.append((prediction_model_df[column] == value).to_numpy())
+    return labels, np.stack(masks)
+
+
+def compute_stratified_evidence(prediction_model_df, stratum_masks, penalty=PENALTY, epsilon=None):
+    """
+    Compute the evidence of all models for all participants in all strata at once. The answers are parsed once into
+    answer-level arrays, and the per-participant counts of every stratum are summed over these arrays in one pass. As
+    with a filtered prediction table, the random model only uses the answers in the same stratum.
+
+    :param prediction_model_df: see load_stratified_table
+    :param stratum_masks: boolean array (strata x answers), see get_stratum_masks
+    :param penalty: the penalty of the error model (see compute_likelihood)
+    :param epsilon: the shared error rate of the error model (if None, then it is estimated per participant-model pair)
+    :return: the participant ids, the model names, the log-likelihoods (strata x subjects x models, random model last)
+    and the number of answers of each participant in each stratum (strata x subjects)
+    """
+    model_names, model_codes, subj_codes = get_answer_codes(prediction_model_df)
+    matches = (model_codes == subj_codes[:, np.newaxis]).astype(float)
+    subjects, subj_idx = np.unique(prediction_model_df["Subject.id"], return_inverse=True)
+
+    # every answer counts once for each stratum it belongs to, in the group of its (stratum, participant) pair
+    n_strata, n_subjects = stratum_masks.shape[0], len(subjects)
+    stratum_idx, answer_idx = np.nonzero(stratum_masks)
+    group_idx = stratum_idx * n_subjects + subj_idx[answer_idx]
+    n_groups = n_strata * n_subjects
+    stratum_matches = sum_per_subject(matches[answer_idx], group_idx, n_groups).reshape(n_strata, n_subjects, -1)
+    trials = np.bincount(group_idx, minlength=n_groups).reshape(n_strata, n_subjects)
+    answer_counts = count_codes(subj_codes[answer_idx], group_idx, n_groups).reshape(n_strata, n_subjects, N_CODES)
+
+    # participants without answers in a stratum have an undefined error rate and coherence there; their evidence is
+    # ignored by the weights of RFX-BMS
+    with np.errstate(invalid="ignore"):
+        likelihoods = compute_likelihood(stratum_matches, trials[..., np.newaxis] - stratum_matches, penalty=penalty,
+                                         epsilon=epsilon)
+        likelihood_random, _ = compute_random_evidence(answer_counts, answer_counts.sum(axis=-2))
+    log_likelihoods = np.concatenate([likelihoods, likelihood_random[..., np.newaxis]], axis=-1)
+    return list(subjects), model_names + ["Random"], log_likelihoods, trials
+
+
+def stratified_model_comparison(name_pred_file="predictions_tom", name_stratified_file="stratified", strata=STRATA,
+                                penalty=PENALTY, epsilon=None, converge_diff=0.001):
+    """
+    Run the model comparison separately on every stratum of the data (level of ToM, scenario, block and correct or
+    incorrect answers) from the same prediction table, with RFX-BMS updated for all strata together. Participants
+    without answers in a stratum are left out of that stratum.
+
+    :param name_pred_file: the path to the predictions csv file
+    :param name_stratified_file: file path where the estimated frequencies per stratum will be saved
+    :param strata: dictionary of stratum name -> column name
+    :param penalty: the penalty of the error model
+    :param epsilon: the shared error rate of the error model (if None, then it is estimated per participant-model pair)
+    :param converge_diff: the convergence tolerance of RFX-BMS
+    :return: dataframe with one row per stratum and model
+    """
+    prediction_model_df = load_stratified_table(name_pred_file)
+    labels, stratum_masks = get_stratum_masks(prediction_model_df, strata=strata)
+    _, model_names, log_likelihoods, trials = compute_stratified_evidence(prediction_model_df, stratum_masks,
+                                                                          penalty=penalty, epsilon=epsilon)
+    alpha = compute_rfx_bms(log_likelihoods, converge_diff=converge_diff, weights=(trials > 0).astype(float))
+    frequencies = alpha / alpha.sum(axis=-1, keepdims=True)
+
+    n_models = len(model_names)
+    stratified_df = pd.DataFrame({"Stratum": np.repeat([stratum for stratum, _ in labels], n_models),
+                                  "Value": np.repeat([str(value) for _, value in labels], n_models),
+                                  "N.subjects": np.repeat((trials > 0).sum(axis=-1), n_models),
+                                  "N.answers": np.repeat(stratum_masks.sum(axis=-1), n_models),
+                                  "Model.name": np.tile(model_names, len(labels)),
+                                  "Estimated.frequency": frequencies.ravel()})
+    stratified_df.to_csv(f"{name_stratified_file}.csv", index=False)
+    return stratified_df
+
+
+if __name__ == "__main__":
+    df = stratified_model_comparison()
+    print(df.pivot_table(index=["Stratum", "Value", "N.subjects", "N.answers"], columns="Model.name",
+                         values="Estimated.frequency", sort=False).round(3).to_string())
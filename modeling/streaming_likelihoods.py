@@ -0,0 +1,151 @@
+import os
+import numpy as np
+import pandas as pd
+from puzzle_formalism import Puzzle
+from epistemic_model import EpistemicModel
+from fitting import PENALTY, get_model_configs, get_prediction_one_model, compute_likelihood, sum_per_subject, \
+    get_likelihood_df, compute_rfx_bms_beta
+from answer_codec import encode_answers, count_codes
+from chunks import CHUNK_SIZE, read_subject_chunks, get_peak_rss
+
+# the columns of the puzzle answers (see analysis/enrich.py) that the likelihoods are computed from
+STREAM_COLUMNS = ["Subject.id", "Index", "Level", "Translated.answer", "Is.correct"]
+# suffix of the binary file with the log-likelihood matrix (subjects x models, float64, in the row order of the
+# likelihoods file), which RFX-BMS reads block by block in every iteration
+MATRIX_SUFFIX = "_matrix.dat"
+# the puzzle answers of the synthetic population of analysis/streaming.py, and the real ones if it was not generated
+SYNTHETIC_PUZZLE_ANSWERS_FILE = "../analysis/synthetic answers_puzzles.csv"
+PUZZLE_ANSWERS_FILE = "../analysis/All answers_puzzles.csv"
+
+
+def get_level_codes(questions_df, max_pa_tom_level=3):
+    """
+    All puzzles are translated to the original birthday puzzle of their ToM level, so the predictions of the models
+    only depend on the level (see fitting.predict_answers): compute them once, as answer codes
+
+    :param questions_df: the question bank
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :return: the model names and the codes of the predictions (levels x models, the first row is level 1)
+    """
+    cb = Puzzle(list_players=["a", "b"], visibility=[[True, False], [False, True]])
+    model_configs = get_model_configs(max_pa_tom_level)
+    predictions = []
+    for level in range(1, questions_df["Level of ToM"].max() + 1):
+        temp_solver = EpistemicModel(1, max_pa_tom_level, level - 1, cb)
+        predictions.append([get_prediction_one_model(temp_solver, kwargs) for kwargs in model_configs.values()])
+    return list(model_configs), encode_answers(predictions)
+
+
+def get_chunk_arrays(puzzle_answers, model_names, level_codes, correct_codes):
+    """
+    Streaming version of fitting.get_subject_arrays: the same arrays, computed from a chunk of puzzle answers and the
+    predictions per level instead of from the predictions file
+
+    :param puzzle_answers: dataframe with the puzzle answers (see STREAM_COLUMNS) of complete participants
+    :param model_names: the names of the models, see get_level_codes
+    :param level_codes: the codes of the predictions per level, see get_level_codes
+    :param correct_codes: series of puzzle index -> code of the correct (translated) answer
+    :return: see fitting.get_subject_arrays
+    """
+    subjects, subj_idx = np.unique(puzzle_answers["Subject.id"], return_inverse=True)
+    n_subjects = len(subjects)
+    subj_codes = encode_answers(puzzle_answers["Translated.answer"])
+    model_codes = level_codes[puzzle_answers["Level"].to_numpy() - 1]
+    model_correct = model_codes == puzzle_answers["Index"].map(correct_codes).to_numpy()[:, np.newaxis]
+    trials = np.bincount(subj_idx, minlength=n_subjects)
+    return {"subjects": list(subjects),
+            "models": model_names,
+            "subject_accuracy": sum_per_subject(puzzle_answers["Is.correct"].to_numpy(dtype=float), subj_idx,
+                                                n_subjects) / trials,
+            "matches": sum_per_subject(model_codes == subj_codes[:, np.newaxis], subj_idx, n_subjects),
+            "trials": trials,
+            "model_accuracy": sum_per_subject(model_correct, subj_idx, n_subjects) / trials[:, np.newaxis],
+            "answer_counts": count_codes(subj_codes, subj_idx, n_subjects)}
+
+
+def count_population_answers(puzzle_answers_file, chunk_size=CHUNK_SIZE):
+    """
+    :param puzzle_answers_file: the path to the csv file with the puzzle answers
+    :param chunk_size: the number of rows read at once
+    :return: the number of occurrences of each answer code over all participants (the distribution of the random model)
+    """
+    population_counts = 0
+    for chunk in pd.read_csv(puzzle_answers_file, usecols=["Translated.answer"], chunksize=chunk_size):
+        population_counts = population_counts + count_codes(encode_answers(chunk["Translated.answer"]))
+    return population_counts
+
+
+def stream_log_likelihoods(puzzle_answers_file, name_likelihood_file="likelihoods_streamed", chunk_size=CHUNK_SIZE,
+                           penalty=PENALTY, epsilon=None, max_pa_tom_level=3):
+    """
+    Streaming version of fitting.generate_log_likelihoods, for puzzle answers that do not fit in memory: a first pass
+    counts the answers of the population (for the random model), a second pass computes the evidence of the
+    participants chunk by chunk and appends it to the likelihoods file. The multiple-solutions distributions of
+    fitting.compute_distribution_evidence are not supported.
+
+    :param puzzle_answers_file: the path to the csv file with the puzzle answers (see analysis/enrich.py); the rows of a
+    participant must be consecutive
+    :param name_likelihood_file: file path where the log-likelihoods will be saved (in the format of
+    fitting.generate_log_likelihoods), next to the log-likelihood matrix (see MATRIX_SUFFIX)
+    :param chunk_size: the number of rows read at once
+    :param penalty: the penalty of the error model (see fitting.compute_likelihood)
+    :param epsilon: the shared error rate of the error model; if None, then it is estimated for each participant-model
+    pair
+    :param max_pa_tom_level: the maximum possible level of ToM for public announcements
+    :return: the model names (with the random model last) and the number of participants
+    """
+    questions_df = pd.read_csv("../interface/question_bank.csv")
+    model_names, level_codes = get_level_codes(questions_df, max_pa_tom_level)
+    correct_codes = pd.Series(encode_answers(questions_df["Translated answer"]), index=questions_df["IDX"])
+    population_counts = count_population_answers(puzzle_answers_file, chunk_size)
+
+    n_subjects = 0
+    with open(f"{name_likelihood_file}{MATRIX_SUFFIX}", "wb") as matrix_file:
+        for idx, chunk in enumerate(read_subject_chunks(puzzle_answers_file, "Subject.id", chunk_size=chunk_size,
+                                                        usecols=STREAM_COLUMNS)):
+            arrays = get_chunk_arrays(chunk, model_names, level_codes, correct_codes)
+            trials = arrays["trials"][:, np.newaxis]
+            likelihoods = compute_likelihood(arrays["matches"], trials - arrays["matches"], penalty=penalty,
+                                             epsilon=epsilon)
+            likelihood_df = get_likelihood_df(arrays, likelihoods, arrays["matches"] / trials,
+                                              arrays["model_accuracy"], population_counts)
+            likelihood_df.to_csv(f"{name_likelihood_file}.csv", index=False, mode="w" if idx == 0 else "a",
+                                 header=idx == 0)
+            likelihood_df["Log-likelihood"].to_numpy(dtype=float).tofile(matrix_file)
+            n_subjects += len(arrays["subjects"])
+    return model_names + ["Random"], n_subjects
+
+
+def stream_model_frequencies(model_names, name_likelihood_file="likelihoods_streamed", chunk_size=CHUNK_SIZE,
+                             converge_diff=0.001):
+    """
+    Streaming version of fitting.get_model_frequencies: every iteration of RFX-BMS adds up beta over blocks of
+    participants (see fitting.compute_rfx_bms_beta), read from the log-likelihood matrix on disk
+
+    :param model_names: the model names, in the column order of the matrix (see stream_log_likelihoods)
+    :param name_likelihood_file: the path to the likelihoods file (without extension)
+    :param chunk_size: the number of participants per block
+    :param converge_diff: see fitting.compute_rfx_bms
+    :return: dictionary of model name -> estimated frequency, sorted by model name
+    """
+    log_likelihoods = np.memmap(f"{name_likelihood_file}{MATRIX_SUFFIX}", dtype=float, mode="r") \
+        .reshape(-1, len(model_names))
+    a0 = np.ones(len(model_names))
+    a = a0
+    while True:
+        prev = a
+        a = a0 + sum(compute_rfx_bms_beta(log_likelihoods[start:start + chunk_size], a)
+                     for start in range(0, len(log_likelihoods), chunk_size))
+        if np.all(np.abs(a - prev) <= converge_diff):
+            break
+    # Normalize final alpha so elements sum to 1
+    return dict(sorted({model_name: round(a[k] / a.sum(), 3) for k, model_name in enumerate(model_names)}.items()))
+
+
+if __name__ == "__main__":
+    answers_file = SYNTHETIC_PUZZLE_ANSWERS_FILE if os.path.exists(SYNTHETIC_PUZZLE_ANSWERS_FILE) \
+        else PUZZLE_ANSWERS_FILE
+    names, subject_count = stream_log_likelihoods(answers_file)
+    print(f"Log-likelihoods of {subject_count} participants from {answers_file}")
+    print("Model frequencies:", stream_model_frequencies(names))
+    print(f"Peak resident memory: {get_peak_rss():.0f} MB with chunks of {CHUNK_SIZE} rows")
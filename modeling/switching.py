@@ -0,0 +1,316 @@
+import numpy as np
+import pandas as pd
+from fitting import PENALTY, get_trial_arrays, compute_trial_likelihoods
+from recovery import load_recovery_data, simulate_answers
+from stratified import load_stratified_table
+
+# number of trials per block of the synthetic participants (the blocks of the participants are read from the Block
+# column of their answers, see stratified.load_stratified_table)
+BLOCK_SIZE = 4
+# initial probability of staying with the same model between two trials
+INIT_STAY = 0.8
+# extra concentration of the Dirichlet prior on the diagonal of the transition matrices: with only a few trials per
+# participant, a flat prior lets Baum-Welch explain the answers with deterministic cycles between models
+STICKINESS = 10.0
+# initial value of the error rate, if it is estimated by Baum-Welch
+INIT_EPSILON = 0.25
+# seed of the synthetic sequences
+SEED = 42
+
+
+def logsumexp(x, axis):
+    """
+    Numerically stable log(sum(exp(x))) along one axis; a lighter version of scipy.special.logsumexp for the small
+    arrays inside the forward-backward loops
+
+    :param x: the array
+    :param axis: the axis to sum over
+    :return: the array without that axis
+    """
+    x_max = x.max(axis=axis, keepdims=True)
+    x_max = np.where(np.isfinite(x_max), x_max, 0)
+    with np.errstate(divide="ignore"):
+        return np.squeeze(x_max, axis=axis) + np.log(np.exp(x - x_max).sum(axis=axis))
+
+
+def get_block_starts(blocks):
+    """
+    Find the trials at which a new block starts (the first trial and the padding are not counted)
+
+    :param blocks: array (subjects x trials) with the block of each trial (0 for padding), see get_trial_arrays
+    :return: boolean array (subjects x trials)
+    """
+    block_starts = np.zeros(blocks.shape, dtype=bool)
+    block_starts[:, 1:] = (blocks[:, 1:] != blocks[:, :-1]) & (blocks[:, 1:] > 0)
+    return block_starts
+
+
+def get_block_posteriors(posteriors, blocks):
+    """
+    Average the posterior model probabilities of forward-backward over the trials of each block, i.e. the expected
+    share of the trials of the block answered with each model
+
+    :param posteriors: array (subjects x trials x models), see fit_switching_model
+    :param blocks: array (subjects x trials) with the block of each trial (numbered from 1, 0 for padding)
+    :return: array (subjects x blocks x models); all zeros for the blocks in which a participant has no trial
+    """
+    block_posteriors = []
+    for block in range(1, blocks.max() + 1):
+        in_block = blocks == block
+        block_posteriors.append((posteriors * in_block[..., np.newaxis]).sum(axis=1)
+                                / np.maximum(in_block.sum(axis=1), 1)[:, np.newaxis])
+    return np.stack(block_posteriors, axis=1)
+
+
+def get_block_switches(block_posteriors):
+    """
+    Find the dominant model of every block and whether it changes between the first two blocks
+
+    :param block_posteriors: see get_block_posteriors
+    :return: array (subjects x blocks) with the index of the dominant model (-1 for the blocks without trials) and
+    boolean array (subjects), True for the participants whose dominant model differs between the two blocks
+    """
+    dominant = np.where(block_posteriors.sum(axis=-1) > 0, block_posteriors.argmax(axis=-1), -1)
+    return dominant, (dominant[:, 0] >= 0) & (dominant[:, 1] >= 0) & (dominant[:, 0] != dominant[:, 1])
+
+
+def init_transitions(n_models, stay=INIT_STAY):
+    """
+    Transition matrix that stays with the same model with probability stay and switches uniformly otherwise
+
+    :param n_models: the number of models (hidden states)
+    :param stay: the probability of staying with the same model
+    :return: array (models x models), rows are the current model and columns the next model
+    """
+    switch = (1 - stay) / (n_models - 1)
+    return np.full((n_models, n_models), switch) + np.eye(n_models) * (stay - switch)
+
+
+def forward_backward(log_emissions, log_initial, log_transitions, block_starts):
+    """
+    Batched forward-backward algorithm in log space over all participants
+
+    :param log_emissions: array (subjects x trials x models) with the log-likelihood of each answer under each model
+    (0 for padding)
+    :param log_initial: array (models) with the log-probability of each model at the first trial
+    :param log_transitions: array (2 x models x models) with the log-transition matrices within a block (index 0) and
+    between blocks (index 1)
+    :param block_starts: boolean array (subjects x trials), True at the trials that start a new block
+    :return: the log forward and backward variables (subjects x trials x models) and the log-likelihood per subject
+    """
+    n_trials = log_emissions.shape[1]
+    log_alpha = np.empty_like(log_emissions)
+    log_beta = np.zeros_like(log_emissions)
+
+    log_alpha[:, 0] = log_initial + log_emissions[:, 0]
+    for t in range(1, n_trials):
+        # transition matrix of every participant (subjects x models x models)
+        log_a = log_transitions[block_starts[:, t].astype(int)]
+        log_alpha[:, t] = logsumexp(log_alpha[:, t - 1, :, np.newaxis] + log_a, axis=1) + log_emissions[:, t]
+    for t in range(n_trials - 2, -1, -1):
+        log_a = log_transitions[block_starts[:, t + 1].astype(int)]
+        log_beta[:, t] = logsumexp(log_a + (log_emissions[:, t + 1] + log_beta[:, t + 1])[:, np.newaxis, :], axis=2)
+    return log_alpha, log_beta, logsumexp(log_alpha[:, -1], axis=-1)
+
+
+def get_log_emissions(matches, random_probs, mask, penalty, epsilon):
+    """
+    Compute the log-likelihood of every answer under every model; padded trials are uninformative, i.e. their
+    emission probability is 1 for every model
+
+    :param matches: see get_trial_arrays
+    :param random_probs: see get_trial_arrays
+    :param mask: see get_trial_arrays
+    :param penalty: the penalty of the error model
+    :param epsilon: the error rate of the error model
+    :return: array (subjects x trials x models)
+    """
+    with np.errstate(divide="ignore"):
+        log_likelihoods = np.log(compute_trial_likelihoods(matches, random_probs, penalty=penalty, epsilon=epsilon))
+    return np.where(mask[..., np.newaxis], log_likelihoods, 0)
+
+
+def fit_switching_model(matches, random_probs, mask, blocks, penalty=PENALTY, epsilon=None, prior=1.0,
+                        stickiness=STICKINESS, converge_diff=1e-6, max_iter=500):
+    """
+    Fit a hidden Markov model over trials, with the models as hidden states and the error model of
+    compute_trial_likelihoods as emissions. The initial distribution and the transition matrices (one within blocks,
+    one between blocks) are shared by all participants and estimated with Baum-Welch.
+
+    :param matches: boolean array (subjects x trials x non-random models), see get_trial_arrays
+    :param random_probs: array (subjects x trials) with the probability of each answer under the random model
+    :param mask: boolean array (subjects x trials), False for padding (only at the end of a sequence)
+    :param blocks: array (subjects x trials) with the block of each trial (0 for padding), see get_trial_arrays
+    :param penalty: the penalty of the error model
+    :param epsilon: the error rate of the error model; if None, then it is estimated as well
+    :param prior: concentration of the symmetric Dirichlet prior on the rows of the transition matrices and on the
+    initial distribution, at least 1 (1 means maximum likelihood)
+    :param stickiness: concentration added to the prior on the diagonal of the transition matrices, i.e. pseudo-counts
+    of staying with the same model (0 means a symmetric prior)
+    :param converge_diff: stop iterating when the log-likelihood improves by this value or less
+    :param max_iter: the maximum number of Baum-Welch iterations
+    :return: dictionary with the "initial" distribution, the "transitions" (within, between blocks), the error rate
+    "epsilon", the posterior model probabilities "posteriors" (subjects x trials x models) and the "log-likelihood"
+    """
+    if prior < 1 or stickiness < 0:
+        raise ValueError("The prior concentration must be at least 1 and the stickiness non-negative")
+    n_models = matches.shape[-1] + 1
+    block_starts = get_block_starts(blocks)
+    # pseudo-counts of the prior on every row of the transition matrices
+    transition_prior = prior - 1 + stickiness * np.eye(n_models)
+    initial = np.full(n_models, 1 / n_models)
+    transitions = np.stack([init_transitions(n_models)] * 2)
+    eps = INIT_EPSILON if epsilon is None else epsilon
+    prev_likelihood = -np.inf
+
+    for _ in range(max_iter):
+        log_emissions = get_log_emissions(matches, random_probs, mask, penalty, eps)
+        with np.errstate(divide="ignore"):
+            log_transitions = np.log(transitions)
+            log_initial = np.log(initial)
+        log_alpha, log_beta, subj_likelihood = forward_backward(log_emissions, log_initial, log_transitions,
+                                                                block_starts)
+        likelihood = subj_likelihood.sum()
+        posteriors = np.exp(log_alpha + log_beta - subj_likelihood[:, np.newaxis, np.newaxis])
+
+        # expected number of transitions between all consecutive trials at once, summed over participants and over
+        # the trials within (index 0) and between (index 1) blocks; padded trials do not count
+        log_xi = log_alpha[:, :-1, :, np.newaxis] + log_transitions[block_starts[:, 1:].astype(int)] \
+            + (log_emissions[:, 1:] + log_beta[:, 1:])[:, :, np.newaxis, :] \
+            - subj_likelihood[:, np.newaxis, np.newaxis, np.newaxis]
+        xi = np.exp(log_xi) * mask[:, 1:, np.newaxis, np.newaxis]
+        transition_counts = np.stack([xi[~block_starts[:, 1:]].sum(axis=0), xi[block_starts[:, 1:]].sum(axis=0)])
+
+        # M-step (rows without any expected transition or pseudo-count keep their previous values)
+        initial = (posteriors[:, 0].sum(axis=0) + prior - 1) / (mask.shape[0] + n_models * (prior - 1))
+        row_sums = transition_counts.sum(axis=-1, keepdims=True) + transition_prior.sum(axis=-1, keepdims=True)
+        transitions = np.where(row_sums > 0,
+                               (transition_counts + transition_prior) / np.where(row_sums > 0, row_sums, 1),
+                               transitions)
+        if epsilon is None:
+            non_random = posteriors[..., :-1] * mask[..., np.newaxis]
+            eps = (non_random * ~matches).sum() / non_random.sum()
+
+        if likelihood - prev_likelihood <= converge_diff:
+            break
+        prev_likelihood = likelihood
+
+    return {"initial": initial, "transitions": transitions, "epsilon": eps, "posteriors": posteriors,
+            "log-likelihood": likelihood}
+
+
+def viterbi(log_emissions, log_initial, log_transitions, block_starts):
+    """
+    Batched Viterbi decoding of the most likely sequence of models for every participant
+
+    :param log_emissions: see forward_backward
+    :param log_initial: see forward_backward
+    :param log_transitions: see forward_backward
+    :param block_starts: see forward_backward
+    :return: array (subjects x trials) with the index of the decoded model at each trial
+    """
+    n_subjects, n_trials, n_models = log_emissions.shape
+    delta = log_initial + log_emissions[:, 0]
+    backpointers = np.zeros((n_subjects, n_trials, n_models), dtype=int)
+    for t in range(1, n_trials):
+        scores = delta[:, :, np.newaxis] + log_transitions[block_starts[:, t].astype(int)]
+        backpointers[:, t] = scores.argmax(axis=1)
+        delta = scores.max(axis=1) + log_emissions[:, t]
+
+    path = np.zeros((n_subjects, n_trials), dtype=int)
+    path[:, -1] = delta.argmax(axis=-1)
+    for t in range(n_trials - 1, 0, -1):
+        path[:, t - 1] = np.take_along_axis(backpointers[:, t], path[:, t, np.newaxis], axis=-1)[:, 0]
+    return path
+
+
+def strategy_switching(name_pred_file="predictions_tom", name_switching_file="switching", penalty=PENALTY,
+                       epsilon=None, prior=1.0, stickiness=STICKINESS):
+    """
+    Fit the strategy-switching model on the participants' data, decode the most likely model at each trial and save,
+    for every participant, the decoded models, the dominant model of each block and whether the participant switched
+    model between the two blocks
+
+    :param name_pred_file: the path to the predictions csv file
+    :param name_switching_file: file path where the decoded models will be saved
+    :param penalty: the penalty of the error model
+    :param epsilon: the error rate of the error model (if None, then it is estimated)
+    :param prior: concentration of the Dirichlet prior on the initial distribution and the transition matrices
+    :param stickiness: extra concentration of the prior on the diagonal of the transition matrices
+    :return: the fitted parameters (see fit_switching_model) and the dataframe with the decoded models
+    """
+    arrays = get_trial_arrays(load_stratified_table(name_pred_file))
+    mask, blocks = arrays["mask"], arrays["block"]
+    fit = fit_switching_model(arrays["matches"], arrays["random_probs"], mask, blocks, penalty=penalty,
+                              epsilon=epsilon, prior=prior, stickiness=stickiness)
+
+    log_emissions = get_log_emissions(arrays["matches"], arrays["random_probs"], mask, penalty, fit["epsilon"])
+    with np.errstate(divide="ignore"):
+        path = viterbi(log_emissions, np.log(fit["initial"]), np.log(fit["transitions"]), get_block_starts(blocks))
+
+    model_names = np.array(arrays["models"] + ["Random"])
+    switching_df = pd.DataFrame(np.where(mask, model_names[path], ""),
+                                columns=[f"Trial.{t + 1}" for t in range(mask.shape[1])])
+    switching_df.insert(0, "Subject.id", arrays["subjects"])
+    # a participant switches if the model with the largest posterior probability over the trials of the first block is
+    # not the one of the second block
+    dominant, switches = get_block_switches(get_block_posteriors(fit["posteriors"], blocks))
+    for block in range(dominant.shape[1]):
+        switching_df[f"Model.block.{block + 1}"] = np.where(dominant[:, block] >= 0, model_names[dominant[:, block]], "")
+    switching_df["Switches.between.blocks"] = switches
+    switching_df.to_csv(f"{name_switching_file}.csv", index=False)
+    return fit, switching_df
+
+
+def simulate_switching(n_subjects, n_trials, initial, transitions, epsilon, name_pred_file="predictions_tom",
+                       seed=SEED, block_size=BLOCK_SIZE, levels=None):
+    """
+    Simulate synthetic participants that switch between models according to a hidden Markov model, e.g. to test that
+    fit_switching_model recovers the transition matrices on very long sequences
+
+    :param n_subjects: the number of synthetic participants
+    :param n_trials: the number of trials per participant
+    :param initial: the probability of each model at the first trial
+    :param transitions: the transition matrices within (index 0) and between (index 1) blocks
+    :param epsilon: the error rate of all participants
+    :param name_pred_file: the path to the predictions csv file (its cached predictions are reused)
+    :param seed: the seed of the random generator
+    :param block_size: the number of trials per block
+    :param levels: the ToM level of each trial, e.g. recovery.TRIAL_LEVELS (if None, then drawn uniformly for every
+    trial of every participant)
+    :return: the matches, random-model probabilities, mask and blocks (see get_trial_arrays) and the true models
+    """
+    rng = np.random.default_rng(seed)
+    data = load_recovery_data(name_pred_file)
+    blocks = np.tile(1 + np.arange(n_trials) // block_size, (n_subjects, 1))
+    block_starts = get_block_starts(blocks)
+
+    true_models = np.zeros((n_subjects, n_trials), dtype=int)
+    true_models[:, 0] = rng.choice(len(initial), size=n_subjects, p=initial)
+    cumulative = np.cumsum(transitions, axis=-1)
+    for t in range(1, n_trials):
+        rows = cumulative[block_starts[:, t].astype(int), true_models[:, t - 1]]
+        true_models[:, t] = np.minimum((rng.random((n_subjects, 1)) > rows).sum(axis=-1), len(initial) - 1)
+
+    levels = rng.integers(1, 5, size=(n_subjects, n_trials)) if levels is None \
+        else np.broadcast_to(levels, (n_subjects, n_trials))
+    answers = simulate_answers(rng, true_models, epsilon, data, levels=levels)
+    matches = answers[..., np.newaxis] == np.moveaxis(data["predictions"][:, levels - 1], 0, -1)
+    return matches, data["population"][answers], np.ones((n_subjects, n_trials), dtype=bool), blocks, true_models
+
+
+if __name__ == "__main__":
+    fit, df = strategy_switching()
+    print(f"epsilon = {fit['epsilon']:.3f}, log-likelihood = {fit['log-likelihood']:.3f}")
+    print("transitions within blocks:\n", fit["transitions"][0].round(3))
+    print("transitions between blocks:\n", fit["transitions"][1].round(3))
+    print(f"participants switching model between blocks: {df['Switches.between.blocks'].sum()} out of {len(df)}")
+    print(pd.crosstab(df["Model.block.1"], df["Model.block.2"]))
+
+    # check that the transition matrices are recovered from long synthetic sequences (without the sticky prior, which
+    # is only needed for short sequences)
+    true_transitions = np.stack([init_transitions(5, 0.95), init_transitions(5, 0.5)])
+    matches, random_probs, mask, blocks, _ = simulate_switching(10, 2_000, np.full(5, 0.2), true_transitions, 0.1)
+    synthetic_fit = fit_switching_model(matches, random_probs, mask, blocks, stickiness=0, converge_diff=1e-3)
+    print("synthetic: max. absolute error of the transition matrices:",
+          np.abs(synthetic_fit["transitions"] - true_transitions).max().round(3))
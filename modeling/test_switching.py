@@ -0,0 +1,30 @@
+import numpy as np
+from recovery import TRIAL_LEVELS
+from switching import init_transitions, fit_switching_model, get_block_posteriors, get_block_switches, \
+    simulate_switching
+
+# indices of the models of recovery.load_recovery_data
+EPISTEMIC, CUT_1_LR = 0, 1
+
+
+def test_recovers_cutting_to_epistemic_switch():
+    # half of the participants start with cutting and all use the epistemic model in the second block: the switch is
+    # planted in the transitions between blocks, the models do not change within a block; every block has one puzzle
+    # of each ToM level, as in the experiment
+    initial = np.zeros(5)
+    initial[[EPISTEMIC, CUT_1_LR]] = 0.5
+    between = np.eye(5)
+    between[CUT_1_LR] = np.eye(5)[EPISTEMIC]
+    matches, random_probs, mask, blocks, true_models = simulate_switching(
+        200, len(TRIAL_LEVELS), initial, np.stack([np.eye(5), between]), 0.05, levels=TRIAL_LEVELS)
+    fit = fit_switching_model(matches, random_probs, mask, blocks)
+    dominant, switches = get_block_switches(get_block_posteriors(fit["posteriors"], blocks))
+
+    planted = true_models[:, 0] == CUT_1_LR
+    assert np.all(true_models[:, -1] == EPISTEMIC)
+    assert np.mean(switches == planted) >= 0.9
+    assert np.mean(dominant[planted, 0] == CUT_1_LR) >= 0.9
+    assert np.mean(dominant[:, 1] == EPISTEMIC) >= 0.9
+    # the switch is attributed to the transitions between blocks
+    assert fit["transitions"][1, CUT_1_LR, EPISTEMIC] > 0.5
+    assert fit["transitions"][0, CUT_1_LR, EPISTEMIC] < 0.1
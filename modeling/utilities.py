@@ -1,14 +1,10 @@
 from enum import Enum
-import matplotlib.pyplot as plt
-import networkx as nx
-from collections import Counter
-import pandas as pd
-from statistics import mean, median
-import numpy as np
-import matplotlib
+import os
+from functools import lru_cache
+from plot_cache import memoize
 
-matplotlib.use('TkAgg')
-matplotlib.rc('font', size=12)
+# NOTE: the solver only needs Month and format_text_states from this file, so matplotlib, networkx, numpy and pandas are
+# imported by the functions that use them
 
 
 class Month(Enum):
@@ -38,24 +34,64 @@ def get_common_ratio(model_answers, subj_answers):
     :param subj_answers: list of answers given by the participants
     :return: percentage of explained data
     """
-    # for consistency across answers, replace all occurrences of "Sept" with "September"
-    model_answers = [date.replace("Sept", "September") for date in model_answers]
-    model_dict = dict(Counter(model_answers))
-    subj_dict = dict(Counter(subj_answers))
-    # keep track of the common answers
-    common_keys = list(set(model_dict.keys()).intersection(subj_dict.keys()))
-    # count how many occurrences of the common answers exist
-    common_values = sum([min(model_dict[key], subj_dict[key]) for key in common_keys])
-    return common_values * 100 / len(subj_answers)
+    from answer_codec import encode_answers, count_codes
+    from metrics import compute_explained_data
+
+    # the answer codes also make the naming of September consistent; for many models, levels or subsets at once, use
+    # metrics.explained_data_table
+    return compute_explained_data(count_codes(encode_answers(model_answers)), count_codes(encode_answers(subj_answers)))
+
+
+@lru_cache(maxsize=None)
+def get_pyplot():
+    """
+    Import and configure matplotlib the first time a figure is drawn
+    :return: the matplotlib.pyplot module
+    """
+    import matplotlib
+    # render without a display by default; set MPLBACKEND (e.g. to TkAgg) to open figures in a window
+    matplotlib.use(os.environ.get("MPLBACKEND", "Agg"))
+    matplotlib.rc('font', size=12)
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def render_figure(function_name, args, kwargs):
+    """
+    Render one figure from its precomputed data
+    :param function_name: the name of the plotting function in this file
+    :param args: the positional arguments of the plotting function
+    :param kwargs: the keyword arguments of the plotting function (including the save file)
+    """
+    save_file = kwargs.get("title_save_file", kwargs.get("save_file"))
+    if save_file and os.path.dirname(save_file):
+        os.makedirs(os.path.dirname(save_file), exist_ok=True)
+    globals()[function_name](*args, **kwargs)
+    get_pyplot().close("all")
+
+
+def render_figures(figures):
+    """
+    Render a list of figures, see render_figure
+    :param figures: list of (plotting function name, arguments, keyword arguments)
+    """
+    for function_name, args, kwargs in figures:
+        render_figure(function_name, args, kwargs)
 
 
 def draw_model(graph, save_file=None):
     """
     Draws a graph and possibly saves to file
 
-    :param graph: the graph to be drawn
+    :param graph: the graph to be drawn (a solver.KripkeGraph or a networkx graph)
     :param save_file: the path to save the file
     """
+    import networkx as nx
+    plt = get_pyplot()
+    # the solvers' graphs are converted to networkx for drawing
+    if not isinstance(graph, nx.Graph):
+        graph = graph.to_networkx()
+
     # define figure size
     fgsz = 7
 
@@ -95,7 +131,7 @@ def draw_model(graph, save_file=None):
 
 
 def plot_bar(data, title_plot, x_label, y_label, y_range, x_range, title_save_file=None, chance_x=None, chance_y=None,
-             rotation_x=90, rotation_y=0, bar_width=0.8):
+             rotation_x=90, rotation_y=0, bar_width=0.8, y_err=None):
     """
     Generate simple bar plot
     :param data: data in dictionary format
@@ -110,12 +146,13 @@ def plot_bar(data, title_plot, x_label, y_label, y_range, x_range, title_save_fi
     :param rotation_x: degree of rotation of the labels on the x axis
     :param rotation_y: degree of rotation of the labels on the y-axis
     :param bar_width: width of the bars in the bar plot
+    :param y_err: optional error bars, as accepted by matplotlib (e.g. lower and upper distances to the bar values)
     """
-    plt.cla()
+    plt = get_pyplot()
     figure, ax = plt.subplots(nrows=1,
                               ncols=1,
                               figsize=(5, 7))
-    ax.bar(list(data.keys()), list(data.values()), edgecolor='black', width=bar_width)
+    ax.bar(list(data.keys()), list(data.values()), edgecolor='black', width=bar_width, yerr=y_err, capsize=4)
     ax.set_xlabel(x_label)
     ax.tick_params(axis='x', rotation=rotation_x)
     ax.tick_params(axis='y', rotation=rotation_y)
@@ -131,21 +168,25 @@ def plot_bar(data, title_plot, x_label, y_label, y_range, x_range, title_save_fi
     figure.tight_layout()
     if title_save_file:
         figure.savefig(f"{title_save_file}.png", bbox_inches='tight')
+        # close the saved figure, otherwise every call leaves one more figure open
+        plt.close(figure)
     else:
         figure.show()
 
 
-def plot_coherence(name_correct_rates_file, best_model, title_save_file):
+def get_coherence_rates(name_correct_rates_file, best_model):
     """
-    Plot coherence for
-        i) all non-random models
-        ii) model with best fit according to RFX_BMS
-    and add jittered red-crosses to stand for participants associated with only the random model
+    Split the coherence values of the participants into
+        i) the participants associated with only the random model
+        ii) the participants associated with a non-random model
+        iii) the participants associated with the model with best fit according to RFX_BMS
 
     :param name_correct_rates_file: path to the correct rates csv file
     :param best_model: name of the model with best fit according to RFX_BMS
-    :param title_save_file: path to save the coherence plots
+    :return: the three lists of coherence values
     """
+    import pandas as pd
+
     # read in the correct rates
     df_correct_rates = pd.read_csv(f"{name_correct_rates_file}.csv")
 
@@ -163,19 +204,53 @@ def plot_coherence(name_correct_rates_file, best_model, title_save_file):
                 best_model_rates.append(eval(df_correct_rates[subj][1]))
             # in all other cases, save in non-random_rates
             non_random_rates.append(eval(df_correct_rates[subj][1]))
+    return rand_rates, non_random_rates, best_model_rates
+
+
+def get_coherence_figures(name_correct_rates_file, best_model, title_save_file):
+    """
+    Coherence plots for
+        i) all non-random models
+        ii) model with best fit according to RFX_BMS
+    with jittered red-crosses to stand for participants associated with only the random model
+
+    :param name_correct_rates_file: path to the correct rates csv file
+    :param best_model: name of the model with best fit according to RFX_BMS
+    :param title_save_file: path to save the coherence plots
+    :return: list of figures, as (plotting function, arguments, keyword arguments) (see render_figure)
+    """
+    # the coherence values are only computed again if the correct rates change (see plot_cache.py)
+    rand_rates, non_random_rates, best_model_rates = memoize(get_coherence_rates, name_correct_rates_file, best_model,
+                                                             input_files=[f"{name_correct_rates_file}.csv"])
 
     # plot coherence for random as the best model
     if best_model == "Random":
-        plot_violin(rand_rates, None, "Coherence", "Density", (-0.1, 1.1), (-1, 1),
-                    "Coherence distribution for the random model", f"{title_save_file}_best")
+        figures = [("plot_violin", (rand_rates, None, "Coherence", "Density", (-0.1, 1.1), (-1, 1),
+                                    "Coherence distribution for the random model"),
+                    dict(title_save_file=f"{title_save_file}_best"))]
     # plot coherence for a non-random best model
     else:
-        plot_violin(best_model_rates, rand_rates, "Coherence", "Density", (-0.1, 1.1), (-1, 1),
-                    "Coherence distribution for best non-random model", f"{title_save_file}_best")
+        figures = [("plot_violin", (best_model_rates, rand_rates, "Coherence", "Density", (-0.1, 1.1), (-1, 1),
+                                    "Coherence distribution for best non-random model"),
+                    dict(title_save_file=f"{title_save_file}_best"))]
 
     # plot coherence for all non-random models
-    plot_violin(non_random_rates, rand_rates, "Coherence", "Density", (-0.1, 1.1), (-1, 1),
-                "Coherence distribution for the non-random models", f"{title_save_file}")
+    figures.append(("plot_violin", (non_random_rates, rand_rates, "Coherence", "Density", (-0.1, 1.1), (-1, 1),
+                                    "Coherence distribution for the non-random models"),
+                    dict(title_save_file=f"{title_save_file}")))
+    return figures
+
+
+def plot_coherence(name_correct_rates_file, best_model, title_save_file):
+    """
+    Plot coherence for all non-random models and for the model with best fit according to RFX_BMS (see
+    get_coherence_figures)
+
+    :param name_correct_rates_file: path to the correct rates csv file
+    :param best_model: name of the model with best fit according to RFX_BMS
+    :param title_save_file: path to save the coherence plots
+    """
+    render_figures(get_coherence_figures(name_correct_rates_file, best_model, title_save_file))
 
 
 def plot_violin(list_data, list_rand, x_label, y_label, x_range, y_range, title_plot, title_save_file):
@@ -190,7 +265,9 @@ def plot_violin(list_data, list_rand, x_label, y_label, x_range, y_range, title_
     :param title_plot: the title of the plot
     :param title_save_file: the name of the save file
     """
-    plt.cla()
+    import numpy as np
+    plt = get_pyplot()
+
     figure, ax = plt.subplots(nrows=1,
                               ncols=1,
                               figsize=(5, 7))
@@ -209,6 +286,47 @@ def plot_violin(list_data, list_rand, x_label, y_label, x_range, y_range, title_
     ax.set_xlim([x_range[0], x_range[1]])
     ax.set_ylim([y_range[0], y_range[1]])
     figure.savefig(f"{title_save_file}.png", bbox_inches='tight')
+    plt.close(figure)
+
+
+def plot_heatmap(data, title_plot, x_label, y_label, title_save_file=None, color_label=None, v_range=None):
+    """
+    Generate heatmap with the values written in the cells
+    :param data: data in dataframe format; the index is shown on the y-axis and the columns on the x-axis
+    :param title_plot: the title of the plot
+    :param x_label: the label for the x-axis
+    :param y_label: the label for the y-axis
+    :param title_save_file: the name of the save file
+    :param color_label: the label of the color bar
+    :param v_range: range of values covered by the colormap (if None, then symmetric around 0)
+    """
+    import numpy as np
+    plt = get_pyplot()
+
+    figure, ax = plt.subplots(nrows=1,
+                              ncols=1,
+                              figsize=(2 + 1.2 * data.shape[1], 1 + 0.35 * data.shape[0]))
+    if v_range is None:
+        v_max = max(np.nanmax(np.abs(data.to_numpy())), 1e-3)
+        v_range = (-v_max, v_max)
+    image = ax.imshow(data.to_numpy(), cmap="coolwarm", vmin=v_range[0], vmax=v_range[1], aspect="auto")
+    for (row, col), value in np.ndenumerate(data.to_numpy()):
+        # missing values (e.g. models left out of a configuration) are left blank
+        if not np.isnan(value):
+            ax.text(col, row, f"{value:.2f}", ha="center", va="center", fontsize=8)
+    figure.colorbar(image, ax=ax, label=color_label)
+    ax.set_xticks(range(data.shape[1]), list(data.columns), rotation=45, ha="right")
+    ax.set_yticks(range(data.shape[0]), [str(idx) for idx in data.index])
+    ax.set_xlabel(x_label)
+    ax.set_ylabel(y_label)
+    ax.set_title(title_plot)
+    figure.tight_layout()
+    if title_save_file:
+        figure.savefig(f"{title_save_file}.png", bbox_inches='tight')
+        # close the saved figure, otherwise every call leaves one more figure open
+        plt.close(figure)
+    else:
+        figure.show()
 
 
 if __name__ == "__main__":